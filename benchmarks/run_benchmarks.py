@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Micro and macro benchmarks of the growing pipeline, run on synthetic receptors, ligands and PELE outputs (see
+synthetic.py). The results are written as JSON, so runs can be compared over time, and a previous result can be used
+as baseline to check for regressions (the script exits with 1 if any benchmark is slower than the baseline by more
+than the threshold).
+
+e.g.
+
+    python benchmarks/run_benchmarks.py -o baseline.json
+    python benchmarks/run_benchmarks.py -o current.json --compare baseline.json --threshold 0.2
+    python benchmarks/run_benchmarks.py --scale full -k "analyser*"
+
+The benchmarks whose dependencies are not installed (ProDy, AdaptivePELE, mdtraj, Schrodinger...) are reported as
+skipped.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import platform
+import argparse
+import tempfile
+import datetime
+import subprocess
+import contextlib
+import numpy as np
+# Local imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+from frag_pele.Helpers import folder_handler
+
+SCALES = {"small": {"receptor_atoms": [1000], "ligand_atoms": [20], "trajectories": [64], "steps": 8},
+          "full": {"receptor_atoms": [1000, 10000, 50000], "ligand_atoms": [20, 50, 200],
+                   "trajectories": [64, 256, 1024], "steps": 8}}
+# Receptor and ligand used by the synthetic PELE outputs, whatever the scale
+SAMPLING_RECEPTOR_ATOMS = 1000
+SAMPLING_LIGAND_ATOMS = 20
+FRAGMENT_ATOMS = 8
+OVERLAPPING_PDBS = 10
+BEST_STRUCTURES = 10
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_NOISE = 0.001
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmarks of the growing pipeline on synthetic data.")
+    parser.add_argument("-s", "--scale", choices=sorted(SCALES), default="small",
+                        help="Sizes of the synthetic systems: 'small' for a quick run, 'full' for 1k/10k/50k-atom "
+                             "receptors, 20-200 atom ligands and 64-1024 trajectories.")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of times each benchmark is timed (the median is reported).")
+    parser.add_argument("-k", "--select", default="*",
+                        help="Pattern (fnmatch) of the names of the benchmarks to run.")
+    parser.add_argument("-o", "--output", default="benchmark_results.json",
+                        help="JSON file where the results are written.")
+    parser.add_argument("-c", "--compare", default=None,
+                        help="JSON file of a previous run used as baseline to check for regressions.")
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown (0.25 = 25%%) over the baseline considered a regression.")
+    parser.add_argument("--noise", type=float, default=DEFAULT_NOISE,
+                        help="Slowdowns smaller than this number of seconds are never considered regressions.")
+    parser.add_argument("-w", "--workdir", default=None,
+                        help="Folder where the synthetic data is written. By default a temporary folder, removed at "
+                             "the end.")
+    args = parser.parse_args()
+    return args.scale, args.repeats, args.select, args.output, args.compare, args.threshold, args.noise, \
+           args.workdir
+
+
+class Skip(Exception):
+    """
+    Raised by the set-up of a benchmark that can not run in this environment.
+    """
+    pass
+
+
+@contextlib.contextmanager
+def requires(*modules):
+    """
+    Turn the ImportErrors of the modules needed by a benchmark into a Skip.
+    """
+    try:
+        yield
+    except ImportError as e:
+        raise Skip("missing dependency ({}): {}".format(", ".join(modules), e))
+
+
+class SyntheticData(object):
+    """
+    Lazy cache of the synthetic inputs, so each one is generated once and shared by all the benchmarks that use it.
+    """
+
+    def __init__(self, folder, steps):
+        self.folder = folder
+        self.steps = steps
+        self._cache = {}
+
+    def _get(self, key, builder):
+        if key not in self._cache:
+            self._cache[key] = builder()
+        return self._cache[key]
+
+    def complex(self, receptor_atoms, ligand_atoms):
+        path = os.path.join(self.folder, "complex_{}_{}.pdb".format(receptor_atoms, ligand_atoms))
+        return self._get(path, lambda: synthetic.write_complex(path, receptor_atoms, ligand_atoms)[0])
+
+    def fragment(self, fragment_atoms):
+        path = os.path.join(self.folder, "fragment_{}.pdb".format(fragment_atoms))
+
+        def build():
+            names, elements, coords, bonds = synthetic.build_chain_ligand(fragment_atoms, origin=(30., 30., 30.))
+            return synthetic.write_ligand_pdb(path, names, elements, coords, bonds, resname="FRG")
+        return self._get(path, build)
+
+    def templates(self, ligand_atoms):
+        folder = os.path.join(self.folder, "templates_{}".format(ligand_atoms))
+
+        def build():
+            os.makedirs(folder)
+            core_atoms = max(8, ligand_atoms - FRAGMENT_ATOMS)
+            return synthetic.write_templates(folder, core_atoms, ligand_atoms - core_atoms)
+        return self._get(folder, build)
+
+    def sampling(self, trajectories):
+        folder = os.path.join(self.folder, "sampling_{}".format(trajectories))
+        return self._get(folder, lambda: synthetic.write_sampling_folder(
+            folder, self.complex(SAMPLING_RECEPTOR_ATOMS, SAMPLING_LIGAND_ATOMS), trajectories, self.steps))
+
+
+def bench_template_fragmenter(data, case_dir, ligand_atoms):
+    from frag_pele.Growing import template_fragmenter
+    template_initial, template_grown, hydrogen, core_atom = data.templates(ligand_atoms)
+    out_template = os.path.join(case_dir, "grwz_out")
+    return lambda: template_fragmenter.main(template_initial, template_grown, 1, 6, hydrogen, core_atom,
+                                            out_template)
+
+
+def bench_add_fragment(data, case_dir, receptor_atoms, ligand_atoms):
+    with requires("prody", "Bio"):
+        from frag_pele.Growing import add_fragment_from_pdbs
+    complex_pdb = data.complex(receptor_atoms, ligand_atoms)
+    fragment_pdb = data.fragment(FRAGMENT_ATOMS)
+    n_carbons = max(2, int(round((ligand_atoms - 2) / 3.)))
+    # Fresh copies, as the inputs are fixed in place
+    core = shutil.copy(complex_pdb, os.path.join(case_dir, "core.pdb"))
+    fragment = shutil.copy(fragment_pdb, os.path.join(case_dir, "fragment.pdb"))
+    return lambda: add_fragment_from_pdbs.main(core, fragment, "C{}".format(n_carbons), "C1", 6,
+                                               h_core="H{}C".format(n_carbons), h_frag="H1C")
+
+
+def bench_cluster_traject(data, case_dir, trajectories):
+    with requires("AdaptivePELE", "mdtraj"):
+        from frag_pele.Helpers import clusterizer
+    folder = data.sampling(trajectories)
+    column = clusterizer.get_column_num(folder, "Binding Energy", "report")
+    return lambda: clusterizer.cluster_traject("LIG", trajectories, column, 4, 0.3,
+                                               os.path.join(folder, "trajectory_*"),
+                                               os.path.join(case_dir, "clusters"), case_dir)
+
+
+def bench_check_atom_overlapping(data, case_dir, receptor_atoms):
+    with requires("mdtraj", "AdaptivePELE"):
+        from frag_pele.Helpers import clusterizer
+    complex_pdb = data.complex(receptor_atoms, SAMPLING_LIGAND_ATOMS)
+    pdbs = [complex_pdb] * OVERLAPPING_PDBS
+    return lambda: clusterizer.check_atom_overlapping(pdbs, ligand_resname="LIG")
+
+
+def bench_best_structs(data, case_dir, trajectories):
+    from frag_pele.Growing import bestStructs
+    folder = data.sampling(trajectories)
+    return lambda: bestStructs.main("Binding Energy", case_dir, path=folder, n_structs=BEST_STRUCTURES)
+
+
+def bench_get_score(data, case_dir, trajectories, streaming=False):
+    from frag_pele.Analysis import analyser
+    folder = data.sampling(trajectories)
+    return lambda: analyser.get_score_for_folder("report_", folder, export=False, streaming=streaming)
+
+
+def bench_find_core(data, case_dir, ligand_atoms):
+    with requires("schrodinger"):
+        from frag_pele.PlopRotTemp_S_2017 import PlopRotTemp
+    tors, bonds, n_atoms = synthetic.build_ligand_graph(ligand_atoms)
+    return lambda: PlopRotTemp.FindCore_GetCoreAtom(tors, bonds, n_atoms, -1, [], True)
+
+
+def get_cases(scale):
+    """
+    :return: list of (benchmark name, set-up function, parameters) of the scale.
+    """
+    sizes = SCALES[scale]
+    cases = []
+    for ligand_atoms in sizes["ligand_atoms"]:
+        cases.append(("template_fragmenter.main", bench_template_fragmenter, {"ligand_atoms": ligand_atoms}))
+        cases.append(("PlopRotTemp.FindCore_GetCoreAtom", bench_find_core, {"ligand_atoms": ligand_atoms}))
+    for receptor_atoms in sizes["receptor_atoms"]:
+        for ligand_atoms in sizes["ligand_atoms"]:
+            cases.append(("add_fragment_from_pdbs.main", bench_add_fragment,
+                          {"receptor_atoms": receptor_atoms, "ligand_atoms": ligand_atoms}))
+        cases.append(("clusterizer.check_atom_overlapping", bench_check_atom_overlapping,
+                      {"receptor_atoms": receptor_atoms}))
+    for trajectories in sizes["trajectories"]:
+        cases.append(("clusterizer.cluster_traject", bench_cluster_traject, {"trajectories": trajectories}))
+        cases.append(("bestStructs.main", bench_best_structs, {"trajectories": trajectories}))
+        cases.append(("analyser.get_score_for_folder", bench_get_score, {"trajectories": trajectories}))
+        cases.append(("analyser.get_score_for_folder", bench_get_score,
+                      {"trajectories": trajectories, "streaming": True}))
+    return cases
+
+
+def get_case_id(name, params):
+    return "{}[{}]".format(name, ",".join("{}={}".format(key, params[key]) for key in sorted(params)))
+
+
+def run_case(data, case_dir, setup, params, repeats):
+    """
+    Set up a benchmark and time it repeats times (the set-up is not timed).
+    :return: dictionary with the status ("ok", "skipped" or "error"), the times and their median and minimum.
+    """
+    os.makedirs(case_dir)
+    try:
+        with folder_handler.working_directory(case_dir):
+            function = setup(data, case_dir, **params)
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+    except Skip as e:
+        return {"status": "skipped", "message": str(e)}
+    except Exception as e:
+        return {"status": "error", "message": "{}: {}".format(type(e).__name__, e)}
+    return {"status": "ok", "times": times, "median": float(np.median(times)), "min": float(np.min(times))}
+
+
+def get_metadata(scale, repeats):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit, "scale": scale,
+            "repeats": repeats, "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.node(), "platform": platform.platform()}
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD, noise=DEFAULT_NOISE):
+    """
+    Compare the median times of the benchmarks that ran fine in both results.
+    :return: list of (case id, baseline median, current median, ratio, is regression).
+    """
+    comparison = []
+    for case_id, result in sorted(results.items()):
+        reference = baseline.get(case_id)
+        if not reference or result["status"] != "ok" or reference["status"] != "ok":
+            continue
+        ratio = result["median"] / reference["median"] if reference["median"] else float("inf")
+        regression = ratio > 1. + threshold and result["median"] - reference["median"] > noise
+        comparison.append((case_id, reference["median"], result["median"], ratio, regression))
+    return comparison
+
+
+def main(scale="small", repeats=3, select="*", output="benchmark_results.json", compare=None,
+         threshold=DEFAULT_THRESHOLD, noise=DEFAULT_NOISE, workdir=None):
+    folder = os.path.abspath(workdir) if workdir else tempfile.mkdtemp(prefix="frag_benchmarks_")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    data = SyntheticData(os.path.join(folder, "data"), SCALES[scale]["steps"])
+    if not os.path.exists(data.folder):
+        os.makedirs(data.folder)
+    results = {}
+    try:
+        for n, (name, setup, params) in enumerate(get_cases(scale)):
+            case_id = get_case_id(name, params)
+            if not fnmatch.fnmatch(case_id, select):
+                continue
+            result = run_case(data, os.path.join(folder, "case_{}".format(n)), setup, params, repeats)
+            result.update({"benchmark": name, "params": params})
+            results[case_id] = result
+            if result["status"] == "ok":
+                print("{:<75} {:>10.4f} s".format(case_id, result["median"]))
+            else:
+                print("{:<75} {:>10} ({})".format(case_id, result["status"].upper(), result["message"]))
+    finally:
+        if not workdir:
+            shutil.rmtree(folder, ignore_errors=True)
+    with open(output, "w") as out:
+        json.dump({"metadata": get_metadata(scale, repeats), "results": results}, out, indent=2, sort_keys=True)
+    if not compare:
+        return results, []
+    with open(compare) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    comparison = compare_results(results, baseline, threshold, noise)
+    print("\n{:<75} {:>10} {:>10} {:>7}".format("Benchmark", "Baseline", "Current", "Ratio"))
+    for case_id, reference, current, ratio, regression in comparison:
+        print("{:<75} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(case_id, reference, current, ratio,
+                                                             "  REGRESSION" if regression else ""))
+    return results, [row[0] for row in comparison if row[4]]
+
+
+if __name__ == '__main__':
+    scale, repeats, select, output, compare, threshold, noise, workdir = parse_arguments()
+    _, regressions = main(scale, repeats, select, output, compare, threshold, noise, workdir)
+    if regressions:
+        print("\n{} benchmarks slower than the baseline by more than {:.0%}".format(len(regressions), threshold))
+        sys.exit(1)
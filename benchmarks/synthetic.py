@@ -0,0 +1,218 @@
+"""
+Generators of the synthetic inputs used by the benchmarks: receptors, ligands (and fragments), OPLS2005 templates,
+PELE sampling folders and ligand graphs. Everything is deterministic (seeded), so two runs of the benchmarks time
+exactly the same work.
+"""
+import os
+import sys
+import numpy as np
+# Local imports
+frag_pele_dirname = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if frag_pele_dirname not in sys.path:
+    sys.path.append(frag_pele_dirname)
+from frag_pele.Helpers import fake_pele
+from frag_pele.Helpers import fake_plop
+
+SEED = 1234
+C_C_DISTANCE = 1.54
+C_H_DISTANCE = 1.09
+RESIDUE_SPACING = 4.5
+CAVITY_MARGIN = 4.
+# Heavy atoms of the residues of the synthetic receptors (ALA), relative to the CA
+RESIDUE_ATOMS = (("N", "N", (-1.2, 0.7, 0.)), ("CA", "C", (0., 0., 0.)), ("C", "C", (1.2, 0.7, 0.)),
+                 ("O", "O", (1.3, 1.9, 0.3)), ("CB", "C", (0., -0.8, 1.3)))
+PDB_LINE = "{:<6}{:>5} {:<4} {:>3} {}{:>4}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00          {:>2}\n"
+
+
+def format_atom(record, serial, name, resname, chain, resnum, coords, element):
+    # Names of one or two characters are written from the 14th column, as usual in PDBs
+    name = " {}".format(name) if len(name) < 4 and len(element) == 1 else name
+    return PDB_LINE.format(record, serial % 100000, name, resname, chain, resnum % 10000, coords[0], coords[1],
+                           coords[2], element)
+
+
+def build_chain_ligand(n_atoms, origin=(0., 0., 0.), prefix=""):
+    """
+    Build an alkane-like ligand (zig-zag chain of sp3 carbons with their hydrogens) of about n_atoms atoms. The
+    heavy atoms are called {prefix}C1, {prefix}C2... and the hydrogens H{n}A/H{n}B (and H{n}C at the ends).
+    :param n_atoms: number of atoms wanted (the chain has 3 * carbons + 2 atoms).
+    :param origin: position of the first carbon.
+    :param prefix: prefix of the heavy atom names, to build fragments with different names.
+    :return: list of atom names, list of elements, coordinates (n_atoms x 3) and bonds (pairs of indexes).
+    """
+    n_carbons = max(2, int(round((n_atoms - 2) / 3.)))
+    # Projections of the C-C bond (tetrahedral angle) and the C-H bonds
+    dx, dy = C_C_DISTANCE * np.sin(np.radians(54.75)), C_C_DISTANCE * np.cos(np.radians(54.75)) / 2.
+    hy, hz = C_H_DISTANCE * np.cos(np.radians(54.75)), C_H_DISTANCE * np.sin(np.radians(54.75))
+    names, elements, coords, bonds = [], [], [], []
+    carbons = []
+    for i in range(n_carbons):
+        side = 1. if i % 2 else -1.
+        carbon = np.array(origin, dtype=float) + (i * dx, side * dy, 0.)
+        carbons.append(len(names))
+        if i:
+            bonds.append((carbons[-2], carbons[-1]))
+        names.append("{}C{}".format(prefix, i + 1))
+        elements.append("C")
+        coords.append(carbon)
+        hydrogens = [(side * hy, hz), (side * hy, -hz)]
+        for suffix, (y, z) in zip("AB", hydrogens):
+            bonds.append((carbons[-1], len(names)))
+            names.append("H{}{}".format(i + 1, suffix))
+            elements.append("H")
+            coords.append(carbon + (0., y, z))
+        if i in (0, n_carbons - 1):
+            bonds.append((carbons[-1], len(names)))
+            names.append("H{}C".format(i + 1))
+            elements.append("H")
+            coords.append(carbon + (-C_H_DISTANCE if i == 0 else C_H_DISTANCE, 0., 0.))
+    return names, elements, np.array(coords), bonds
+
+
+def build_receptor(n_atoms, cavity_center=(0., 0., 0.), cavity_radius=8., seed=SEED):
+    """
+    Build a receptor of ALA residues placed on a cubic lattice around a cavity (where the ligand will be).
+    :param n_atoms: number of heavy atoms wanted (rounded to whole residues).
+    :param cavity_center: center of the empty cavity.
+    :param cavity_radius: radius of the empty cavity.
+    :return: list of (atom name, element, residue number) and coordinates (n_atoms x 3).
+    """
+    rng = np.random.default_rng(seed)
+    n_residues = max(1, n_atoms // len(RESIDUE_ATOMS))
+    side = 1
+    while True:
+        grid = np.indices((side, side, side)).reshape(3, -1).T - (side - 1) / 2.
+        grid = grid * RESIDUE_SPACING + cavity_center
+        grid = grid[np.linalg.norm(grid - cavity_center, axis=1) > cavity_radius]
+        if len(grid) >= n_residues:
+            break
+        side += 1
+    # The closest positions to the cavity are used, so the receptor is compact around the ligand
+    grid = grid[np.argsort(np.linalg.norm(grid - cavity_center, axis=1), kind="stable")[:n_residues]]
+    offsets = np.array([position for _, _, position in RESIDUE_ATOMS])
+    atoms = []
+    coords = []
+    for resnum, center in enumerate(grid, start=1):
+        coords.append(center + offsets + rng.normal(scale=0.05, size=offsets.shape))
+        atoms.extend((name, element, resnum) for name, element, _ in RESIDUE_ATOMS)
+    return atoms, np.concatenate(coords)
+
+
+def write_ligand_pdb(path, names, elements, coords, bonds, resname="LIG", chain="L", receptor=None, first_serial=1):
+    """
+    Write a ligand (optionally after a receptor) in PDB format, with the CONECT records of the ligand.
+    :param receptor: tuple (atoms, coordinates) as returned by build_receptor.
+    """
+    lines = []
+    serial = first_serial
+    if receptor is not None:
+        for (name, element, resnum), position in zip(*receptor):
+            lines.append(format_atom("ATOM", serial, name, "ALA", "A", resnum, position, element))
+            serial += 1
+        lines.append("TER\n")
+    ligand_serials = []
+    for name, element, position in zip(names, elements, coords):
+        lines.append(format_atom("HETATM", serial, name, resname, chain, 1, position, element))
+        ligand_serials.append(serial)
+        serial += 1
+    lines.append("TER\n")
+    neighbours = {n: [] for n in range(len(names))}
+    for i, j in bonds:
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    for n, bonded in neighbours.items():
+        if bonded:
+            lines.append("CONECT" + "".join("{:>5}".format(ligand_serials[m] % 100000)
+                                            for m in [n] + sorted(bonded)) + "\n")
+    lines.append("END\n")
+    with open(path, "w") as pdb:
+        pdb.writelines(lines)
+    return path
+
+
+def write_complex(path, receptor_atoms, ligand_atoms, resname="LIG", seed=SEED):
+    """
+    Write a complex of a synthetic receptor of receptor_atoms heavy atoms and a synthetic ligand of ligand_atoms atoms.
+    :return: path of the complex and the ligand (names, elements, coordinates, bonds).
+    """
+    ligand = build_chain_ligand(ligand_atoms)
+    names, elements, coords, bonds = ligand
+    center = coords.mean(axis=0)
+    cavity_radius = np.linalg.norm(coords - center, axis=1).max() + CAVITY_MARGIN
+    receptor = build_receptor(receptor_atoms, center, cavity_radius, seed)
+    write_ligand_pdb(path, names, elements, coords, bonds, resname=resname, receptor=receptor)
+    return path, ligand
+
+
+def write_templates(folder, core_atoms, fragment_atoms, resname="LIG"):
+    """
+    Write the OPLS2005 templates of a core and of the core grown with a fragment: the grown ligand is the core chain
+    extended, so the core atoms keep their names, and the last hydrogen of the core is the one replaced.
+    :return: path of the initial template, path of the grown template, hydrogen replaced and core atom linker.
+    """
+    core = build_chain_ligand(core_atoms)
+    grown = build_chain_ligand(core_atoms + fragment_atoms)
+    n_core_carbons = len([element for element in core[1] if element == "C"])
+    templates = []
+    for name, (names, elements, coords, bonds) in (("{}z".format(resname.lower()), core), ("grwz", grown)):
+        atoms = [(n + 1, atom_name, element) for n, (atom_name, element) in enumerate(zip(names, elements))]
+        path = os.path.join(folder, name)
+        with open(path, "w") as template:
+            template.write(fake_plop.build_template(resname if name != "grwz" else "GRW", atoms, coords, bonds))
+        templates.append(path)
+    return templates[0], templates[1], "H{}C".format(n_core_carbons), "C{}".format(n_core_carbons)
+
+
+def write_sampling_folder(folder, complex_pdb, n_trajectories, steps, seed=SEED):
+    """
+    Write a PELE sampling folder (report_N and trajectory_N.pdb files) with the stand-in of PELE.
+    """
+    settings = {"complexes": [complex_pdb], "steps": steps, "seed": seed, "chains": ["L"],
+                "report": os.path.join(folder, "report"), "trajectory": os.path.join(folder, "trajectory.pdb"),
+                "metrics": [("bindingEnergy", "Binding Energy"), ("sasa", "sasaLig")], "log": None}
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    for trajectory_id in range(1, n_trajectories + 1):
+        fake_pele.run_trajectory(settings, trajectory_id, complex_pdb)
+    return folder
+
+
+def build_ligand_graph(n_atoms, ring_fraction=0.2, seed=SEED):
+    """
+    Build a random ligand graph (as PlopRotTemp gets it from the mae file): a random tree of heavy atoms with some
+    extra bonds closing rings, and a hydrogen on each heavy atom with free valences.
+    :return: torsions (rotatable bonds) and bonds, both as lists of [i, j] 0-based atom indexes, and number of atoms.
+    """
+    rng = np.random.default_rng(seed)
+    n_heavy = max(2, n_atoms // 2)
+    valences = [0] * n_heavy
+    bonds = []
+    for atom in range(1, n_heavy):
+        candidates = [parent for parent in range(atom) if valences[parent] < 3] or [atom - 1]
+        parent = candidates[int(rng.integers(len(candidates)))]
+        bonds.append([parent, atom])
+        valences[parent] += 1
+        valences[atom] += 1
+    ring_bonds = []
+    for _ in range(int(n_heavy * ring_fraction / 6.)):
+        atom = int(rng.integers(n_heavy - 5))
+        ring_bonds.append([atom, atom + 5])
+        valences[atom] += 1
+        valences[atom + 5] += 1
+    bonds.extend(ring_bonds)
+    hydrogen = n_heavy
+    for atom in range(n_heavy):
+        if hydrogen < n_atoms and valences[atom] < 4:
+            bonds.append([atom, hydrogen])
+            hydrogen += 1
+    heavy_degree = [0] * n_heavy
+    for i, j in bonds:
+        if i < n_heavy and j < n_heavy:
+            heavy_degree[i] += 1
+            heavy_degree[j] += 1
+    in_ring = set()
+    for i, j in ring_bonds:
+        in_ring.update(range(i, j + 1))
+    tors = [[i, j] for i, j in bonds if i < n_heavy and j < n_heavy and heavy_degree[i] > 1 and heavy_degree[j] > 1
+            and not (i in in_ring and j in in_ring)]
+    return tors, bonds, hydrogen
@@ -2,8 +2,12 @@ import sys
 import os
 import re
 import glob
+import numpy as np
 import pandas as pd
 import argparse
+import multiprocessing
+# Local imports
+from frag_pele.Analysis import score_store
 
 
 def parse_arguments():
@@ -43,11 +47,20 @@ def parse_arguments():
                         help="Top value to create the new subset of samples.")
     parser.add_argument("-ld", "--limit_down", default=None, type=float,
                         help="Lowest value to create the new subset of samples.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Compute the scores reading the reports chunk by chunk, with bounded memory (for huge "
+                             "simulations). No summary csv is exported.")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of folders scored in parallel.")
+    parser.add_argument("-db", "--store", default=None,
+                        help="If set, SQLite score store where the scores will be upserted. A TSV summary with the "
+                             "same name is written as a view of the store.")
 
     args = parser.parse_args()
 
     return args.path_to_analyze, args.rep_pref, args.steps, args.file, args.out, args.equil_folder, args.col, \
-           args.quart, args.export_csv, args.limit_column, args.limit_up, args.limit_down
+           args.quart, args.export_csv, args.limit_column, args.limit_up, args.limit_down, args.jobs, args.store, \
+           args.stream
 
 
 def pele_report2pandas(path, export=True):
@@ -67,16 +80,18 @@ def pele_report2pandas(path, export=True):
         path_to_folder = "/".join(path.split("/")[0:-1])
         new_dir = path_to_folder + "/summary"
         if not os.path.exists(new_dir):
-            os.mkdir(new_dir)
+            os.makedirs(new_dir, exist_ok=True)
+        # Exclusive creation, so previous summaries are never overwritten
+        counter = 1
         while True:
-            counter = 1
+            summary_file = "{}/summary_report_{}.csv".format(new_dir, counter)
             try:
-                result.to_csv("{}/summary_report_{}.csv".format(new_dir, counter))
-                print("Data saved in {}/summary_report_{}.csv".format(new_dir, counter))
+                with open(summary_file, "x") as summary:
+                    result.to_csv(summary)
+                print("Data saved in {}".format(summary_file))
                 break
             except FileExistsError:
-                counter =+ 1
-                result.to_csv("{}/summary_report_{}.csv".format(new_dir, counter))
+                counter += 1
 
     return result
 
@@ -125,60 +140,164 @@ def compute_sterr(dataframe, column, quantile_value):
     return err_subset
 
 
+def read_report_header(report):
+    with open(report) as report_file:
+        header = report_file.readline()
+    return re.split(r"\s{2,}", header.strip())
+
+
+def stream_report_column(report, column, steps=False, limit_col=None, limit_up=None, limit_down=None,
+                         chunk_size=100000):
+    """
+    Read a single column of a PELE report chunk by chunk (discarding the first row, as pele_report2pandas does),
+    applying the steps and limit filters. Only one chunk is kept in memory.
+    :return: generator of numpy arrays with the values of the column.
+    """
+    header = read_report_header(report)
+    columns = [header.index(column)]
+    if steps:
+        columns.append(header.index("Step"))
+    if limit_col:
+        if not limit_up:
+            raise ValueError("You must fill the argument '--limit_up'!")
+        if not limit_down:
+            raise ValueError("You must fill the argument '--limit_down'!")
+        columns.append(header.index(limit_col))
+    with open(report) as report_file:
+        report_file.readline()  # Header
+        report_file.readline()  # We must discard the first row
+        while True:
+            chunk = np.loadtxt(report_file, usecols=columns, max_rows=chunk_size, ndmin=2)
+            if not chunk.size:
+                break
+            mask = np.ones(len(chunk), dtype=bool)
+            if steps:
+                mask &= chunk[:, 1] <= int(steps)
+            if limit_col:
+                mask &= (chunk[:, -1] > float(limit_down)) & (chunk[:, -1] < float(limit_up))
+            yield chunk[mask, 0]
+            if len(chunk) < chunk_size:
+                break
+
+
+def compute_streaming_score(reports, column, quantile_value, steps=False, limit_col=None, limit_up=None,
+                            limit_down=None, chunk_size=100000):
+    """
+    Compute the same FrAG score (mean of the values under the quantile) and standard error as compute_mean_quantile
+    and compute_sterr, with bounded memory. A first pass counts the values and a second pass keeps an exact selection
+    buffer with only the lowest values needed to interpolate the quantile.
+    :return: mean and standard error of the values under the quantile.
+    """
+    def stream():
+        for report in reports:
+            for values in stream_report_column(report, column, steps, limit_col, limit_up, limit_down, chunk_size):
+                yield values
+
+    n_values = sum(len(values) for values in stream())
+    if n_values == 0:
+        return np.nan, np.nan
+    # Same linear interpolation as pandas.Series.quantile
+    position = quantile_value * (n_values - 1)
+    lower = int(np.floor(position))
+    buffer_size = min(lower + 2, n_values)
+    selection = np.empty(0)
+    for values in stream():
+        selection = np.concatenate([selection, values])
+        if len(selection) > buffer_size:
+            selection = np.partition(selection, buffer_size - 1)[:buffer_size]
+    selection.sort()
+    quantile = selection[lower]
+    if lower + 1 < n_values:
+        quantile += (position - lower) * (selection[lower + 1] - selection[lower])
+    subset = selection[selection < quantile]
+    if len(subset) == 0:
+        return np.nan, np.nan
+    sterr = subset.std(ddof=1) / np.sqrt(len(subset)) if len(subset) > 1 else np.nan
+    return subset.mean(), sterr
+
+
 def get_score_for_folder(report_prefix, path_to_equilibration, steps=False,
                          column="Binding Energy", quantile_value=0.25, export=True,
-                         limit_col=None, limit_up=None, limit_down=None):
-    df = pele_report2pandas(os.path.join(path_to_equilibration, report_prefix), export)
-    if steps:
-        df = select_subset_by_steps(df, steps)
-    mean_quartile = compute_mean_quantile(df, column, quantile_value, limit_col, limit_up, limit_down)
+                         limit_col=None, limit_up=None, limit_down=None, streaming=False):
+    if streaming:
+        # The reports are never loaded completely, so no summary can be exported
+        reports = glob.glob('{}*'.format(os.path.join(path_to_equilibration, report_prefix)))
+        mean_quartile, _ = compute_streaming_score(reports, column, float(quantile_value), steps, limit_col,
+                                                   limit_up, limit_down)
+    else:
+        df = pele_report2pandas(os.path.join(path_to_equilibration, report_prefix), export)
+        if steps:
+            df = select_subset_by_steps(df, steps)
+        mean_quartile = compute_mean_quantile(df, column, quantile_value, limit_col, limit_up, limit_down)
     results = [path_to_equilibration, mean_quartile]
     print("SCORING results: {}	{}".format(results[0], results[1]))
     return results
 
 
-def analyse_at_epoch(report_prefix, path_to_equilibration, steps=False, column="Binding Energy", quantile_value=0.25):
+def analyse_at_epoch(report_prefix, path_to_equilibration, steps=False, column="Binding Energy", quantile_value=0.25,
+                     store=score_store.SCORE_STORE):
     result = get_score_for_folder(report_prefix=report_prefix, path_to_equilibration=path_to_equilibration,
                                   steps=steps, column=column, quantile_value=quantile_value)
-    out_file = "simulation_score_summary.tsv"
-    if os.path.exists(out_file):
-        #Pandas new version compatibility
-        try:
-            df = pd.read_csv(out_file, sep="\t", header=0, ignore_index=True)
-        except TypeError:
-            df = pd.read_csv(out_file, sep="\t", header=0, index_col=False)
-        df = pd.concat([df, pd.DataFrame([result],  columns=["Fragment_Results_Folder", "Score"])])
-    else:
-        df = pd.DataFrame([result], columns=["Fragment_Results_Folder", "Score"])
-    df.to_csv(out_file, sep="\t", index=False)
+    # Only upsert the score: the TSV summary is exported once, when all the fragments have been scored
+    score_store.ScoreStore(store).upsert(os.path.abspath(result[0]), float(result[1]))
+    return float(result[1])
+
+
+def score_folder(kwargs):
+    """
+    Worker to score a single folder in a process pool.
+    :return: folder, result (None if something fails) and error message (None if everything goes fine).
+    """
+    try:
+        return kwargs["path_to_equilibration"], get_score_for_folder(**kwargs), None
+    except Exception as e:
+        return kwargs["path_to_equilibration"], None, e
 
 
 def main(report_prefix, path_to_equilibration, equil_pattern="equilibration*", steps=False, out_report=False,
-         column="Binding Energy", quantile_value=0.25, export=True, limit_col=None, limit_up=None, limit_down=None):
-    folder_list = glob.glob(os.path.join(path_to_equilibration, equil_pattern))
-    for folder in list(folder_list):
+         column="Binding Energy", quantile_value=0.25, export=True, limit_col=None, limit_up=None, limit_down=None,
+         jobs=1, store=None, streaming=False):
+    folder_list = sorted(glob.glob(os.path.join(path_to_equilibration, equil_pattern)))
+    tasks = [dict(report_prefix=report_prefix, path_to_equilibration=folder, steps=steps, column=column,
+                  quantile_value=quantile_value, export=export, limit_col=limit_col, limit_up=limit_up,
+                  limit_down=limit_down, streaming=streaming) for folder in folder_list]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
         try:
-            result = get_score_for_folder(report_prefix=report_prefix, path_to_equilibration=folder, steps=steps,
-                                          column=column, quantile_value=quantile_value, export=export,
-                                          limit_col=limit_col, limit_up=limit_up, limit_down=limit_down)
-            line_of_report = "{}\t{:.2f}\n".format(result[0], float(result[1]))
+            scores = pool.map(score_folder, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        scores = [score_folder(task) for task in tasks]
+    results = []
+    for folder, result, error in scores:
+        if error is not None:
+            print("ERROR {} in {}".format(error, folder))
+            continue
+        results.append((result[0], float(result[1])))
+    if out_report:
+        lines_of_report = ["{}\t{:.2f}\n".format(folder, score) for folder, score in results]
+        for line_of_report in lines_of_report:
             print(line_of_report)
-            if out_report:
-                if os.path.exists(out_report):
-                    with open(out_report, "a") as report:
-                        report.write(line_of_report)
-                else:
-                    with open(out_report, "w") as report:
-                        report.write("# FragmentResultsFolder\tFrAG-score\n")
-        except Exception as e:
-            print("ERROR {} in {}".format(e, folder))
+        new_report = not os.path.exists(out_report)
+        with open(out_report, "a") as report:
+            if new_report:
+                report.write("# FragmentResultsFolder\tFrAG-score\n")
+            report.write("".join(lines_of_report))
+    if store:
+        score_database = score_store.ScoreStore(store)
+        score_database.upsert_many(results)
+        score_database.export_tsv(score_store.get_summary_file(store))
+    return results
 
 
 if __name__ == '__main__':
-    path, rep_pref, steps, file, out, equil_folder, col, quart, export, limit_col, limit_up, limit_down= \
-        parse_arguments()
+    path, rep_pref, steps, file, out, equil_folder, col, quart, export, limit_col, limit_up, limit_down, jobs, \
+        store, stream = parse_arguments()
     main(report_prefix=rep_pref, path_to_equilibration=path, equil_pattern=equil_folder, steps=steps, out_report=out,
-         column=col, quantile_value=quart, export=export, limit_col=limit_col, limit_up=limit_up, limit_down=limit_down)
+         column=col, quantile_value=quart, export=export, limit_col=limit_col, limit_up=limit_up, limit_down=limit_down,
+         jobs=jobs, store=store, streaming=stream)
 
 
 
@@ -7,10 +7,8 @@ import os
 import sys
 import argparse
 import glob
-import itertools
 import re
 from ast import literal_eval
-from AdaptivePELE.utilities import utilities
 try:
     basestring
 except NameError:
@@ -21,24 +19,156 @@ def parseArguments():
     """
         Parse the command-line options
 
-        :returns: str, str, str, str --  path to file to backtrack,
+        :returns: list, str, str, str, bool --  paths to the files to backtrack,
             path to the result files,
-            output path where to write the files, name of the files
+            output path where to write the files, name of the files,
+            batch mode
     """
     desc = "Write the information related to the conformation network to file\n"
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("file_to_backtrack", type=str, help="File of the selected_results folder that you want to"
-                                                            "backtrack.")
+    parser.add_argument("file_to_backtrack", type=str, nargs="*", help="File(s) of the selected_results folder that you"
+                                                                       " want to backtrack.")
 
     parser.add_argument("-p", type=str, default="growing_results", help="Path to the folder which contains the growing"
                                                                         "results of all growing steps.")
     parser.add_argument("-o", type=str, default=None, help="Output path where to write the files")
     parser.add_argument("--name", type=str, default="pathway.pdb", help="Name of the pdb to write the files")
+    parser.add_argument("--batch", action="store_true", help="Backtrack all the files of the selected_result_* "
+                                                             "folders in one run.")
     args = parser.parse_args()
-    return args.file_to_backtrack, args.p, args.o, args.name
+    return args.file_to_backtrack, args.p, args.o, args.name, args.batch
 
 
-def main(file_to_backtrack, results_path, outputPath, out_filename):
+def index_models(trajectory):
+    """
+    Build the index of the models of a trajectory: the byte offset where each model starts. Each model goes from the
+    line after the previous ENDMDL to its own ENDMDL line (both included).
+
+    :param trajectory: PDB trajectory.
+    :type trajectory: str
+    :return: list of offsets (the last one is the end of the last model).
+    """
+    offsets = [0]
+    position = 0
+    with open(trajectory, "rb") as trajectory_file:
+        for line in trajectory_file:
+            position += len(line)
+            if line.startswith(b"ENDMDL"):
+                offsets.append(position)
+    return offsets
+
+
+def get_model_offsets(trajectory, indexes):
+    """
+    Get the index of the models of a trajectory, building it only the first time.
+
+    :param trajectory: PDB trajectory.
+    :type trajectory: str
+    :param indexes: cache of indexes, shared by all the files backtracked.
+    :type indexes: dict
+    :return: list of offsets.
+    """
+    if trajectory not in indexes:
+        indexes[trajectory] = index_models(trajectory)
+    return indexes[trajectory]
+
+
+def read_spawning_map(results_path, growing_id):
+    """
+    Parse the processorMapping.txt of all the growing steps of a growing.
+
+    :param results_path: Path where the growing simulations are stored.
+    :type results_path: str
+    :param growing_id: ID of the growing.
+    :type growing_id: str
+    :return: list (one per growing step) of lists of tuples (epoch, trajectory, snapshot) from where each trajectory
+    spawned.
+    """
+    growing_epochs = glob.glob(os.path.join(results_path, "{}_growing_output*".format(growing_id)))
+    if not growing_epochs:
+        raise ValueError("Trajectory %s not found!" % os.path.join(results_path))
+    spawning_map = []
+    for n in range(len(growing_epochs)):
+        with open(os.path.join(results_path, "{}_growing_output{}".format(growing_id, n),
+                               "processorMapping.txt")) as mapping_file:
+            spawning_map.append([literal_eval(cluster_from.strip()) for cluster_from in mapping_file.read().split(":")
+                                 if cluster_from.strip()])
+    return spawning_map
+
+
+def get_pathway(file_to_backtrack, results_path, spawning_maps):
+    """
+    Find the MODEL blocks of each trajectory that led to the discovery of a snapshot.
+
+    :param file_to_backtrack: File of the selected_results folder that you want to backtrack.
+    :type file_to_backtrack: str
+    :param results_path: Path where the growing simulations are stored.
+    :type results_path: str
+    :param spawning_maps: cache of spawning maps by growing ID, shared by all the files backtracked.
+    :type spawning_maps: dict
+    :return: list of tuples (trajectory file, first model, last model), in order.
+    """
+    # Get information of the input structure
+    trajectory, snapshot, growing_id = extract_info_from_selected_file(path_to_selected_file=file_to_backtrack)
+    if growing_id not in spawning_maps:
+        spawning_maps[growing_id] = read_spawning_map(results_path, growing_id)
+    spawning_map = spawning_maps[growing_id]
+    # All snapshots from the sampling trajectory until the input snapshot
+    pathway = [("sampling_result_{}/trajectory_{}.pdb".format(growing_id, trajectory), 1, snapshot)]
+    for n in range(len(spawning_map)-1, -1, -1):
+        # Extract the spawning structure of the previous simulation
+        cluster_from_tup = spawning_map[n][trajectory-1]
+        # Update the trajectory and snapshot to be used
+        trajectory = cluster_from_tup[1]
+        snapshot = cluster_from_tup[2]
+        filename = os.path.join(results_path, "{}_growing_output{}/trajectory_{}.pdb".format(growing_id, n, trajectory))
+        # Take all MODELS until the snapshot (the initial one only in the first growing step)
+        pathway.insert(0, (filename, 0 if n == 0 else 1, snapshot))
+    return pathway
+
+
+def write_pathway(pathway, out_file, indexes):
+    """
+    Write the MODEL blocks of a pathway as a stream, reading only these blocks from each trajectory.
+
+    :param pathway: list of tuples (trajectory file, first model, last model).
+    :type pathway: list
+    :param out_file: output PDB file.
+    :type out_file: str
+    :param indexes: cache of indexes, shared by all the files backtracked.
+    :type indexes: dict
+    :return: None
+    """
+    with open(out_file, "ab") as f:
+        for filename, first, last in pathway:
+            offsets = get_model_offsets(filename, indexes)
+            last = min(last, len(offsets) - 2)
+            if last < first:
+                continue
+            with open(filename, "rb") as trajectory_file:
+                trajectory_file.seek(offsets[first])
+                remaining = offsets[last + 1] - offsets[first]
+                while remaining > 0:
+                    chunk = trajectory_file.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+
+
+def get_output_filename(outputPath, out_filename):
+    if os.path.exists(outputPath+out_filename):
+        # If the specified name exists, append a number to distinguish the files
+        name, ext = os.path.splitext(out_filename)
+        out_filename = "".join([name, "_%d", ext])
+        i = 1
+        while os.path.exists(outputPath+out_filename % i):
+            i += 1
+        out_filename %= i
+    return out_filename
+
+
+def main(file_to_backtrack, results_path, outputPath, out_filename, indexes=None, spawning_maps=None):
     """
 
     :param file_to_backtrack: File of the selected_results folder that you want to backtrack.
@@ -49,73 +179,70 @@ def main(file_to_backtrack, results_path, outputPath, out_filename):
     :type outputPath: str
     :param out_filename: Output filename prefix.
     :type out_filename: str
-    :return: None
+    :param indexes: cache of model indexes of the trajectories (to share it between several calls).
+    :type indexes: dict
+    :param spawning_maps: cache of the spawning maps of the growings (to share it between several calls).
+    :type spawning_maps: dict
+    :return: path of the pathway written.
     """
+    if indexes is None:
+        indexes = {}
+    if spawning_maps is None:
+        spawning_maps = {}
     if outputPath is not None:
         outputPath = os.path.join(outputPath, "")
         if not os.path.exists(outputPath):
             os.makedirs(outputPath)
     else:
         outputPath = ""
-    if os.path.exists(outputPath+out_filename):
-        # If the specified name exists, append a number to distinguish the files
-        name, ext = os.path.splitext(out_filename)
-        out_filename = "".join([name, "_%d", ext])
-        i = 1
-        while os.path.exists(outputPath+out_filename % i):
-            i += 1
-        out_filename %= i
-    pathway = []
+    out_filename = get_output_filename(outputPath, out_filename)
     sys.stderr.write("Creating pathway...\n")
-    # Get information of the input structure
-    trajectory, snapshot, growing_id = extract_info_from_selected_file(path_to_selected_file=file_to_backtrack)
-    # Obtain trajectory from sampling folder
-    sampling_file_from = "sampling_result_{}/trajectory_{}.pdb".format(growing_id, trajectory)
-    sampling_models = utilities.getSnapshots(sampling_file_from)
-    # Get all snapshots from the input snapshot and add it to pathway
-    snapshots = sampling_models[1:snapshot + 1]
-    pathway.insert(0, snapshots)
-    growing_epochs = glob.glob(os.path.join(results_path, "{}_growing_output*".format(growing_id)))
-    if not growing_epochs:
-        raise ValueError("Trajectory %s not found!" % os.path.join(results_path))
-    for n in range(len(growing_epochs)-1, -1, -1):
-        # Reading mapping information
-        procMapping = open(os.path.join(results_path, "{}_growing_output{}".format(growing_id, n),
-                                        "processorMapping.txt")).read().split(":")
-        # Extract the spawning structure of the previous simulation
-        cluster_from = procMapping[trajectory-1].rstrip("\n")
-        cluster_from_tup = literal_eval(cluster_from)
-        # Update the trajectory and snapshot to be used
-        trajectory = cluster_from_tup[1]
-        snapshot = cluster_from_tup[2]
-        # Extract the filename and the snapshot that has spawn
-        filename = os.path.join(results_path, "{}_growing_output{}/trajectory_{}.pdb".format(growing_id, n, trajectory))
-        print(n, filename, trajectory, snapshot, procMapping)
-        snapshots = utilities.getSnapshots(filename)
-        if n == 0:
-            initial = 0
-        else:
-            initial = 1
-        # Take all MODELS from the snapshot
-        snapshots = snapshots[initial:snapshot+1]
-        pathway.insert(0, snapshots)
-
+    pathway = get_pathway(file_to_backtrack, results_path, spawning_maps)
     sys.stderr.write("Writing pathway...\n")
-    with open(outputPath+out_filename, "a") as f:
-        f.write("ENDMDL\n".join(itertools.chain.from_iterable(pathway)))
+    write_pathway(pathway, outputPath+out_filename, indexes)
+    return outputPath+out_filename
+
+
+def backtrack_selected_results(results_path, outputPath, out_filename, selected_pattern="selected_result_*",
+                               files_to_backtrack=None):
+    """
+    Batch mode: backtrack all the files of the selected_result_* folders (or the files given) in one run, sharing the
+    model indexes and the spawning maps. Each pathway is named after the file backtracked.
+
+    :param results_path: Path where the growing simulations are stored.
+    :type results_path: str
+    :param outputPath: Output folder path.
+    :type outputPath: str
+    :param out_filename: Output filename prefix.
+    :type out_filename: str
+    :param selected_pattern: pattern of the selected results folders.
+    :type selected_pattern: str
+    :param files_to_backtrack: files to backtrack. If not set, all the PDB files of the selected results folders.
+    :type files_to_backtrack: list
+    :return: list of paths of the pathways written.
+    """
+    if not files_to_backtrack:
+        files_to_backtrack = sorted(glob.glob(os.path.join(selected_pattern, "*.pdb")))
+    indexes = {}
+    spawning_maps = {}
+    name, ext = os.path.splitext(out_filename)
+    pathways = []
+    for file_to_backtrack in files_to_backtrack:
+        pathway_name = "{}_{}{}".format(name, os.path.splitext(os.path.basename(file_to_backtrack))[0], ext)
+        pathways.append(main(file_to_backtrack, results_path, outputPath, pathway_name, indexes, spawning_maps))
+    return pathways
 
 
 def extract_info_from_selected_file(path_to_selected_file):
-    pattern_trajectory = re.compile('trajectory_[\d+]\.')
-    pattern_snapshot = re.compile('\.[\d+]_')
-    trajectory_and_others = re.findall(pattern_trajectory, path_to_selected_file)
-    trajectory = re.findall('\d+', trajectory_and_others[0])
-    snapshot_and_others = re.findall(pattern_snapshot, path_to_selected_file)
-    snapshot = re.findall('\d+', snapshot_and_others[0])
+    pattern = re.compile(r'trajectory_(\d+)\.(\d+)_')
+    trajectory, snapshot = re.findall(pattern, os.path.basename(path_to_selected_file))[0]
     growing_id = path_to_selected_file.split("epochsampling_result_")[-1].split("_trajectory")[0]
-    return int(trajectory[0]), int(snapshot[0]), growing_id
+    return int(trajectory), int(snapshot), growing_id
 
 
 if __name__ == "__main__":
-    traj, results_path, output_path, output_filename = parseArguments()
-    main(traj, results_path, output_path, output_filename)
+    trajs, results_path, output_path, output_filename, batch = parseArguments()
+    if batch or len(trajs) > 1:
+        backtrack_selected_results(results_path, output_path, output_filename, files_to_backtrack=trajs)
+    else:
+        main(trajs[0], results_path, output_path, output_filename)
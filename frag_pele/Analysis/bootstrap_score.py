@@ -0,0 +1,197 @@
+import os
+import re
+import glob
+import argparse
+import multiprocessing
+import numpy as np
+# Local imports
+from frag_pele.Analysis import analyser
+from frag_pele.Analysis import score_store
+
+SEED = 1234
+CI_LOW_COLUMN = "Score_CI_low"
+CI_HIGH_COLUMN = "Score_CI_high"
+
+
+def parse_arguments():
+    """
+    Parse user arguments
+
+    Output: list with all the user arguments
+    """
+    parser = argparse.ArgumentParser(description="""Computes bootstrapped confidence intervals of the FrAG score
+    (mean of the 25% lowest values) of each fragment grown, resampling blocks of consecutive steps of each processor
+    trajectory, and adds them to the score summary.""")
+    required_named = parser.add_argument_group('required named arguments')
+    required_named.add_argument("path_to_analyze",
+                                help="""Path of the folder to be analyzed, where all simulations are stored.""")
+    parser.add_argument("-r", "--rep_pref", default='report_',
+                        help="""Prefix of the report file: usually 'report_'. """)
+    parser.add_argument("-e", "--equil_folder", default="sampling_result*",
+                        help="Prefix of the sampling folders (where the results are)")
+    parser.add_argument("-s", "--steps", default=False,
+                        help="Used to filter by N PELE steps")
+    parser.add_argument("-c", "--col", default="Binding Energy",
+                        help="Name of the column used to compute the score")
+    parser.add_argument("-q", "--quart", default=0.25, type=float,
+                        help="Quartile that will be used to compute the mean")
+    parser.add_argument("-n", "--resamples", default=1000, type=int,
+                        help="Number of bootstrap resamples.")
+    parser.add_argument("-b", "--block", default=None, type=int,
+                        help="Number of consecutive steps of each resampled block. By default, the cube root of the "
+                             "number of values of each trajectory.")
+    parser.add_argument("-ci", "--confidence", default=0.95, type=float,
+                        help="Confidence level of the intervals.")
+    parser.add_argument("--seed", default=SEED, type=int,
+                        help="Seed of the random generator, so the intervals are reproducible.")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of fragments processed in parallel.")
+    parser.add_argument("-db", "--store", default=score_store.SCORE_STORE,
+                        help="SQLite score store where the scores and their intervals will be upserted. A TSV summary "
+                             "with the same name is written as a view of the store.")
+    args = parser.parse_args()
+    return args.path_to_analyze, args.rep_pref, args.equil_folder, args.steps, args.col, args.quart, \
+           args.resamples, args.block, args.confidence, args.seed, args.jobs, args.store
+
+
+def read_trajectory_values(path_to_equilibration, report_prefix="report_", column="Binding Energy", steps=False):
+    """
+    Read the values of a column for each processor trajectory of a sampling folder (discarding the first row of each
+    report, as the analyser does).
+    :return: list of arrays, one per trajectory, sorted by processor.
+    """
+    reports = glob.glob(os.path.join(path_to_equilibration, "{}*".format(report_prefix)))
+    reports.sort(key=lambda report: int(re.findall(r'\d+$', report)[0]))
+    trajectories = []
+    for report in reports:
+        values = list(analyser.stream_report_column(report, column, steps))
+        values = np.concatenate(values) if values else np.empty(0)
+        if len(values):
+            trajectories.append(values)
+    return trajectories
+
+
+def quantile_scores(samples, quantile_value):
+    """
+    Compute the FrAG score (mean of the values under the quantile) of each row of a matrix at once.
+    :param samples: array (n_resamples x n_values).
+    :param quantile_value: quantile used to compute the score.
+    :return: array with the score of each row.
+    """
+    quantiles = np.quantile(samples, quantile_value, axis=1)[:, np.newaxis]
+    mask = samples < quantiles
+    counts = mask.sum(axis=1)
+    sums = np.where(mask, samples, 0.).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def get_block_indices(rng, n_values, n_resamples, block_size=None):
+    """
+    Build the indices of a moving block bootstrap of a trajectory: blocks of consecutive steps, starting at random
+    positions, are concatenated until the length of the trajectory is reached.
+    :param rng: random generator.
+    :param n_values: number of values of the trajectory.
+    :param n_resamples: number of resamples.
+    :param block_size: number of consecutive steps of each block. By default, the cube root of n_values.
+    :return: array of indices (n_resamples x n_values).
+    """
+    if block_size is None:
+        block_size = int(round(n_values ** (1. / 3.)))
+    block_size = min(max(1, block_size), n_values)
+    n_blocks = -(-n_values // block_size)
+    starts = rng.integers(0, n_values - block_size + 1, size=(n_resamples, n_blocks, 1))
+    return (starts + np.arange(block_size)).reshape(n_resamples, n_blocks * block_size)[:, :n_values]
+
+
+def bootstrap_scores(trajectories, quantile_value=0.25, resamples=1000, seed=SEED, batch_size=None, block_size=None):
+    """
+    Bootstrap the FrAG score resampling, with replacement, blocks of consecutive steps of each trajectory independently
+    (so every resample keeps the number of values of each trajectory). The steps of a PELE trajectory are correlated,
+    so resampling them one by one would give too narrow intervals. All the resamples are built as a matrix of random
+    indices and scored in a vectorized way, by batches to limit the memory used.
+    :param trajectories: list of arrays of values, one per trajectory.
+    :param quantile_value: quantile used to compute the score.
+    :param resamples: number of bootstrap resamples.
+    :param seed: seed of the random generator.
+    :param batch_size: number of resamples scored at once. By default, batches of ~10^7 values.
+    :param block_size: number of consecutive steps of each block. By default, the cube root of the number of values of
+    each trajectory.
+    :return: array with the score of each resample.
+    """
+    rng = np.random.default_rng(seed)
+    n_values = sum(len(values) for values in trajectories)
+    if batch_size is None:
+        batch_size = max(1, int(1e7 // max(n_values, 1)))
+    scores = []
+    for start in range(0, resamples, batch_size):
+        n_resamples = min(batch_size, resamples - start)
+        samples = np.concatenate([values[get_block_indices(rng, len(values), n_resamples, block_size)]
+                                  for values in trajectories], axis=1)
+        scores.append(quantile_scores(samples, quantile_value))
+    return np.concatenate(scores)
+
+
+def compute_confidence_interval(path_to_equilibration, report_prefix="report_", column="Binding Energy", steps=False,
+                                quantile_value=0.25, resamples=1000, confidence=0.95, seed=SEED, block_size=None):
+    """
+    Compute the FrAG score of a sampling folder and its bootstrapped confidence interval.
+    :return: score, lower and upper limits of the interval.
+    """
+    trajectories = read_trajectory_values(path_to_equilibration, report_prefix, column, steps)
+    if not trajectories:
+        raise ValueError("No values found in {}".format(path_to_equilibration))
+    score = quantile_scores(np.concatenate(trajectories)[np.newaxis, :], quantile_value)[0]
+    scores = bootstrap_scores(trajectories, quantile_value, resamples, seed, block_size=block_size)
+    alpha = (1. - confidence) / 2.
+    ci_low, ci_high = np.nanquantile(scores, [alpha, 1. - alpha])
+    return float(score), float(ci_low), float(ci_high)
+
+
+def confidence_interval_for_folder(kwargs):
+    """
+    Worker to compute the interval of a single folder in a process pool.
+    :return: folder, result (None if something fails) and error message (None if everything goes fine).
+    """
+    try:
+        return kwargs["path_to_equilibration"], compute_confidence_interval(**kwargs), None
+    except Exception as e:
+        return kwargs["path_to_equilibration"], None, e
+
+
+def main(path_to_analyze, report_prefix="report_", equil_pattern="sampling_result*", steps=False,
+         column="Binding Energy", quantile_value=0.25, resamples=1000, confidence=0.95, seed=SEED, jobs=1,
+         store=score_store.SCORE_STORE, block_size=None):
+    folder_list = sorted(glob.glob(os.path.join(path_to_analyze, equil_pattern)))
+    tasks = [dict(path_to_equilibration=folder, report_prefix=report_prefix, column=column, steps=steps,
+                  quantile_value=quantile_value, resamples=resamples, confidence=confidence, seed=seed,
+                  block_size=block_size)
+             for folder in folder_list]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            intervals = pool.map(confidence_interval_for_folder, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        intervals = [confidence_interval_for_folder(task) for task in tasks]
+    results = []
+    score_database = score_store.ScoreStore(store)
+    score_database.add_columns([CI_LOW_COLUMN, CI_HIGH_COLUMN])
+    for folder, result, error in intervals:
+        if error is not None:
+            print("ERROR {} in {}".format(error, folder))
+            continue
+        score, ci_low, ci_high = result
+        print("SCORING results: {}\t{}\t[{}, {}]".format(folder, score, ci_low, ci_high))
+        score_database.upsert(folder, score, **{CI_LOW_COLUMN: ci_low, CI_HIGH_COLUMN: ci_high})
+        results.append((folder, score, ci_low, ci_high))
+    score_database.export_tsv(score_store.get_summary_file(store))
+    return results
+
+
+if __name__ == '__main__':
+    path, rep_pref, equil_folder, steps, col, quart, resamples, block, confidence, seed, jobs, store = parse_arguments()
+    main(path, report_prefix=rep_pref, equil_pattern=equil_folder, steps=steps, column=col, quantile_value=quart,
+         resamples=resamples, confidence=confidence, seed=seed, jobs=jobs, store=store, block_size=block)
@@ -0,0 +1,170 @@
+import os
+import re
+import glob
+import logging
+import numpy as np
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+TOLERANCE = 0.25
+SEM_TOLERANCE = 0.5
+PATIENCE = 3
+MIN_VALUES = 100
+POLL_INTERVAL = 60
+
+
+class ReportTailer(object):
+    """
+    Reads the rows appended to the PELE reports of a folder since the last read (like "tail -f"), keeping the byte
+    offset of each report. Incomplete lines (still being written) are left for the next read, and the first row of each
+    report (the initial structure) is discarded, as the analyser does.
+    """
+
+    def __init__(self, folder, report_prefix="report_", column="Binding Energy"):
+        self.folder = folder
+        self.report_prefix = report_prefix
+        self.column = column
+        self.offsets = {}
+        self.columns = {}
+
+    def read_new_values(self):
+        """
+        :return: list with the new values of the column.
+        """
+        values = []
+        for report in glob.glob(os.path.join(self.folder, "{}*".format(self.report_prefix))):
+            if not re.search(r"\d+$", report):
+                continue
+            # Binary mode, so the offsets are bytes and seek can go back to them
+            with open(report, "rb") as report_file:
+                report_file.seek(self.offsets.get(report, 0))
+                content = report_file.read()
+            end = content.rfind(b"\n")
+            if end < 0:
+                continue
+            lines = content[:end].decode().split("\n")
+            if report not in self.offsets:
+                # Wait for the header and the initial structure
+                if len(lines) < 2:
+                    continue
+                header = re.split(r"\s{2,}", lines[0].strip())
+                if self.column not in header:
+                    raise ValueError("Column {} not found in {}".format(self.column, report))
+                self.columns[report] = header.index(self.column)
+                lines = lines[2:]
+            self.offsets[report] = self.offsets.get(report, 0) + end + 1
+            for line in lines:
+                fields = line.split()
+                if fields:
+                    values.append(float(fields[self.columns[report]]))
+        return values
+
+
+class ScoreConvergence(object):
+    """
+    Watches the reports of a running PELE simulation and updates, incrementally, the FrAG score (mean of the values
+    under the quantile, as analyser.compute_mean_quantile) and its standard error. The simulation has converged when,
+    with at least min_values values, the score has changed less than tolerance in the last patience checks and its
+    standard error is below sem_tolerance.
+
+    e.g.
+
+    watcher = ScoreConvergence("sampling_result_aminoC1N1")
+    simulations_linker.simulation_runner(pele_dir, control_file, cpus, watcher=watcher)
+    """
+
+    def __init__(self, folders, report_prefix="report_", column="Binding Energy", quantile_value=0.25,
+                 tolerance=TOLERANCE, sem_tolerance=SEM_TOLERANCE, patience=PATIENCE, min_values=MIN_VALUES):
+        if isinstance(folders, str):
+            folders = [folders]
+        self.tailers = [ReportTailer(folder, report_prefix, column) for folder in folders]
+        self.quantile_value = quantile_value
+        self.tolerance = tolerance
+        self.sem_tolerance = sem_tolerance
+        self.patience = patience
+        self.min_values = min_values
+        # Sorted buffer with all the values read so far
+        self.values = np.empty(0)
+        self.history = []
+
+    def update(self):
+        """
+        Read the new rows of the reports and compute the score and its standard error.
+        :return: score and standard error (None if there are not enough values yet).
+        """
+        new_values = []
+        for tailer in self.tailers:
+            new_values.extend(tailer.read_new_values())
+        if new_values:
+            # Only the new values are sorted, and then merged in the buffer
+            new_values = np.sort(np.asarray(new_values, dtype=float))
+            self.values = np.insert(self.values, np.searchsorted(self.values, new_values), new_values)
+        score, sem = self.compute_score()
+        if score is not None:
+            self.history.append((len(self.values), score, sem))
+            logger.info("Score with {} values: {:.3f} +/- {:.3f}".format(len(self.values), score, sem))
+        return score, sem
+
+    def compute_score(self):
+        n_values = len(self.values)
+        if n_values < 2:
+            return None, None
+        # Linear interpolation between the closest ranks, as np.quantile, read directly from the sorted buffer
+        position = self.quantile_value * (n_values - 1)
+        lower = int(np.floor(position))
+        quantile = self.values[lower]
+        if lower + 1 < n_values:
+            quantile += (position - lower) * (self.values[lower + 1] - self.values[lower])
+        subset = self.values[:np.searchsorted(self.values, quantile, side="left")]
+        if len(subset) < 2:
+            return None, None
+        return float(subset.mean()), float(subset.std(ddof=1) / np.sqrt(len(subset)))
+
+    def converged(self):
+        if len(self.history) <= self.patience or self.history[-1][0] < self.min_values:
+            return False
+        recent = self.history[-self.patience - 1:]
+        # New values are needed between checks, otherwise a stalled simulation would look converged
+        if len(set(n_values for n_values, _, _ in recent)) < len(recent):
+            return False
+        scores = [score for _, score, _ in recent]
+        return max(scores) - min(scores) < self.tolerance and recent[-1][2] < self.sem_tolerance
+
+
+def trim_outputs(folder, report_prefix="report_", traject_prefix="trajectory_"):
+    """
+    Leave the outputs of a simulation stopped (or interrupted) before its end consistent: drop the model being written
+    at the end of each trajectory, the rows of its report that are incomplete or whose model was not written, and the
+    models written after the last row of the report.
+    """
+    for report in glob.glob(os.path.join(folder, "{}*".format(report_prefix))):
+        number = re.findall(r"(\d+)$", report)
+        if not number:
+            continue
+        trajectory = os.path.join(folder, "{}{}.pdb".format(traject_prefix, number[0]))
+        # Offset of the end of each complete model
+        model_ends = None
+        if os.path.exists(trajectory):
+            model_ends = []
+            with open(trajectory, "rb") as trajectory_file:
+                for line in trajectory_file:
+                    if line.startswith(b"ENDMDL") and line.endswith(b"\n"):
+                        model_ends.append(trajectory_file.tell())
+        with open(report) as report_file:
+            lines = report_file.readlines()
+        rows = [lines[0]] if lines else []
+        n_models = 0
+        for line in lines[1:]:
+            fields = line.split()
+            # The models of the trajectory are the accepted steps + 1
+            if not line.endswith("\n") or len(fields) < 3:
+                break
+            if model_ends is not None and int(fields[2]) + 1 > len(model_ends):
+                break
+            rows.append(line)
+            n_models = int(fields[2]) + 1
+        with open(report, "w") as report_file:
+            report_file.writelines(rows)
+        if model_ends is not None:
+            os.truncate(trajectory, model_ends[n_models - 1] if n_models else 0)
@@ -0,0 +1,190 @@
+import os
+import glob
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+AMINOACIDS = {"ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "HID", "HIE", "HIP", "ILE", "LEU", "LYS",
+              "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL", "ASH", "GLH", "LYN", "CYX", "CYT"}
+WATERS = {"HOH", "WAT", "SOL", "TIP", "TIP3", "T3P", "SPC"}
+
+
+def parse_arguments():
+    """
+            Parse user arguments
+
+            Output: list with all the user arguments
+        """
+    parser = argparse.ArgumentParser(description="""Computes the interaction fingerprints (contacts between each
+    ligand atom and the residues of the protein or waters) of all the snapshots of the trajectories of a sampling
+    folder, and the frequency of each contact.""")
+    required_named = parser.add_argument_group('required named arguments')
+    required_named.add_argument("path", help="""Sampling folder with the trajectories.""")
+    parser.add_argument("-t", "--traj_pattern", default="trajectory_*.pdb",
+                        help="Pattern of the trajectory files.")
+    parser.add_argument("-ch", "--chain", default="L",
+                        help="Ligand chain.")
+    parser.add_argument("-d", "--dist", default=4., type=float,
+                        help="Interaction distance threshold.")
+    parser.add_argument("-ah", "--addh", default=False, action='store_true',
+                        help="If set it takes into account ligand H's in the interaction.")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of trajectories processed in parallel.")
+    parser.add_argument("-o", "--outfile", default="contact_frequencies.csv",
+                        help="Output csv file (written inside the sampling folder) with the contact frequencies.")
+    parser.add_argument("-m", "--matrix", default=False, action='store_true',
+                        help="If set, the sparse snapshot x contact matrix is also saved (npz).")
+    args = parser.parse_args()
+    return args.path, args.traj_pattern, args.chain, args.dist, args.addh, args.jobs, args.outfile, args.matrix
+
+
+def read_topology(trajectory):
+    """
+    Read the atoms of the first model of a PDB file (or trajectory).
+    :param trajectory: PDB file.
+    :return: list of tuples (atom name, resname, resnum, chain, element) of each atom.
+    """
+    atoms = []
+    with open(trajectory) as pdb:
+        for line in pdb:
+            if line.startswith("ENDMDL"):
+                break
+            if line.startswith(("ATOM", "HETATM")):
+                name = line[12:16].strip()
+                element = line[76:78].strip() or name.lstrip("0123456789")[:1]
+                atoms.append((name, line[17:21].strip(), line[22:26].strip(), line[21:22], element))
+    return atoms
+
+
+def iterate_frames(trajectory, n_atoms):
+    """
+    Read the coordinates of the models of a trajectory, one model at a time.
+    :param trajectory: PDB trajectory.
+    :param n_atoms: number of atoms of each model.
+    :return: generator of arrays of coordinates (n_atoms x 3).
+    """
+    coordinates = []
+    with open(trajectory) as pdb:
+        for line in pdb:
+            if line.startswith(("ATOM", "HETATM")):
+                coordinates.append((line[30:38], line[38:46], line[46:54]))
+            elif line.startswith("ENDMDL"):
+                yield np.array(coordinates, dtype=float).reshape(n_atoms, 3)
+                coordinates = []
+    if coordinates:
+        yield np.array(coordinates, dtype=float).reshape(n_atoms, 3)
+
+
+def get_contact_indices(atoms, ligand_chain="L", addh=False):
+    """
+    Build, once per topology, the indices needed by the fingerprints.
+    :param atoms: atoms of the topology, as returned by read_topology.
+    :param ligand_chain: chain of the ligand.
+    :param addh: if True, the hydrogens of the ligand are also taken into account.
+    :return: indices of the ligand atoms, indices of the protein (and water) atoms, residue (column) of each protein
+    atom, names of the ligand atoms and labels of the residues.
+    """
+    ligand = [n for n, atom in enumerate(atoms) if atom[3] == ligand_chain and (addh or atom[4] != "H")]
+    receptor = [n for n, atom in enumerate(atoms) if atom[3] != ligand_chain and
+                (atom[1] in AMINOACIDS or atom[1] in WATERS)]
+    residue_labels = []
+    residue_positions = {}
+    atom_residues = []
+    for n in receptor:
+        name, resname, resnum, chain, element = atoms[n]
+        key = (chain, resnum, resname)
+        if key not in residue_positions:
+            residue_positions[key] = len(residue_labels)
+            residue_labels.append("{}{}".format(resnum, resname))
+        atom_residues.append(residue_positions[key])
+    ligand_names = [atoms[n][0] for n in ligand]
+    return np.array(ligand, dtype=int), np.array(receptor, dtype=int), np.array(atom_residues, dtype=int), \
+           ligand_names, residue_labels
+
+
+def compute_fingerprints(trajectory, ligand_chain="L", distance=4., addh=False):
+    """
+    Compute the interaction fingerprint of each snapshot of a trajectory. For each snapshot, a KD-tree of the protein
+    (and water) atoms is built and all the ligand atoms are queried at once.
+    :param trajectory: PDB trajectory.
+    :param ligand_chain: chain of the ligand.
+    :param distance: interaction distance threshold.
+    :param addh: if True, the hydrogens of the ligand are also taken into account.
+    :return: sparse boolean matrix (snapshots x (ligand atom, residue)), names of the ligand atoms and labels of the
+    residues. The column of the contact between the ligand atom i and the residue j is i * n_residues + j.
+    """
+    atoms = read_topology(trajectory)
+    ligand, receptor, atom_residues, ligand_names, residue_labels = get_contact_indices(atoms, ligand_chain, addh)
+    n_residues = len(residue_labels)
+    rows = []
+    columns = []
+    n_frames = 0
+    for frame, coordinates in enumerate(iterate_frames(trajectory, len(atoms))):
+        n_frames += 1
+        tree = cKDTree(coordinates[receptor])
+        for ligand_atom, neighbours in enumerate(tree.query_ball_point(coordinates[ligand], r=distance)):
+            if neighbours:
+                contacts = np.unique(atom_residues[neighbours]) + ligand_atom * n_residues
+                columns.append(contacts)
+                rows.append(np.full(len(contacts), frame))
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+    columns = np.concatenate(columns) if columns else np.empty(0, dtype=int)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)),
+                               shape=(n_frames, len(ligand_names) * n_residues))
+    return matrix, ligand_names, residue_labels
+
+
+def fingerprints_for_trajectory(args):
+    """
+    Worker to compute the fingerprints of a trajectory in a process pool.
+    """
+    return compute_fingerprints(*args)
+
+
+def compute_contact_frequencies(path, traj_pattern="trajectory_*.pdb", ligand_chain="L", distance=4., addh=False,
+                                jobs=1):
+    """
+    Compute the fingerprints of all the trajectories of a sampling folder and the frequency of each contact.
+    :return: sparse matrix with the fingerprints of all the snapshots (trajectories sorted by name) and a dataframe
+    with the frequency of each contact (ligand atom, residue) found at least once.
+    """
+    trajectories = sorted(glob.glob(os.path.join(path, traj_pattern)))
+    tasks = [(trajectory, ligand_chain, distance, addh) for trajectory in trajectories]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.map(fingerprints_for_trajectory, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fingerprints_for_trajectory(task) for task in tasks]
+    if not results:
+        raise ValueError("No trajectories found in {}".format(path))
+    ligand_names, residue_labels = results[0][1], results[0][2]
+    matrix = sparse.vstack([result[0] for result in results], format="csr")
+    frequencies = np.asarray(matrix.sum(axis=0)).ravel() / max(matrix.shape[0], 1)
+    contacts = np.flatnonzero(frequencies)
+    n_residues = len(residue_labels)
+    summary = pd.DataFrame({"ligand_atom": [ligand_names[n // n_residues] for n in contacts],
+                            "residue": [residue_labels[n % n_residues] for n in contacts],
+                            "frequency": frequencies[contacts]})
+    summary = summary.sort_values("frequency", ascending=False)
+    return matrix, summary
+
+
+def main(path, traj_pattern="trajectory_*.pdb", ligand_chain="L", distance=4., addh=False, jobs=1,
+         outfile="contact_frequencies.csv", save_matrix=False):
+    matrix, summary = compute_contact_frequencies(path, traj_pattern, ligand_chain, distance, addh, jobs)
+    summary.to_csv(os.path.join(path, outfile), index=False)
+    if save_matrix:
+        sparse.save_npz(os.path.join(path, "{}.npz".format(os.path.splitext(outfile)[0])), matrix)
+    return matrix, summary
+
+
+if __name__ == '__main__':
+    path, traj_pattern, chain, dist, addh, jobs, outfile, save_matrix = parse_arguments()
+    main(path, traj_pattern, chain, dist, addh, jobs, outfile, save_matrix)
@@ -1,5 +1,6 @@
 import os
 import argparse
+import multiprocessing
 import schrodinger.structure as st
 
 
@@ -81,14 +82,60 @@ def pdb_to_mae(pdb_inputfile, schr_path, mae_output_file=None, remove=False):
         os.remove(pdb_inputfile)
 
 
+def read_manifest(manifest):
+    """
+    Read a manifest file with one pdb file per line (empty lines and lines starting with # are skipped).
+    """
+    with open(manifest) as manifest_file:
+        return [line.strip() for line in manifest_file if line.strip() and not line.startswith("#")]
+
+
+def _pdb_to_mae(args):
+    pdb_inputfile, schr_path, remove = args
+    try:
+        pdb_to_mae(pdb_inputfile, schr_path, remove=remove)
+    except Exception as e:
+        return pdb_inputfile, e
+    return pdb_inputfile, None
+
+
+def pdbs_to_mae(pdb_inputfiles, schr_path, remove=False, jobs=1):
+    """
+    Convert many pdb files to mae in the same interpreter (optionally with a pool of workers), so the Schrodinger
+    modules are only imported once.
+    :return: list of (pdb file, error) of the files that could not be converted.
+    """
+    tasks = [(pdb_inputfile, schr_path, remove) for pdb_inputfile in pdb_inputfiles]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.map(_pdb_to_mae, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_pdb_to_mae(task) for task in tasks]
+    errors = [(pdb_inputfile, error) for pdb_inputfile, error in results if error is not None]
+    for pdb_inputfile, error in errors:
+        print("ERROR converting {}: {}".format(pdb_inputfile, error))
+    return errors
+
+
 def add_args(parser):
-    parser.add_argument('inputfile', type=str, help="Pdb input file")
+    parser.add_argument('inputfile', type=str, nargs="*", help="Pdb input file(s)")
+    parser.add_argument('--manifest', type=str, default=None, help="File with a pdb input file per line")
     parser.add_argument('--schr', type=str, help="schrodinger root path")
     parser.add_argument('--remove', action="store_true", help="Remove inputfile at exit")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of files converted in parallel")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Write mae and sdf files with certain properties')
     add_args(parser)
     args = parser.parse_args()
-    pdb_to_mae(args.inputfile, args.schr, remove=args.remove)
+    inputfiles = list(args.inputfile)
+    if args.manifest:
+        inputfiles.extend(read_manifest(args.manifest))
+    errors = pdbs_to_mae(inputfiles, args.schr, remove=args.remove, jobs=args.jobs)
+    if errors:
+        raise SystemExit(1)
@@ -1,9 +1,10 @@
 import sys
 import os
 import re
-import mdtraj
 import glob
 import argparse
+import multiprocessing
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -27,6 +28,8 @@ def parse_arguments():
                         help="Resame of the ligand.")
     parser.add_argument("-c", "--csv", default="summary/summary_report_1.csv",
                         help="Relative path to csv file")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of trajectories read in parallel.")
 
 
     # Plot arguments
@@ -37,7 +40,7 @@ def parse_arguments():
 
     args = parser.parse_args()
 
-    return args.pdb_reference, args.path, args.resname, args.csv, args.ycol, args.plot
+    return args.pdb_reference, args.path, args.resname, args.csv, args.ycol, args.plot, args.jobs
 
 
 def check_common_residues(pdb_target_prody, pdb_reference_prody):
@@ -55,25 +58,108 @@ def check_common_residues(pdb_target_prody, pdb_reference_prody):
     return only_resnums
 
 
+def get_ligand_indices(pdb_reference, resname="GRW"):
+    """
+    Get the positions (in the list of atoms of the first model) of the atoms of the ligand.
+    :param pdb_reference: reference pdb file
+    :param resname: residue name of the ligand
+    :return: list of indices
+    """
+    indices = []
+    index = 0
+    with open(pdb_reference) as pdb:
+        for line in pdb:
+            if line.startswith("ENDMDL"):
+                break
+            if line.startswith(("ATOM", "HETATM")):
+                if line[17:20].strip() == resname:
+                    indices.append(index)
+                index += 1
+    return indices
+
+
+def read_coordinates(pdb_file, atom_indices):
+    """
+    Read only the coordinates of some atoms of each model of a (multi-model) PDB file, without building any topology.
+    The atoms are selected by their position inside the model.
+    :param pdb_file: pdb file (or trajectory)
+    :param atom_indices: positions of the atoms inside each model
+    :return: array of coordinates in Angstroms (n_models x n_atoms x 3)
+    """
+    selected = set(atom_indices)
+    models = []
+    coordinates = {}
+    index = 0
+    with open(pdb_file) as pdb:
+        for line in pdb:
+            if line.startswith(("ATOM", "HETATM")):
+                if index in selected:
+                    coordinates[index] = (line[30:38], line[38:46], line[46:54])
+                index += 1
+            elif line.startswith("ENDMDL"):
+                models.append([coordinates[n] for n in atom_indices])
+                coordinates = {}
+                index = 0
+    if index:
+        models.append([coordinates[n] for n in atom_indices])
+    return np.array(models, dtype=float).reshape(-1, len(atom_indices), 3)
+
+
+def compute_rmsd(coordinates, reference):
+    """
+    Compute the RMSD of all the frames against the reference at once, after the optimal superposition (Kabsch) of each
+    frame, as mdtraj.rmsd does.
+    :param coordinates: array of coordinates (n_frames x n_atoms x 3)
+    :param reference: array of coordinates of the reference (n_atoms x 3)
+    :return: array of RMSD values, in the same units as the coordinates
+    """
+    coordinates = coordinates - coordinates.mean(axis=1)[:, np.newaxis, :]
+    reference = reference - reference.mean(axis=0)
+    covariance = np.einsum("fai,aj->fij", coordinates, reference)
+    singular_values = np.linalg.svd(covariance, compute_uv=False)
+    # Avoid reflections
+    signs = np.sign(np.linalg.det(covariance))
+    singular_values[:, -1] *= np.where(signs == 0, 1, signs)
+    squared = (coordinates ** 2).sum(axis=(1, 2)) + (reference ** 2).sum() - 2 * singular_values.sum(axis=1)
+    return np.sqrt(np.maximum(squared, 0) / reference.shape[0])
+
+
+def superimpose_backbones(coordinates, reference, backbone_indices, reference_backbone_indices=None):
+    """
+    Superimpose all the frames onto the reference using the backbone atoms (optimal rotation and translation).
+    :param coordinates: array of coordinates (n_frames x n_atoms x 3)
+    :param reference: array of coordinates of the reference (n_reference_atoms x 3)
+    :param backbone_indices: indices of the backbone atoms in the frames
+    :param reference_backbone_indices: indices of the same atoms in the reference (by default, backbone_indices)
+    :return: array of superimposed coordinates (n_frames x n_atoms x 3)
+    """
+    if reference_backbone_indices is None:
+        reference_backbone_indices = backbone_indices
+    mobile = coordinates[:, backbone_indices]
+    fixed = reference[reference_backbone_indices]
+    mobile_center = mobile.mean(axis=1)[:, np.newaxis, :]
+    fixed_center = fixed.mean(axis=0)
+    covariance = np.einsum("fai,aj->fij", mobile - mobile_center, fixed - fixed_center)
+    u, _, vt = np.linalg.svd(covariance)
+    # Avoid reflections
+    signs = np.sign(np.linalg.det(np.matmul(u, vt)))
+    u[:, :, -1] *= signs[:, np.newaxis]
+    rotations = np.matmul(u, vt)
+    return np.matmul(coordinates - mobile_center, rotations) + fixed_center
+
+
 def ligands_rmsd_calculator(pdb_target, pdb_reference, resname="GRW"):
     """
 
     :param pdb_target: problem pdb file
     :param pdb_reference: reference pdb file
-    :param write2report: if True export results in a file
-    :param write2pdb: pdb file with the result of the superposition between "pdb_target" and "pdb_reference"
-    :param ligand_chain: name of the chain of the ligand
-    :return: superpose the backbone of the pdb_target to the pdb_reference and computes the RMSD of the ligand
+    :param resname: residue name of the ligand
+    :return: superpose the ligand of each model of pdb_target to the ligand of pdb_reference and computes its RMSD (nm)
     """
-    # Reparation of PDB files if it is needed
-    repair_pdbs(pdb_target)
-    # Load the data to mdtraj
-    target = mdtraj.load(pdb_target)
-    reference = mdtraj.load(pdb_reference)
-    # Get the indexes of heavy atoms of the ligands
-    ligand = reference.topology.select('resname "{}"'.format(resname))
-    rmsd = mdtraj.rmsd(target, reference=reference, atom_indices=ligand)
-    return rmsd
+    ligand = get_ligand_indices(pdb_reference, resname)
+    reference = read_coordinates(pdb_reference, ligand)[0]
+    target = read_coordinates(pdb_target, ligand)
+    return compute_rmsd(target, reference) / 10.
 
 
 def repair_pdbs(pdb_file):
@@ -105,22 +191,47 @@ def sort_atoms_by_name(pdb_file):
         write_output.write(new_pdb_content)
 
 
+def read_trajectory_coordinates(args):
+    """
+    Worker to read the ligand coordinates of a trajectory in a process pool.
+    """
+    trajectory, atom_indices = args
+    return read_coordinates(trajectory, atom_indices)
+
+
 def compute_rmsd_in_serie(pdb_reference, path, resname="GRW", pattern_to_csv="summary/summary_report_1.csv", plot=False,
-                          y=None):
+                          y=None, jobs=1):
     equilibration_files = sorted(glob.glob("{}/trajectory_[0-9]*.pdb".format(path)))
     csv = os.path.join(path, pattern_to_csv)
     df = pd.read_csv(csv)
-    for file in equilibration_files:
-        result = ligands_rmsd_calculator(file, pdb_reference, resname=resname)
-        processor = re.findall(r'\d+', file.split("/")[-1])[0]
+    # The first column of the summary is the row of each value in its original report (i.e. the model)
+    report_row = df.columns[0]
+    ligand = get_ligand_indices(pdb_reference, resname)
+    reference = read_coordinates(pdb_reference, ligand)[0]
+    tasks = [(file, ligand) for file in equilibration_files]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
         try:
-            indexes = search_indexes_with_certain_value_in_column(df, int(processor), "Processor")
-            for rmsd, index in zip(result, indexes):
-                add_data_to_dataframe(dataframe=df, value_to_add=rmsd, row_to_add=index, column_name="rmsd")
-        except Exception as e:
-            print(e)
+            coordinates = pool.map(read_trajectory_coordinates, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        coordinates = [read_trajectory_coordinates(task) for task in tasks]
+    processors = []
+    models = []
+    for file, trajectory in zip(equilibration_files, coordinates):
+        processor = int(re.findall(r'\d+', file.split("/")[-1])[0])
+        processors.append(np.full(len(trajectory), processor))
+        models.append(np.arange(len(trajectory)))
+    if coordinates:
+        rmsd = compute_rmsd(np.concatenate(coordinates), reference) / 10.  # In nm, as mdtraj
+        results = pd.DataFrame({"Processor": np.concatenate(processors), report_row: np.concatenate(models),
+                                "rmsd": rmsd})
+        df = df.drop(columns="rmsd", errors="ignore")
+        df = df.merge(results, on=["Processor", report_row], how="left")
     # Overwriting the initial report
-    df.to_csv(csv)
+    df.to_csv(csv, index=False)
     if plot:
         filename = os.path.join(path, "{}_rmsd.png".format(y))
         plot_results(df, xcolumn="rmsd", ycolumn=y, outfile=filename)
@@ -183,6 +294,6 @@ def get_pdb_by_min_value(report_file, column_number):
 
 
 if __name__ == '__main__':
-    pdb_reference, path, resname, csv, ycol, plot = parse_arguments()
-    compute_rmsd_in_serie(pdb_reference, path, pattern_to_csv=csv, resname=resname, plot=plot, y=ycol)
+    pdb_reference, path, resname, csv, ycol, plot, jobs = parse_arguments()
+    compute_rmsd_in_serie(pdb_reference, path, pattern_to_csv=csv, resname=resname, plot=plot, y=ycol, jobs=jobs)
 
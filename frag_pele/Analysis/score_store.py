@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import argparse
+from contextlib import closing, contextmanager
+# Local imports
+from frag_pele.Helpers import folder_handler
+
+SCORE_STORE = "simulation_score_summary.db"
+SCORE_SUMMARY = "simulation_score_summary.tsv"
+TSV_COLUMNS = ["Fragment_Results_Folder", "Score"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Export the TSV summary of a score store.")
+    parser.add_argument("-db", "--store", default=SCORE_STORE, help="SQLite score store. By default = {}".format(
+        SCORE_STORE))
+    parser.add_argument("-o", "--out", default=None,
+                        help="TSV summary. By default, the store with the .tsv extension.")
+    args = parser.parse_args()
+    return args.store, args.out
+
+
+def get_summary_file(store):
+    """
+    :return: path of the TSV summary of a store (same name, .tsv extension).
+    """
+    return os.path.splitext(store)[0] + ".tsv"
+
+
+class ScoreStore(object):
+    """
+    Append-safe store of the FrAG scores, backed by SQLite. Each fragment has a single row (identified by its ID) that
+    is inserted or updated (upsert), so several growings can save their scores at the same time and the summary never
+    needs to be read and rewritten completely. The TSV summary is produced as a view of the store.
+
+    e.g.
+
+    store = ScoreStore()
+    store.upsert("sampling_result_aminoC1N1", -45.43)
+    store.upsert("sampling_result_aminoC1N2", -41.12)
+    store.export_tsv()  # Once, when all the fragments have been scored
+    """
+
+    def __init__(self, path=SCORE_STORE, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS scores (fragment_id TEXT PRIMARY KEY, "
+                               "results_folder TEXT, score REAL)")
+
+    @contextmanager
+    def _connect(self):
+        """
+        Connection for a single transaction: it is committed (or rolled back on errors) and closed at the end.
+        """
+        with closing(sqlite3.connect(self.path, timeout=self.timeout)) as connection:
+            with connection:
+                yield connection
+
+    @staticmethod
+    def get_fragment_id(results_folder):
+        """
+        The ID of the fragment is the name of its sampling results folder without the prefix.
+        """
+        folder_name = os.path.basename(os.path.normpath(results_folder))
+        return folder_name.split("sampling_result_", 1)[-1]
+
+    def add_columns(self, columns):
+        """
+        Add extra REAL columns to the store (if they are not already there).
+        """
+        with self._connect() as connection:
+            existing = [row[1] for row in connection.execute("PRAGMA table_info(scores)")]
+            for column in columns:
+                if column not in existing:
+                    connection.execute('ALTER TABLE scores ADD COLUMN "{}" REAL'.format(column))
+
+    def upsert(self, results_folder, score, **extra_columns):
+        """
+        Insert the score of a fragment, or update it if the fragment is already in the store.
+        """
+        if extra_columns:
+            self.add_columns(extra_columns.keys())
+        columns = ["fragment_id", "results_folder", "score"] + list(extra_columns.keys())
+        values = [self.get_fragment_id(results_folder), results_folder, score] + list(extra_columns.values())
+        updates = ", ".join('"{0}"=excluded."{0}"'.format(column) for column in columns[1:])
+        with self._connect() as connection:
+            connection.execute('INSERT INTO scores ({}) VALUES ({}) ON CONFLICT(fragment_id) DO UPDATE SET {}'.format(
+                ", ".join('"{}"'.format(column) for column in columns), ", ".join("?" * len(columns)), updates),
+                values)
+
+    def upsert_many(self, results):
+        """
+        Upsert a list of (results_folder, score) in a single transaction.
+        """
+        with self._connect() as connection:
+            connection.executemany("INSERT INTO scores (fragment_id, results_folder, score) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(fragment_id) DO UPDATE SET results_folder=excluded.results_folder, "
+                                   "score=excluded.score",
+                                   [(self.get_fragment_id(folder), folder, score) for folder, score in results])
+
+    def read(self):
+        """
+        :return: header and rows of the store, in insertion order.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute("SELECT * FROM scores ORDER BY rowid")
+            header = [description[0] for description in cursor.description]
+            return header, cursor.fetchall()
+
+    def export_tsv(self, out_file=SCORE_SUMMARY):
+        """
+        Write the TSV summary (view of the store) atomically.
+        """
+        header, rows = self.read()
+        extra_columns = header[3:]
+        lines = ["\t".join(TSV_COLUMNS + extra_columns)]
+        for row in rows:
+            lines.append("\t".join("" if value is None else str(value) for value in row[1:]))
+        folder_handler.atomic_write(out_file, "\n".join(lines) + "\n")
+
+
+if __name__ == '__main__':
+    store_path, out_file = parse_arguments()
+    if not os.path.exists(store_path):
+        raise IOError("Score store {} not found".format(store_path))
+    ScoreStore(store_path).export_tsv(out_file or get_summary_file(store_path))
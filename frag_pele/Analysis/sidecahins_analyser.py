@@ -1,14 +1,14 @@
 import sys
 import os
 import numpy as np
-import prody
 import argparse
 
 
 # Local import
-from rmsd_computer import superimpose_backbones
-from interaction_detector import pdb2prody
-from interaction_detector import select_atom_given_name_type_and_num
+from frag_pele.Analysis.rmsd_computer import superimpose_backbones
+from frag_pele.Analysis.interaction_fingerprints import read_topology, iterate_frames, AMINOACIDS
+
+BACKBONE_ATOMS = ("N", "CA", "C", "O")
 
 
 def parse_arguments():
@@ -58,9 +58,114 @@ def read_selecteds_from_file(filepath):
     return [a.strip("\n") for a in residues_id_list]
 
 
+def read_frames(pdb_file, atom_indices):
+    """
+    Read the coordinates of some atoms of all the models of a PDB file (or trajectory).
+    :param pdb_file: PDB file.
+    :param atom_indices: indices of the atoms to keep.
+    :return: array of coordinates (n_models x n_atoms x 3).
+    """
+    n_atoms = len(read_topology(pdb_file))
+    return np.array([coordinates[atom_indices] for coordinates in iterate_frames(pdb_file, n_atoms)]).reshape(
+        -1, len(atom_indices), 3)
+
+
+def get_atom_keys(atoms):
+    """
+    :return: dictionary {(chain, resnum, atom name): index} of the atoms of a topology.
+    """
+    return {(atom[3], atom[2], atom[0]): n for n, atom in enumerate(atoms)}
+
+
+def select_residues(reference_atoms, reference_coords, res_file=False, area=False, ligand_chain="L"):
+    """
+    Select the residues (resnums) of the protein used to compute the RMSD: those that have any atom within 'area'
+    Angstroms of the ligand or those listed in 'res_file'.
+    """
+    protein = np.array([atom[1] in AMINOACIDS and atom[3] != ligand_chain for atom in reference_atoms])
+    resnums = np.array([atom[2] for atom in reference_atoms])
+    if area:
+        print("Selection set of {} Amstrongs".format(area))
+        ligand = np.array([atom[3] == ligand_chain for atom in reference_atoms])
+        distances = np.linalg.norm(reference_coords[protein][:, np.newaxis, :] -
+                                   reference_coords[ligand][np.newaxis, :, :], axis=-1)
+        close = np.any(distances <= float(area), axis=1)
+        return sorted(set(resnums[protein][close]), key=int)
+    elif res_file:
+        aminoacids_list = read_selecteds_from_file(res_file)
+        print("Searching the following amino acids: {}".format(aminoacids_list))
+        return sorted(set(aminoacids_list) & set(resnums[protein]), key=int)
+    else:
+        print("Please, set an input file or a radii to determine which amino acids will be used to compute the RMSD.")
+        return []
+
+
+def get_residue_atom_map(reference_atoms, target_atoms, residues):
+    """
+    Build once the map from residues to atoms: the heavy atoms of all the selected residues are placed contiguously, so
+    per-residue values can be reduced with np.add.reduceat.
+    :return: indices of the heavy atoms in the reference and in the target, offsets of each residue, indices (in the
+    same arrays) of the CA of each residue, resnames and residues kept.
+    """
+    target_keys = get_atom_keys(target_atoms)
+    residues = set(residues)
+    by_residue = {}
+    for n, atom in enumerate(reference_atoms):
+        name, resname, resnum, chain, element = atom
+        if resnum in residues and resname in AMINOACIDS and element != "H":
+            by_residue.setdefault((resnum, resname), []).append(n)
+    reference_indices, target_indices, offsets, ca_positions, resnames, kept = [], [], [], [], [], []
+    for (resnum, resname), atom_indices in sorted(by_residue.items(), key=lambda item: int(item[0][0])):
+        pairs = [(n, target_keys.get((reference_atoms[n][3], resnum, reference_atoms[n][0]))) for n in atom_indices]
+        if any(target is None for n, target in pairs):
+            print("ERROR because different number of atoms in residue {}".format(resnum))
+            continue
+        ca = [position for position, (n, target) in enumerate(pairs) if reference_atoms[n][0] == "CA"]
+        if not ca:
+            continue
+        offsets.append(len(reference_indices))
+        ca_positions.append(len(reference_indices) + ca[0])
+        reference_indices.extend(n for n, target in pairs)
+        target_indices.extend(target for n, target in pairs)
+        resnames.append(resname)
+        kept.append(resnum)
+    return np.array(reference_indices, dtype=int), np.array(target_indices, dtype=int), \
+           np.array(offsets, dtype=int), np.array(ca_positions, dtype=int), resnames, kept
+
+
+def get_backbone_indices(reference_atoms, target_atoms):
+    """
+    :return: indices of the backbone atoms shared by the reference and the target, in both structures.
+    """
+    target_keys = get_atom_keys(target_atoms)
+    reference_indices, target_indices = [], []
+    for n, atom in enumerate(reference_atoms):
+        key = (atom[3], atom[2], atom[0])
+        if atom[1] in AMINOACIDS and atom[0] in BACKBONE_ATOMS and key in target_keys:
+            reference_indices.append(n)
+            target_indices.append(target_keys[key])
+    return np.array(reference_indices, dtype=int), np.array(target_indices, dtype=int)
+
+
+def compute_residue_rmsds(coordinates, reference, offsets, ca_positions):
+    """
+    Compute the RMSD of each residue and the shift of its CA for all the frames at once.
+    :param coordinates: array (n_frames x n_atoms x 3) with the heavy atoms of the residues, contiguous by residue.
+    :param reference: array (n_atoms x 3) with the same atoms in the reference.
+    :param offsets: position of the first atom of each residue.
+    :param ca_positions: position of the CA of each residue.
+    :return: arrays (n_frames x n_residues) with the RMSDs and the CA shifts.
+    """
+    squared = np.sum((coordinates - reference) ** 2, axis=-1)
+    counts = np.diff(np.append(offsets, squared.shape[1]))
+    rmsds = np.sqrt(np.add.reduceat(squared, offsets, axis=1) / counts)
+    ca_shifts = np.sqrt(squared[:, ca_positions])
+    return rmsds, ca_shifts
+
+
 def sidechains_rmsd_calculator(pdb_target, pdb_reference, res_file=False, area=False, write2report=False, ligand_chain="L"):
     """
-    :param pdb_target: problem pdb file
+    :param pdb_target: problem pdb file (or trajectory, all its models are analysed)
     :param pdb_reference: reference pdb file
     :param radii: area that we want to select around the ligand
     :param path: output path
@@ -69,47 +174,53 @@ def sidechains_rmsd_calculator(pdb_target, pdb_reference, res_file=False, area=F
     :return: superpose the backbone of the pdb_target to the pdb_reference and computes the RMSD for each side
     chain in the selection area
     """
-    target, reference = superimpose_backbones(pdb_target, pdb_reference)
-    if area:
-        print("Selection set of {} Amstrongs".format(area))
-        selected_area_target = reference.select("protein and (within {} of chain {})".format(area, ligand_chain))
-        unique_residues_target = sorted(set(selected_area_target.getResnums()))
-    elif res_file:
-        aminoacids_list = read_selecteds_from_file(res_file)
-        print("Searching the following amino acids: {}".format(aminoacids_list))
-        selected_area_target = reference.select("resnum {}".format(' '.join(aminoacids_list)))
-        unique_residues_target = sorted(set(selected_area_target.getResnums()))
-    else:
-        print("Please, set an input file or a radii to determine which amino acids will be used to compute the RMSD.")
+    reference_atoms = read_topology(pdb_reference)
+    target_atoms = read_topology(pdb_target)
+    reference = read_frames(pdb_reference, np.arange(len(reference_atoms)))[0]
+    residues = select_residues(reference_atoms, reference, res_file, area, ligand_chain)
+    reference_indices, target_indices, offsets, ca_positions, resnames, residues = get_residue_atom_map(
+        reference_atoms, target_atoms, residues)
+    reference_backbone, target_backbone = get_backbone_indices(reference_atoms, target_atoms)
+    # Only the atoms needed are kept for each frame
+    needed = np.concatenate([target_indices, target_backbone])
+    frames = read_frames(pdb_target, needed)
+    frames = superimpose_backbones(frames, reference, np.arange(len(target_indices), len(needed)), reference_backbone)
+    rmsds, ca_shifts = compute_residue_rmsds(frames[:, :len(target_indices)], reference[reference_indices], offsets,
+                                             ca_positions)
     list_of_results = []
-    for residue_target in unique_residues_target:
-        res_selected_target = target.select("protein and resnum {} and heavy".format(residue_target))
-        res_selected_reference = reference.select("protein and resnum {} and heavy".format(residue_target))
-        target_CA = target.select("protein and resnum {} and name CA".format(residue_target))
-        reference_CA = reference.select("protein and resnum {} and name CA".format(residue_target))
-        try:
-            RMSD = prody.calcRMSD(res_selected_reference, res_selected_target)
-            distance_bet_CA = prody.calcRMSD(reference_CA, target_CA)
-        except:
-            print("ERROR because different number of atoms in residue {}".format(residue_target))
-            print("ATOMS of the TARGET: {}".format(res_selected_target.getNames()))
-            print("ATOMS of the REFERENCE: {}".format(res_selected_reference.getNames()))
-        residue_information = (residue_target, res_selected_target.getResnames()[0], RMSD, distance_bet_CA)
-        list_of_results.append(residue_information)
-        print(residue_information)
+    for frame in range(len(frames)):
+        for n, residue_target in enumerate(residues):
+            residue_information = (int(residue_target), resnames[n], float(rmsds[frame, n]), float(ca_shifts[frame, n]))
+            if len(frames) > 1:
+                residue_information = (frame,) + residue_information
+            list_of_results.append(residue_information)
+            print(residue_information)
 
     if write2report:
         filename = write2report
         with open(filename, "w") as report:
             for result in list_of_results:
-                report.write("{:4d}\t{}\t{:5.3f}\t{:5.3f}\t{:5.3f}\n".format(result[0], result[1], float(result[2]),
-                             float(result[3]), (float(result[2]) - float(result[3]))))
+                model = "{}\t".format(result[0]) if len(result) > 4 else ""
+                result = result[-4:]
+                report.write("{}{:4d}\t{}\t{:5.3f}\t{:5.3f}\t{:5.3f}\n".format(model, result[0], result[1],
+                             float(result[2]), float(result[3]), (float(result[2]) - float(result[3]))))
+    return list_of_results
+
+
+def parse_atom_names(atom_names):
+    """
+    Atom names of an instruction: a single name or a list with the format [atom1,atomN...]
+    """
+    if "[" in atom_names or "]" in atom_names:
+        return atom_names.strip("[").strip("]").split(",")
+    return [atom_names]
 
 
 def compute_atom_distances(pdb_target, res_file, output_report, chain="L"):
     """
     This function calculate atom-atom distances for ligand and residue atoms. The residue number and atom names
-    (for both, ligand and residue) must be specified in a file ('res_file').
+    (for both, ligand and residue) must be specified in a file ('res_file'). If the PDB file has several models, the
+    distances are computed for all of them.
     :param pdb_target: input PDB file path
     :param res_file: file with instructions. This file must have n rows with three format: RESNUM LATOMNAME/SLIGAND
     ATOMNAMES/SRESIDUE. If you want to calculate a distance using a center of mass write [ATOM1,ATOM2,ATOMN]
@@ -118,67 +229,39 @@ def compute_atom_distances(pdb_target, res_file, output_report, chain="L"):
     :param chain:
     :return:
     """
-    # Load PDB files
-    target = pdb2prody(pdb_target)
-    ligand = target.select("chain {}".format(chain))
-    print(ligand.getNames())
-    # Reading instructions from file
+    # Read the topology once and resolve all the instructions to atom indices
+    atoms = read_topology(pdb_target)
+    ligand = {atom[0]: n for n, atom in enumerate(atoms) if atom[3] == chain}
+    print(list(ligand.keys()))
+    by_residue = {}
+    for n, atom in enumerate(atoms):
+        by_residue.setdefault((atom[2], atom[0]), []).append(n)
     list_of_instructions = read_selecteds_from_file(res_file)
-    # Select the input atoms
-    report = []
+    groups = []
     for line in list_of_instructions:
         resnum, atom_name_ref, atom_name_tar = line.split()
-        # If the user wants to select more than one atom he has to put them in a string with this format: [atom1,atomN...]
-        if "[" in atom_name_ref or "]" in atom_name_ref:
-            print("Multiple atom selection for the ligand")
-            atom_string_with_comas = atom_name_ref.strip("[").strip("]")
-            atom_list = atom_string_with_comas.split(",")
-            atom_string = ' '.join(atom_list)
-            atom_ref_selected = ligand.select("name {}".format(atom_string))
-            print("Selected atoms: {}".format(atom_ref_selected.getNames()))
-        else:
-            print("Single atom selection for the ligand")
-            atom_ref_selected = ligand.select("name {}".format(atom_name_ref))
-            print("Selected atom: {}".format(atom_ref_selected.getNames()))
-
-        if "[" in atom_name_tar or "]" in atom_name_tar:
-            print("Multiple atom selection for the system")
-            atom_string_with_comas = atom_name_tar.strip("[").strip("]")
-            atom_list = atom_string_with_comas.split(",")
-            atom_string = ' '.join(atom_list)
-            atom_tar_selected = select_atom_given_name_type_and_num(target, resnum, atom_string)
-            print("Selected atoms: {}".format(atom_tar_selected.getNames()))
-        else:
-            print("Single atom selection for the system")
-            atom_tar_selected = select_atom_given_name_type_and_num(target, resnum, atom_name_tar)
-            print("Selected atom: {}".format(atom_tar_selected.getNames()))
-        try:
-            number_of_selected_atoms_ref = len(atom_ref_selected.getNames())
-        except AttributeError:
+        ref_names = [name for name in parse_atom_names(atom_name_ref) if name in ligand]
+        tar_indices = [n for name in parse_atom_names(atom_name_tar) for n in by_residue.get((resnum, name), [])]
+        if not ref_names:
             exit("None atoms where selected. Please, check if the selected atoms exists in the ligand in {}".format(pdb_target))
-        try:
-            number_of_selected_atoms_tar = len(atom_tar_selected.getNames())
-        except AttributeError:
+        if not tar_indices:
             exit("None atoms where selected. Please, check if the selected atoms exists in the residue {} in {}".format(resnum, pdb_target))
-        # Now there are four possibilities: len 1 in target and ref, len > 1 in one of both and len >1 in both.
-        # If the len is more than 1 we will use the center of mass as a point to compute the distance.
-        if number_of_selected_atoms_ref <= 1 and number_of_selected_atoms_tar <= 1:
-            distance = prody.calcDistance(atom_tar_selected, atom_ref_selected)
-        elif number_of_selected_atoms_ref <= 1 and number_of_selected_atoms_tar > 1:
-            center_tar = prody.calcCenter(atom_tar_selected)
-            atom_coords = atom_ref_selected.getCoords()[0]
-            distance = np.linalg.norm(center_tar - atom_coords)
-        elif number_of_selected_atoms_ref > 1 and number_of_selected_atoms_tar <= 1:
-            center_ref = prody.calcCenter(atom_ref_selected)
-            atom_coords = atom_tar_selected.getCoords()[0]
-            distance = np.linalg.norm(atom_coords - center_ref)
-        else:
-            center_tar = prody.calcCenter(atom_tar_selected)
-            center_ref = prody.calcCenter(atom_ref_selected)
-            distance = np.linalg.norm(center_tar-center_ref)
-        report_line = "{:4} {:10} {:10} {:6.3f}\n".format(resnum, ''.join(atom_ref_selected.getNames()),
-                                                          ''.join(atom_tar_selected.getNames()), distance)
-        report.append(report_line)
+        print("Selected atoms: {} {}".format(ref_names, [atoms[n][0] for n in tar_indices]))
+        groups.append((resnum, ref_names, [ligand[name] for name in ref_names], tar_indices))
+    needed = np.unique(np.concatenate([np.array(ref + tar, dtype=int) for _, _, ref, tar in groups]))
+    positions = {n: position for position, n in enumerate(needed)}
+    frames = read_frames(pdb_target, needed)
+    # If more than one atom is selected, the center of mass is used as a point to compute the distance
+    centers_ref = np.stack([frames[:, [positions[n] for n in ref]].mean(axis=1) for _, _, ref, _ in groups], axis=1)
+    centers_tar = np.stack([frames[:, [positions[n] for n in tar]].mean(axis=1) for _, _, _, tar in groups], axis=1)
+    distances = np.linalg.norm(centers_tar - centers_ref, axis=-1)
+    report = []
+    for frame in range(len(frames)):
+        for n, (resnum, ref_names, ref, tar) in enumerate(groups):
+            model = "{:4} ".format(frame) if len(frames) > 1 else ""
+            report_line = "{}{:4} {:10} {:10} {:6.3f}\n".format(model, resnum, ''.join(ref_names),
+                                                                ''.join(atoms[i][0] for i in tar), distances[frame, n])
+            report.append(report_line)
 
     report_final = ''.join(report)
 
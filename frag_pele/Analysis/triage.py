@@ -0,0 +1,190 @@
+import logging
+import numpy as np
+# Local imports
+from frag_pele.Growing.template_fragmenter import TemplateOPLS2005
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+TRIAGE_SUMMARY = "triage_summary.tsv"
+CUTOFF = 8.0  # Angstroms
+COULOMB_CONSTANT = 332.0637  # kcal*A/(mol*e^2)
+DIELECTRIC_SLOPE = 4.  # Distance-dependent dielectric: 4r
+MAX_PAIR_ENERGY = 10.  # kcal/mol. Caps the repulsion of overlapping pairs, so a clash does not hide the rest
+# OPLS-AA sigma (A) and epsilon (kcal/mol) of the receptor atoms, by element
+RECEPTOR_LJ = {"C": (3.50, 0.066), "N": (3.25, 0.170), "O": (2.96, 0.210), "S": (3.55, 0.250), "H": (2.50, 0.030),
+               "P": (3.74, 0.200)}
+# Charges of the receptor atoms (e): OPLS-AA backbone and charged side chains, the rest are taken as neutral
+BACKBONE_CHARGES = {"N": -0.5, "H": 0.3, "CA": 0.14, "C": 0.5, "O": -0.5, "OXT": -0.5}
+SIDECHAIN_CHARGES = {("LYS", "NZ"): 1., ("ARG", "NH1"): 0.5, ("ARG", "NH2"): 0.5, ("ASP", "OD1"): -0.5,
+                     ("ASP", "OD2"): -0.5, ("GLU", "OE1"): -0.5, ("GLU", "OE2"): -0.5, ("HIP", "ND1"): 0.5,
+                     ("HIP", "NE2"): 0.5}
+ION_CHARGES = {"NA": 1., "K": 1., "MG": 2., "CA": 2., "ZN": 2., "CL": -1.}
+
+
+def read_pdb_atoms(pdb_file, chain=None, exclude_chain=None):
+    """
+    :param chain: if set, only the atoms of this chain are read.
+    :param exclude_chain: if set, the atoms of this chain are skipped.
+    :return: list of (resname, PDB atom name, element) and coordinates (n_atoms x 3).
+    """
+    atoms, coords = [], []
+    with open(pdb_file) as pdb:
+        for line in pdb:
+            if not line.startswith(("ATOM", "HETATM")):
+                continue
+            if (chain is not None and line[21] != chain) or (exclude_chain is not None and line[21] == exclude_chain):
+                continue
+            name = line[12:16]
+            element = line[76:78].strip().upper() or name.strip().lstrip("0123456789")[:1].upper()
+            atoms.append((line[17:20].strip(), name, element))
+            coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return atoms, np.array(coords, dtype=float).reshape(-1, 3)
+
+
+def get_ligand_parameters(template_path, atoms):
+    """
+    Sigma, epsilon and charge of the ligand atoms, from its OPLS2005 template (matched by PDB atom name).
+    :return: three arrays with a value for each atom.
+    """
+    template = TemplateOPLS2005(template_path)
+    # Templates write the spaces of the PDB atom names as underscores
+    parameters = {atom.pdb_atom_name.replace("_", " ").strip(): (atom.sigma, atom.epsilon, atom.charge)
+                  for atom in template.list_of_atoms.values()}
+    values = []
+    for resname, name, element in atoms:
+        try:
+            values.append(parameters[name.strip()])
+        except KeyError:
+            raise KeyError("Atom {} of the ligand not found in the template {}".format(name, template_path))
+    return tuple(np.array(column) for column in zip(*values))
+
+
+def get_receptor_parameters(atoms):
+    """
+    Sigma, epsilon and charge of the receptor atoms. There is no template of the receptor before PELE runs, so the
+    Lennard-Jones parameters are taken by element and the charges only from the backbone, charged side chains and ions.
+    :return: three arrays with a value for each atom.
+    """
+    sigma, epsilon, charge = [], [], []
+    for resname, name, element in atoms:
+        name = name.strip()
+        atom_sigma, atom_epsilon = RECEPTOR_LJ.get(element, RECEPTOR_LJ["C"])
+        sigma.append(atom_sigma)
+        epsilon.append(atom_epsilon)
+        if resname == name and resname in ION_CHARGES:
+            charge.append(ION_CHARGES[resname])
+        else:
+            charge.append(SIDECHAIN_CHARGES.get((resname, name), BACKBONE_CHARGES.get(name, 0.)))
+    return np.array(sigma), np.array(epsilon), np.array(charge)
+
+
+def get_cell_keys(cells, shape):
+    return (cells[:, 0] * shape[1] + cells[:, 1]) * shape[2] + cells[:, 2]
+
+
+def get_pairs(ligand_coords, receptor_coords, cutoff=CUTOFF):
+    """
+    Find the ligand-receptor pairs closer than the cutoff with a cell list: the receptor atoms are binned in cubic
+    cells of side cutoff, so each ligand atom is only compared to the atoms of its cell and the 26 neighbouring ones.
+    :return: indices of the ligand atoms, indices of the receptor atoms and distances of the pairs.
+    """
+    empty = np.zeros(0, dtype=int)
+    if not len(ligand_coords) or not len(receptor_coords):
+        return empty, empty, np.zeros(0)
+    # Only the receptor atoms around the ligand are binned
+    low, high = ligand_coords.min(axis=0) - cutoff, ligand_coords.max(axis=0) + cutoff
+    nearby = np.nonzero(np.all((receptor_coords >= low) & (receptor_coords <= high), axis=1))[0]
+    shape = np.floor((high - low) / cutoff).astype(int) + 1
+    receptor_keys = get_cell_keys(np.floor((receptor_coords[nearby] - low) / cutoff).astype(int), shape)
+    order = np.argsort(receptor_keys, kind="stable")
+    sorted_keys, sorted_atoms = receptor_keys[order], nearby[order]
+    # Cells of each ligand atom and its neighbours
+    offsets = np.array([(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)])
+    ligand_cells = np.floor((ligand_coords - low) / cutoff).astype(int)
+    neighbour_cells = (ligand_cells[:, np.newaxis, :] + offsets[np.newaxis]).reshape(-1, 3)
+    ligand_atoms = np.repeat(np.arange(len(ligand_coords)), len(offsets))
+    inside = np.all((neighbour_cells >= 0) & (neighbour_cells < shape), axis=1)
+    neighbour_keys = get_cell_keys(neighbour_cells[inside], shape)
+    ligand_atoms = ligand_atoms[inside]
+    starts = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+    counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - starts
+    # Expand each (ligand atom, cell) into the receptor atoms of the cell
+    ligand_index = np.repeat(ligand_atoms, counts)
+    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    receptor_index = sorted_atoms[positions]
+    distances = np.linalg.norm(ligand_coords[ligand_index] - receptor_coords[receptor_index], axis=1)
+    within = distances < cutoff
+    return ligand_index[within], receptor_index[within], distances[within]
+
+
+def compute_interaction_energy(ligand_coords, ligand_parameters, receptor_coords, receptor_parameters,
+                               cutoff=CUTOFF):
+    """
+    Nonbonded interaction energy between the ligand and the receptor: OPLS Lennard-Jones (geometric combination rules)
+    and Coulomb with a distance-dependent dielectric, summed over the pairs within the cutoff. The energy of each pair
+    is capped at MAX_PAIR_ENERGY.
+    :param ligand_parameters: sigma, epsilon and charge arrays of the ligand atoms.
+    :param receptor_parameters: sigma, epsilon and charge arrays of the receptor atoms.
+    :return: Lennard-Jones and Coulomb energies (kcal/mol).
+    """
+    ligand_index, receptor_index, distances = get_pairs(ligand_coords, receptor_coords, cutoff)
+    ligand_sigma, ligand_epsilon, ligand_charge = ligand_parameters
+    receptor_sigma, receptor_epsilon, receptor_charge = receptor_parameters
+    distances = np.maximum(distances, 0.1)
+    sigma = np.sqrt(ligand_sigma[ligand_index] * receptor_sigma[receptor_index])
+    epsilon = np.sqrt(ligand_epsilon[ligand_index] * receptor_epsilon[receptor_index])
+    ratio6 = (sigma / distances) ** 6
+    lennard_jones = np.minimum(4. * epsilon * (ratio6 ** 2 - ratio6), MAX_PAIR_ENERGY)
+    coulomb = COULOMB_CONSTANT * ligand_charge[ligand_index] * receptor_charge[receptor_index] / \
+              (DIELECTRIC_SLOPE * distances ** 2)
+    coulomb = np.clip(coulomb, -MAX_PAIR_ENERGY, MAX_PAIR_ENERGY)
+    return float(lennard_jones.sum()), float(coulomb.sum())
+
+
+def score_fragment(complex_pdb, ligand_pdb, template_path, ligand_chain="L", cutoff=CUTOFF):
+    """
+    Score the initial placement of a grown ligand (before any PELE simulation) by its interaction energy with the
+    receptor.
+    :param complex_pdb: PDB of the receptor-core complex (the ligand chain is skipped).
+    :param ligand_pdb: PDB of the grown ligand, with the fragment completely grown.
+    :param template_path: OPLS2005 template of the grown ligand.
+    :return: dictionary with the Lennard-Jones, Coulomb and total energies.
+    """
+    ligand_atoms, ligand_coords = read_pdb_atoms(ligand_pdb)
+    receptor_atoms, receptor_coords = read_pdb_atoms(complex_pdb, exclude_chain=ligand_chain)
+    lennard_jones, coulomb = compute_interaction_energy(ligand_coords,
+                                                        get_ligand_parameters(template_path, ligand_atoms),
+                                                        receptor_coords, get_receptor_parameters(receptor_atoms),
+                                                        cutoff)
+    return {"lennard_jones": lennard_jones, "coulomb": coulomb, "total": lennard_jones + coulomb}
+
+
+def rank_fragments(scores, keep=None, max_energy=None, out_file=TRIAGE_SUMMARY):
+    """
+    Rank the fragments by their triage energy (lowest first) and select the ones that will be grown.
+    :param scores: dictionary with the fragment ID as key and the dictionary returned by score_fragment as value (None
+    if it could not be scored; those fragments are kept).
+    :param keep: if set, number (> 1) or fraction (<= 1) of the scored fragments that are kept.
+    :param max_energy: if set, fragments with a higher total energy are discarded.
+    :param out_file: TSV file where the ranking is written.
+    :return: set of the IDs of the fragments kept.
+    """
+    scored = sorted((fragment for fragment in scores if scores[fragment] is not None),
+                    key=lambda fragment: scores[fragment]["total"])
+    n_keep = len(scored)
+    if keep is not None:
+        n_keep = int(keep) if keep > 1 else int(np.ceil(keep * len(scored)))
+    kept = set(fragment for fragment in scores if scores[fragment] is None)
+    lines = ["\t".join(["rank", "fragment", "lennard_jones", "coulomb", "total", "kept"])]
+    for rank, fragment in enumerate(scored, 1):
+        score = scores[fragment]
+        is_kept = rank <= n_keep and (max_energy is None or score["total"] <= max_energy)
+        if is_kept:
+            kept.add(fragment)
+        lines.append("\t".join([str(rank), fragment] + ["{:.3f}".format(score[term]) for term in
+                                                         ("lennard_jones", "coulomb", "total")] + [str(is_kept)]))
+    with open(out_file, "w") as summary:
+        summary.write("\n".join(lines) + "\n")
+    logger.info("Triage: {} of {} fragments kept. Ranking written in {}".format(len(kept), len(scores), out_file))
+    return kept
@@ -1,11 +1,18 @@
+import os
 import prody
 import logging
 import glob
+import atexit
+import numpy as np
 import multiprocessing as mp
 
 # Getting the name of the module for the log system
 logger = logging.getLogger(__name__)
 
+# Long-lived pool of workers, reused in all the checks of banned dihedrals
+_POOL = None
+_POOL_PROCESSORS = 0
+
 
 class Detector:
     def __init__(self, pdb, threshold, dihedrals, lig_chain="L"):
@@ -68,20 +75,141 @@ def checker(pdb, threshold, dihedrals, lig_chain):
     return new_detector.check_threshold_dihedral(), pdb
 
 
-def check_folder(folder, threshold, dihedrals, lig_chain="L", processors=4):
-    dict_of_checks = {}
-    list_of_pdbs = glob.glob("{}/*.pdb".format(folder))
-    multi = []
-    pool = mp.Pool(processors)
-    for pdb in list_of_pdbs:
-        multi.append(pool.apply_async(checker, [pdb, threshold, dihedrals, lig_chain]))
-    for process in multi:
-        flag, pdb = process.get()
-        dict_of_checks[pdb] = flag
-    return dict_of_checks
-
-
-
-
+def get_dihedral_indices(atom_names, dihedrals):
+    """
+    Get the positions, inside the ligand, of the atoms that form each dihedral.
+    :param atom_names: atom names of the ligand.
+    :param dihedrals: list of quartets of PDB atom names.
+    :return: array of indices (n_dihedrals x 4).
+    """
+    positions = {}
+    for index, name in enumerate(atom_names):
+        positions.setdefault(name, index)
+    try:
+        return np.array([[positions[atom] for atom in dihedral] for dihedral in dihedrals], dtype=int).reshape(-1, 4)
+    except KeyError as e:
+        raise KeyError("Atom {} of the banned dihedrals not found in the ligand".format(e))
+
+
+def compute_dihedrals(coords):
+    """
+    Compute all the dihedral angles at once, following the same convention as prody.calcDihedral.
+    :param coords: array of coordinates (... x 4 x 3) of the quartets of atoms.
+    :return: array of dihedral angles in degrees (...).
+    """
+    b1 = coords[..., 1, :] - coords[..., 0, :]
+    b2 = coords[..., 2, :] - coords[..., 1, :]
+    b3 = coords[..., 3, :] - coords[..., 2, :]
+    n1 = np.cross(b1, b2)
+    n2 = np.cross(b2, b3)
+    b2_norm = np.linalg.norm(b2, axis=-1)[..., np.newaxis]
+    radians = np.arctan2(np.sum((b2_norm * b1) * n2, axis=-1), np.sum(n1 * n2, axis=-1))
+    return np.degrees(radians)
+
+
+def index_trajectory(trajectory, lig_chain="L"):
+    """
+    Split a multi-model PDB trajectory in its models and build the index of the ligand coordinates: the lines of the
+    ligand atoms are located in the first model and then only these lines are read in the rest of models.
+    :param trajectory: PDB trajectory.
+    :param lig_chain: chain of the ligand.
+    :return: list of models (text), tuple of ligand atom names and array of ligand coordinates
+    (n_models x n_atoms x 3).
+    """
+    with open(trajectory) as trajectory_file:
+        models = [model.lstrip("\n") for model in trajectory_file.read().split("ENDMDL") if model.strip()]
+    ligand_lines = None
+    names = ()
+    coords = []
+    for model in models:
+        lines = model.splitlines()
+        if ligand_lines is None or ligand_lines[-1] >= len(lines) or \
+                tuple(lines[n][12:16].strip() for n in ligand_lines) != names:
+            ligand_lines = [n for n, line in enumerate(lines) if line[21:22] == lig_chain and
+                            line.startswith(("HETATM", "ATOM"))]
+            names = tuple(lines[n][12:16].strip() for n in ligand_lines)
+            if not ligand_lines:
+                raise ValueError("Ligand of chain {} not found in {}".format(lig_chain, trajectory))
+        coords.append([(lines[n][30:38], lines[n][38:46], lines[n][46:54]) for n in ligand_lines])
+    return models, names, np.array(coords, dtype=float)
+
+
+def get_trajectory_mask(trajectory, threshold, dihedrals, lig_chain="L"):
+    """
+    Compute, for all the snapshots of a trajectory at once, which ones do not have banned dihedrals.
+    :param trajectory: PDB trajectory.
+    :param threshold: limit angle of the banned dihedrals, in degrees.
+    :param dihedrals: list of quartets of PDB atom names.
+    :param lig_chain: chain of the ligand.
+    :return: list of models (text) and boolean array with True for the allowed snapshots.
+    """
+    models, names, coords = index_trajectory(trajectory, lig_chain)
+    indices = get_dihedral_indices(names, dihedrals)
+    angles = compute_dihedrals(coords[:, indices])
+    return models, np.all(angles >= abs(threshold), axis=1)
+
+
+def filter_trajectory(trajectory, report, output_folder, threshold, dihedrals, lig_chain="L"):
+    """
+    Write a copy of a trajectory and its report that only contains the snapshots without banned dihedrals. The first
+    snapshot (initial structure) is always kept, because it is skipped when clustering.
+    :param trajectory: PDB trajectory.
+    :param report: PELE report of the trajectory.
+    :param output_folder: folder where the filtered trajectory and report will be written.
+    :param threshold: limit angle of the banned dihedrals, in degrees.
+    :param dihedrals: list of quartets of PDB atom names.
+    :param lig_chain: chain of the ligand.
+    :return: list with the original snapshot index of each snapshot kept.
+    """
+    models, mask = get_trajectory_mask(trajectory, threshold, dihedrals, lig_chain)
+    mask[0] = True
+    kept = [int(n) for n in np.flatnonzero(mask)]
+    with open(report) as report_file:
+        report_lines = report_file.readlines()
+    with open(os.path.join(output_folder, os.path.basename(trajectory)), "w") as out_trajectory:
+        out_trajectory.write("".join("{}ENDMDL\n".format(models[n]) for n in kept))
+    with open(os.path.join(output_folder, os.path.basename(report)), "w") as out_report:
+        out_report.write("".join([report_lines[0]] + [report_lines[n + 1] for n in kept if n + 1 < len(report_lines)]))
+    return kept
+
+
+def get_pool(processors):
+    """
+    Get the long-lived pool of workers, creating it the first time (or when more processors are requested).
+    :param processors: number of processes.
+    :return: multiprocessing.Pool or None if only one processor is requested.
+    """
+    global _POOL, _POOL_PROCESSORS
+    processors = int(processors)
+    if processors < 2:
+        return None
+    if _POOL is None or _POOL_PROCESSORS < processors:
+        close_pool()
+        _POOL = mp.Pool(processors)
+        _POOL_PROCESSORS = processors
+    return _POOL
+
+
+@atexit.register
+def close_pool():
+    global _POOL, _POOL_PROCESSORS
+    if _POOL is not None:
+        _POOL.close()
+        _POOL.join()
+    _POOL = None
+    _POOL_PROCESSORS = 0
 
 
+def check_folder(folder, threshold, dihedrals, lig_chain="L", processors=4):
+    """
+    Check the banned dihedrals of all the PDB files of a folder, using the long-lived pool of workers.
+    :return: dictionary with the PDB file as key and True if it does not have banned dihedrals, False otherwise.
+    """
+    list_of_pdbs = glob.glob("{}/*.pdb".format(folder))
+    arguments = [(pdb, threshold, dihedrals, lig_chain) for pdb in list_of_pdbs]
+    pool = get_pool(processors)
+    if pool:
+        results = pool.starmap(get_trajectory_mask, arguments)
+    else:
+        results = [get_trajectory_mask(*args) for args in arguments]
+    return {pdb: bool(mask[0]) for pdb, (_, mask) in zip(list_of_pdbs, results)}
@@ -23,6 +23,8 @@ if RDKIT:
 logger = logging.getLogger(__name__)
 # Lists
 LIST_OF_IONS = ["ZN", "MN", "FE", "CO", "NI", "CA", "CD"]
+# Residue name of the ligand once the fragment has been added to the core
+GROWN_RESNAME = "GRW"
 
 
 def extract_heteroatoms_pdbs(pdb, create_file=True, ligand_chain="L", get_ligand=False, output_folder="."):
@@ -466,7 +468,7 @@ def finishing_joining(molecule, chain):
     :param molecule: ProDy molecule.
     :return: ProDy molecule with Resname "GRW" and Resnum "1".
     """
-    molecule.setResnames("GRW")
+    molecule.setResnames(GROWN_RESNAME)
     molecule.setResnums(1)
     molecule.setChids(chain)
 
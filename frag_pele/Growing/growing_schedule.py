@@ -0,0 +1,122 @@
+import os
+import re
+import glob
+import logging
+import numpy as np
+import pandas as pd
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+MIN_ACCEPTANCE = 0.2  # Below it the growing is strained
+RELAXED_ACCEPTANCE = 0.5  # Above it (without clashes) the growing is relaxed
+MAX_SPREAD = 10.0  # Standard deviation of the criteria above which the growing is strained
+MAX_OVERLAPPING = 0.25  # Fraction of spawned structures with overlapping atoms above which the growing is strained
+MIN_INCREMENT_FACTOR = 0.25  # The smallest lambda increment is this fraction of the fixed one
+MAX_INCREMENT_FACTOR = 4  # The largest lambda increment is this multiple of the fixed one
+
+
+def read_step_feedback(result_folder, report="report", criteria="Binding Energy"):
+    """
+    Read the reports of a growing step.
+    :param result_folder: results folder of the growing step.
+    :param report: prefix of the reports.
+    :param criteria: column of the reports whose spread is computed.
+    :return: acceptance rate (accepted steps / steps) and standard deviation of the criteria (without the initial
+    structures). None if there are no steps.
+    """
+    steps, accepted, values = 0, 0, []
+    for report_file in glob.glob(os.path.join(result_folder, "{}_*".format(report))):
+        if not re.search(r"\d+$", report_file):
+            continue
+        data = pd.read_csv(report_file, sep='    ', engine='python')
+        if len(data) < 2:
+            continue
+        steps += int(data.iloc[-1, 1])
+        accepted += int(data.iloc[-1, 2])
+        values.extend(data[criteria].iloc[1:])
+    if not steps:
+        return None, None
+    spread = float(np.std(values, ddof=1)) if len(values) > 1 else 0.
+    return float(accepted) / steps, spread
+
+
+class GrowingSchedule(object):
+    """
+    Lambda (fraction of the fragment grown, used by template_fragmenter) of each growing step. The fixed schedule
+    grows the fragment linearly in iterations + 1 steps. The adaptive one starts with the same increment, and after
+    each step it is doubled if the system was relaxed (high acceptance, low spread of the criteria and no overlapping
+    atoms in the spawned structures), so easy fragments need fewer PELE simulations, or halved if it was strained,
+    which adds intermediate templates to bulky fragments.
+
+    e.g.
+
+    schedule = GrowingSchedule(10, adaptive=True)
+    schedule.advance(*read_step_feedback("growing_results/aminoC1N1_growing_output0"), overlapping=0.)
+    template_fragmenter.main(..., lambda_to_reduce=schedule.lambda_value)
+    """
+
+    def __init__(self, iterations, adaptive=False, min_acceptance=MIN_ACCEPTANCE,
+                 relaxed_acceptance=RELAXED_ACCEPTANCE, max_spread=MAX_SPREAD, max_overlapping=MAX_OVERLAPPING):
+        self.iterations = iterations
+        self.adaptive = adaptive
+        self.min_acceptance = min_acceptance
+        self.relaxed_acceptance = relaxed_acceptance
+        self.max_spread = max_spread
+        self.max_overlapping = max_overlapping
+        self.base_increment = 1. / (iterations + 1)
+        self.step = 0
+        self.lambda_value = self.base_increment
+        self.increment = self.base_increment
+
+    def get_state(self):
+        return {"step": self.step, "lambda": self.lambda_value, "increment": self.increment}
+
+    def restore(self, state):
+        self.step, self.lambda_value, self.increment = state["step"], state["lambda"], state["increment"]
+
+    def is_complete(self):
+        return self.lambda_value >= 1.
+
+    def is_strained(self, acceptance, spread, overlapping):
+        return (acceptance is not None and acceptance < self.min_acceptance) or \
+               (spread is not None and spread > self.max_spread) or overlapping > self.max_overlapping
+
+    def is_relaxed(self, acceptance, spread, overlapping):
+        return acceptance is not None and acceptance >= self.relaxed_acceptance and \
+               spread is not None and spread <= self.max_spread / 2. and overlapping == 0
+
+    def advance(self, acceptance=None, spread=None, overlapping=0.):
+        """
+        Move to the next growing step, using the feedback of the previous one if the schedule is adaptive.
+        :param acceptance: acceptance rate of the previous step.
+        :param spread: standard deviation of the criteria in the previous step.
+        :param overlapping: fraction of the structures spawned from the previous step with overlapping atoms.
+        :return: lambda of the new step.
+        """
+        self.step += 1
+        if not self.adaptive:
+            self.lambda_value = min(1., float(self.step + 1) / (self.iterations + 1))
+            return self.lambda_value
+        if self.is_strained(acceptance, spread, overlapping):
+            self.increment = max(self.increment / 2., self.base_increment * MIN_INCREMENT_FACTOR)
+        elif self.is_relaxed(acceptance, spread, overlapping):
+            self.increment = min(self.increment * 2., self.base_increment * MAX_INCREMENT_FACTOR)
+        # Do not leave a last step much smaller than the others
+        if self.lambda_value + self.increment * 1.5 > 1.:
+            self.lambda_value = 1.
+        else:
+            self.lambda_value += self.increment
+        logger.info("Growing step {}: acceptance {}, spread {}, overlapping {:.2f}. Lambda {:.3f} (increment "
+                    "{:.3f})".format(self.step, acceptance, spread, overlapping, self.lambda_value, self.increment))
+        return self.lambda_value
+
+    def get_overlapping_factor(self, min_overlap, max_overlap):
+        """
+        :return: overlapping factor of the control file, interpolated linearly with lambda from min_overlap (first
+        step) to max_overlap (fragment completely grown).
+        """
+        if self.base_increment >= 1.:
+            return float(max_overlap)
+        progress = (self.lambda_value - self.base_increment) / (1. - self.base_increment)
+        return float(min_overlap) + (float(max_overlap) - float(min_overlap)) * progress
@@ -1,11 +1,11 @@
 # General imports
 import os
-import shutil
 import subprocess
 import logging
 
 # Local imports
 import frag_pele.Helpers.templatize as tp
+from frag_pele.Helpers import folder_handler
 
 # Getting the name of the module for the log system
 logger = logging.getLogger(__name__)
@@ -57,26 +57,16 @@ def control_file_modifier(control_template, pdb, license, overlap=0.7, step=0, r
     if not os.path.exists(ctrl_fold_name):
         os.mkdir(ctrl_fold_name)
 
-    # Create a copy of the control template in the control folder, because templatize.py replace the original template
-    if not os.path.exists(os.path.join(ctrl_fold_name, control_template)):
-        shutil.copyfile(controlfile_path, control_template)
-
-    # Else, if has been created this means that we already have a template in this folder, so we will need a copy of the
-    # file in the main folder to then replace the template for a real control file
-    else:
-        shutil.copyfile(controlfile_path, control_template)
-
-    # Modifying the control file template
-    tp.TemplateBuilder(control_template, keywords)
-    # Make a copy in the control files folder
+    # Render the control file in memory from the template (compiled only once per run) and write it atomically in
+    # the control files folder
     simulation_file = os.path.join(ctrl_fold_name, "{}_{}".format(step, control_template))
-    shutil.copyfile(control_template, simulation_file)
+    folder_handler.atomic_write(simulation_file, tp.render_template(controlfile_path, keywords))
     logger.info("{}_{} has been created successfully!".format(step, control_template))
 
     return simulation_file
 
 
-def simulation_runner(path_to_pele, control_in, cpus=4):
+def simulation_runner(path_to_pele, control_in, cpus=4, watcher=None, poll_interval=60, stop_timeout=60):
     """
     Runs a PELE simulation with the parameters described in the input control file.
 
@@ -85,18 +75,57 @@ def simulation_runner(path_to_pele, control_in, cpus=4):
     path_to_pele --> Complete path to PELE folder
 
     control_in --> Name of the control file with the parameters to run PELE
+
+    watcher --> If set, object with update() and converged() methods (e.g. convergence.ScoreConvergence) that is
+    updated every poll_interval seconds while PELE runs. Once it has converged, PELE is stopped (SIGTERM, and SIGKILL
+    if it has not finished after stop_timeout seconds).
+
+    Output: True if the simulation was stopped early, False otherwise
     """
     if cpus:
         cpus = int(cpus)
         if cpus < 2:
             logger.critical("Sorry, to run mpi PELE you need at least 2 CPUs!")
-        else:
-            logger.info("Starting PELE simulation. You will run mpi PELE with {} cores.".format(cpus))
-            cmd = "mpirun -np {} {} {}".format(cpus, path_to_pele, control_in)
-            logger.info("Running {}".format(cmd))
-            subprocess.call(cmd.split())
+            return False
+        logger.info("Starting PELE simulation. You will run mpi PELE with {} cores.".format(cpus))
+        cmd = "mpirun -np {} {} {}".format(cpus, path_to_pele, control_in)
     else:
         logger.info("Starting PELE simulation. You will run serial PELE.")
         cmd = "{} {}".format(path_to_pele, control_in)
-        logger.info("Running {}".format(cmd))
+    logger.info("Running {}".format(cmd))
+    if watcher is None:
         subprocess.call(cmd.split())
+        return False
+    return run_watched(cmd.split(), watcher, poll_interval, stop_timeout)
+
+
+def run_watched(cmd, watcher, poll_interval=60, stop_timeout=60):
+    """
+    Run a command, updating the watcher every poll_interval seconds, and stop it once the watcher has converged.
+    :return: True if the command was stopped, False if it finished by itself.
+    """
+    process = subprocess.Popen(cmd)
+    try:
+        while True:
+            try:
+                process.wait(timeout=poll_interval)
+                watcher.update()
+                return False
+            except subprocess.TimeoutExpired:
+                watcher.update()
+                if watcher.converged():
+                    break
+        logger.info("Convergence reached. Stopping the simulation...")
+        # mpirun forwards the SIGTERM to all the ranks
+        process.terminate()
+        try:
+            process.wait(timeout=stop_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return True
+    except BaseException:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
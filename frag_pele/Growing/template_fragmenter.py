@@ -540,7 +540,7 @@ def set_connecting_atom(template_grown, pdb_atom_name):
 
 
 def main(template_initial_path, template_grown_path, step, total_steps, hydrogen_to_replace, core_atom_linker,
-         tmpl_out_path):
+         tmpl_out_path, lambda_to_reduce=None):
     """
     Module to modify templates, currently working in OPLS2005. This main function basically compares two templates;
     an initial and a grown one, extracting the atoms of the fragment (that have been grown). Then, it uses this data
@@ -562,9 +562,12 @@ def main(template_initial_path, template_grown_path, step, total_steps, hydrogen
     :type core_atom_linker: str
     :param tmpl_out_path: Output path for the template modified.
     :type tmpl_out_path: str
+    :param lambda_to_reduce: If set, lambda parameter used instead of the one computed from step and total_steps.
+    :type lambda_to_reduce: float
     :return: None
     """
-    lambda_to_reduce = float(step/(total_steps+1))
+    if lambda_to_reduce is None:
+        lambda_to_reduce = float(step/(total_steps+1))
     templ_ini = TemplateOPLS2005(template_initial_path)
     templ_grw = TemplateOPLS2005(template_grown_path)
     fragment_atoms = detect_fragment_atoms(template_initial=templ_ini, template_grown=templ_grw,
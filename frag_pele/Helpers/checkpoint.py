@@ -0,0 +1,221 @@
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import hashlib
+import logging
+# Local imports
+from frag_pele.Helpers import folder_handler
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint_{}.json"
+FINGERPRINT_CHUNK = 65536
+REPORT_SEPARATOR = "    "
+
+
+def fingerprint(path):
+    """
+    Fast fingerprint of the content of a file: its size and a hash of its first and last 64 KB, so even the
+    trajectories of a whole campaign are fingerprinted in seconds.
+    :return: fingerprint (str), or None if the file does not exist.
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    size = os.path.getsize(path)
+    content_hash = hashlib.sha1()
+    with open(path, "rb") as content:
+        content_hash.update(content.read(FINGERPRINT_CHUNK))
+        if size > FINGERPRINT_CHUNK:
+            content.seek(max(FINGERPRINT_CHUNK, size - FINGERPRINT_CHUNK))
+            content_hash.update(content.read())
+    return "{}:{}".format(size, content_hash.hexdigest())
+
+
+def get_params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Checkpoint(object):
+    """
+    Manifest of the stages of a growing that have been completed: the hash of their parameters, the fingerprints of
+    their output files and the results needed to skip them (e.g. the atom names returned by the pre-growing). It is
+    stored as JSON in the run root and rewritten atomically after each stage.
+
+    The stages must be checked in the order they run with resume(): the first one that is not complete (or whose
+    parameters or outputs changed) and all the following ones are invalidated, so the growing restarts there.
+
+    e.g.
+
+    manifest = Checkpoint("aminoC1N1")
+    if not manifest.resume("pregrow", params):
+        results = add_fragment_from_pdbs.main(...)
+        manifest.complete("pregrow", params, outputs=[...], results=results)
+    results = manifest.get_results("pregrow")
+    """
+
+    def __init__(self, fragment_id, path=None):
+        self.fragment_id = fragment_id
+        self.path = os.path.abspath(path or CHECKPOINT_FILE.format(fragment_id))
+        self.stages = {}
+        self.invalidated = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as manifest:
+                    self.stages = json.load(manifest).get("stages", {})
+            except ValueError:
+                logger.warning("Corrupted checkpoint {}. All the stages will be run again.".format(self.path))
+
+    def save(self):
+        folder_handler.atomic_write(self.path, json.dumps({"fragment": self.fragment_id, "stages": self.stages},
+                                                          indent=1, sort_keys=True))
+
+    def reset(self, keep=()):
+        """
+        Forget the completed stages, except the ones in keep.
+        """
+        self.stages = {stage: entry for stage, entry in self.stages.items() if stage in keep}
+        self.invalidated = False
+        if self.stages:
+            self.save()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def is_done(self, stage, params):
+        """
+        :return: True if the stage was completed with the same parameters and its outputs have not changed.
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry["params"] != get_params_hash(params):
+            return False
+        return all(fingerprint(path) == value for path, value in entry["outputs"].items())
+
+    def resume(self, stage, params):
+        """
+        Check, in order, if a stage can be skipped. Once a stage has to be run, it and all the stages checked after
+        it are invalidated.
+        :return: True if the stage can be skipped.
+        """
+        if not self.invalidated and self.is_done(stage, params):
+            logger.info("Stage {} of {} already done, skipping it".format(stage, self.fragment_id))
+            return True
+        if not self.invalidated and self.stages:
+            logger.info("Restarting {} from stage {}".format(self.fragment_id, stage))
+        self.invalidated = True
+        if self.stages.pop(stage, None) is not None:
+            self.save()
+        return False
+
+    def complete(self, stage, params, outputs=(), results=None):
+        """
+        Record a stage as completed, with the fingerprints of its output files and its results (JSON serializable).
+        """
+        self.stages[stage] = {"params": get_params_hash(params), "results": results, "completed": time.time(),
+                              "outputs": {os.path.abspath(path): fingerprint(path) for path in outputs}}
+        self.save()
+
+    def get_results(self, stage):
+        return self.stages[stage]["results"]
+
+
+def read_last_row(report):
+    """
+    :return: fields of the last row of a PELE report, or None if it has no rows.
+    """
+    last = None
+    with open(report) as report_file:
+        for n, line in enumerate(report_file):
+            if n > 0 and line.strip():
+                last = line.split()
+    return last
+
+
+def get_completed_steps(folder, report_prefix="report_"):
+    """
+    Read how far each trajectory of a (possibly interrupted) PELE simulation got.
+    :return: dictionary with the trajectory number as key and (last step, accepted steps) as value.
+    """
+    completed = {}
+    for report in glob.glob(os.path.join(folder, "{}*".format(report_prefix))):
+        number = re.findall(r"(\d+)$", report)
+        last = read_last_row(report)
+        if number and last:
+            completed[int(number[0])] = (int(last[1]), int(last[2]))
+    return completed
+
+
+def extract_last_models(folder, trajectories, output_folder, traject_prefix="trajectory_"):
+    """
+    Write the last complete model (closed by ENDMDL) of each trajectory as a PDB file, to continue the simulation from
+    there.
+    :param trajectories: trajectory numbers.
+    :return: list of the PDB files written, in the order of trajectories.
+    """
+    folder_handler.check_and_create_folder(output_folder)
+    output_files = []
+    for trajectory in trajectories:
+        model, last_model = [], []
+        with open(os.path.join(folder, "{}{}.pdb".format(traject_prefix, trajectory))) as trajectory_file:
+            for line in trajectory_file:
+                if line.startswith("MODEL"):
+                    model = []
+                elif line.startswith("ENDMDL"):
+                    last_model = model
+                else:
+                    model.append(line)
+        if not last_model:
+            raise ValueError("Trajectory {} of {} has no complete model to continue from".format(trajectory, folder))
+        model = last_model
+        output_file = os.path.join(output_folder, "last_{}.pdb".format(trajectory))
+        with open(output_file, "w") as pdb:
+            pdb.writelines(model)
+        output_files.append(output_file)
+    return output_files
+
+
+def merge_continuation(folder, continuation_folder, completed, total_steps, report_prefix="report_",
+                       traject_prefix="trajectory_"):
+    """
+    Append the steps of a continuation simulation (started from the last model of each trajectory) to the reports and
+    trajectories of the interrupted one, shifting the steps, accepted steps and model numbers and dropping the steps
+    beyond total_steps. The continuation folder is removed at the end.
+    :param completed: steps done in each trajectory before the continuation, as returned by get_completed_steps.
+    """
+    for trajectory, (done_steps, done_accepted) in sorted(completed.items()):
+        report_file = os.path.join(continuation_folder, "{}{}".format(report_prefix, trajectory))
+        if not os.path.exists(report_file):
+            continue
+        rows = []
+        with open(report_file) as report:
+            # Skip the header and the initial structure, which is the last one of the interrupted simulation
+            for line in list(report)[2:]:
+                fields = line.split()
+                if not fields or done_steps + int(fields[1]) > total_steps:
+                    break
+                fields[1] = str(done_steps + int(fields[1]))
+                fields[2] = str(done_accepted + int(fields[2]))
+                rows.append(REPORT_SEPARATOR + REPORT_SEPARATOR.join(fields) + REPORT_SEPARATOR + "\n")
+        last_accepted = int(rows[-1].split()[2]) - done_accepted if rows else 0
+        models = []
+        with open(os.path.join(continuation_folder, "{}{}.pdb".format(traject_prefix, trajectory))) as trajectory_file:
+            model = None
+            for line in trajectory_file:
+                if line.startswith("MODEL"):
+                    # Models are numbered accepted steps + 1
+                    accepted = int(line.split()[1]) - 1
+                    model = [] if 0 < accepted <= last_accepted else None
+                    if model is not None:
+                        model.append("MODEL     {:4d}\n".format(done_accepted + accepted + 1))
+                elif model is not None:
+                    model.append(line)
+                    if line.startswith("ENDMDL"):
+                        models.extend(model)
+        # Trajectory first, so an interruption here leaves the report (the reference of the progress) untouched
+        with open(os.path.join(folder, "{}{}.pdb".format(traject_prefix, trajectory)), "a") as trajectory_file:
+            trajectory_file.writelines(models)
+        with open(os.path.join(folder, "{}{}".format(report_prefix, trajectory)), "a") as report:
+            report.writelines(rows)
+    shutil.rmtree(continuation_folder, ignore_errors=True)
@@ -7,11 +7,34 @@ from AdaptivePELE.utilities import utilities
 import pandas as pd
 import glob
 import os
+import re
+import shutil
+import logging
+import tempfile
+from frag_pele.Banner import Detector
+from frag_pele.Helpers import timing
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
 
 
 def cluster_traject(resname, trajToDistribute, columnToChoose, distance_contact, clusterThreshold, path_to_cluster,
                     output_path, mapping_out, epsilon=0.5, report_basename="report", condition="min",
-                    metricweights="linear", nclusters=5):
+                    metricweights="linear", nclusters=5, banned=None, limit=None, lig_chain="L", processors=1):
+
+    # Only the snapshots without banned dihedrals are eligible to spawn
+    snapshots_mapping = None
+    banned_folder = None
+    if banned:
+        banned_folder = tempfile.mkdtemp(prefix="banned_filter_", dir=mapping_out)
+        # Timed on its own, although it is also part of the clustering span
+        with timing.span("dihedral_ban"):
+            snapshots_mapping = filter_banned_snapshots(path_to_cluster, banned_folder, report_basename, limit, banned,
+                                                        lig_chain, processors)
+        if snapshots_mapping:
+            path_to_cluster = os.path.join(banned_folder, os.path.basename(path_to_cluster))
+        else:
+            logger.warning("All the snapshots have banned dihedrals. Clustering without filtering them.")
 
     outputPathConst = constants.OutputPathConstants(output_path)
     outputPathConst.tmpFolder = output_path
@@ -41,10 +64,44 @@ def cluster_traject(resname, trajToDistribute, columnToChoose, distance_contact,
 
     _, procMapping = spawningObject.writeSpawningInitialStructures(outputPathConst, degeneracy, clusteringObject,
                                                                    0)
+    if snapshots_mapping:
+        # Translate the snapshots of the filtered trajectories to the ones of the original trajectories
+        procMapping = [(epoch, trajectory, snapshots_mapping[trajectory][snapshot])
+                       for epoch, trajectory, snapshot in procMapping]
+    if banned_folder:
+        shutil.rmtree(banned_folder, ignore_errors=True)
     processorManagerFilename = "processorMapping.txt"
     utilities.writeProcessorMappingToDisk(mapping_out, processorManagerFilename, procMapping)
 
 
+def filter_banned_snapshots(path_to_cluster, output_folder, report_basename, limit, banned, lig_chain="L",
+                            processors=1):
+    """
+    Write in output_folder a copy of each trajectory (and its report) that only contains the snapshots without banned
+    dihedrals. The trajectories are filtered in parallel with the long-lived pool of the Detector.
+    :return: dictionary with the trajectory number as key and the list of original snapshot indexes kept as value.
+    Empty if no snapshot passes the filter.
+    """
+    trajectories = sorted(glob.glob(path_to_cluster))
+    trajectory_numbers = [int(re.findall(r"(\d+)", os.path.basename(trajectory))[-1]) for trajectory in trajectories]
+    arguments = [(trajectory, os.path.join(os.path.dirname(trajectory), "{}_{}".format(report_basename, number)),
+                  output_folder, limit, banned, lig_chain) for trajectory, number in zip(trajectories, trajectory_numbers)]
+    pool = Detector.get_pool(processors)
+    if pool:
+        kept_snapshots = pool.starmap(Detector.filter_trajectory, arguments)
+    else:
+        kept_snapshots = [Detector.filter_trajectory(*args) for args in arguments]
+    snapshots_mapping = {}
+    any_kept = False
+    for trajectory, trajectory_number, kept in zip(trajectories, trajectory_numbers, kept_snapshots):
+        snapshots_mapping[trajectory_number] = kept
+        any_kept = any_kept or len(kept) > 1
+        logger.info("{} snapshots of {} without banned dihedrals".format(len(kept) - 1, trajectory))
+    if not any_kept:
+        return {}
+    return snapshots_mapping
+
+
 def get_column_num(path, header_column, report_basename="report"):
     reports = glob.glob(os.path.join(path, "*{}*".format(report_basename)))
     try:
@@ -0,0 +1,243 @@
+import os
+import glob
+import heapq
+import logging
+import argparse
+import numpy as np
+# Local imports
+from frag_pele import serie_handler
+from frag_pele.Helpers import timing
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+FEATURES = ("ligand_atoms", "rotatable_bonds", "receptor_atoms")
+TIMINGS_PATTERN = os.path.join("**", timing.TIMINGS_FILE.format("*"))
+BOND_DISTANCE = 1.9  # Angstroms. Heavy atoms closer than this are bonded
+LANE_FILE = "{}_lane{}{}"
+
+
+def read_heavy_atoms(pdb_file, chain=None, exclude_chain=None):
+    """
+    :return: coordinates (n_atoms x 3) of the heavy atoms of a PDB file (optionally of a chain or of all the chains
+    except one).
+    """
+    coords = []
+    with open(pdb_file) as pdb:
+        for line in pdb:
+            if not line.startswith(("ATOM", "HETATM")):
+                continue
+            if (chain is not None and line[21] != chain) or (exclude_chain is not None and line[21] == exclude_chain):
+                continue
+            element = line[76:78].strip().upper() or line[12:16].strip().lstrip("0123456789")[:1].upper()
+            if element != "H":
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return np.array(coords, dtype=float).reshape(-1, 3)
+
+
+def estimate_rotatable_bonds(coords):
+    """
+    Estimate the rotatable bonds of a molecule from the coordinates of its heavy atoms: bonds (by distance) that are
+    not in a ring and join two atoms with other heavy neighbours.
+    """
+    distances = np.linalg.norm(coords[:, np.newaxis] - coords[np.newaxis], axis=-1)
+    bonded = (distances < BOND_DISTANCE) & ~np.eye(len(coords), dtype=bool)
+    neighbours = [set(np.nonzero(row)[0]) for row in bonded]
+    rotatable = 0
+    for i, j in zip(*np.nonzero(np.triu(bonded))):
+        if len(neighbours[i]) < 2 or len(neighbours[j]) < 2:
+            continue
+        # The bond is in a ring if j can be reached from i without it
+        visited, pending = {i}, [n for n in neighbours[i] if n != j]
+        while pending and j not in visited:
+            node = pending.pop()
+            if node not in visited:
+                visited.add(node)
+                pending.extend(neighbours[node] - visited)
+        if j not in visited:
+            rotatable += 1
+    return rotatable
+
+
+def get_features(complex_pdb, fragment_pdbs, ligand_chain="L"):
+    """
+    Features of a growing used by the cost model: heavy atoms of the grown ligand, its rotatable bonds and heavy atoms
+    of the receptor. They are computed from the inputs only, so they are the same when the model is fitted (after the
+    growing) and when it is used (before it).
+    :param complex_pdb: PDB of the receptor with the original core.
+    :param fragment_pdbs: fragment PDB (or list of the fragments grown so far, for successive growings).
+    :return: dictionary with the features.
+    """
+    if isinstance(fragment_pdbs, str):
+        fragment_pdbs = [fragment_pdbs]
+    core = read_heavy_atoms(complex_pdb, chain=ligand_chain)
+    fragments = [read_heavy_atoms(fragment_pdb) for fragment_pdb in fragment_pdbs]
+    # Each fragment adds its bond to the core
+    rotatable_bonds = estimate_rotatable_bonds(core) + sum(estimate_rotatable_bonds(fragment) + 1
+                                                           for fragment in fragments)
+    return {"ligand_atoms": len(core) + sum(len(fragment) for fragment in fragments),
+            "rotatable_bonds": rotatable_bonds,
+            "receptor_atoms": len(read_heavy_atoms(complex_pdb, exclude_chain=ligand_chain))}
+
+
+class CostModel(object):
+    """
+    Linear model of the wall time of a growing from its features, fitted by least squares on the total spans recorded
+    by timing (which store the features of each fragment). Without enough spans, the cost is estimated as
+    ligand_atoms * (1 + rotatable_bonds), which is enough to order the growings.
+
+    e.g.
+
+    model = CostModel.from_timings(glob.glob("runs/**/timings_*.jsonl", recursive=True))
+    cost = model.estimate(get_features("complex.pdb", "fragment.pdb"))
+    """
+
+    def __init__(self):
+        self.coefficients = None
+
+    @classmethod
+    def from_timings(cls, timing_files):
+        model = cls()
+        spans = [span for span in timing.read_spans(timing_files) if span["stage"] == timing.TOTAL_STAGE and
+                 span["status"] == "ok" and all(feature in span for feature in FEATURES)]
+        model.fit([[span[feature] for feature in FEATURES] for span in spans], [span["wall_s"] for span in spans])
+        return model
+
+    @staticmethod
+    def get_design_matrix(features):
+        features = np.asarray(features, dtype=float).reshape(-1, len(FEATURES))
+        return np.hstack([np.ones((len(features), 1)), features])
+
+    def fit(self, features, wall_times):
+        """
+        :param features: list with the values of FEATURES of each growing.
+        :param wall_times: wall time of each growing, in seconds.
+        """
+        design = self.get_design_matrix(features)
+        # At least one more sample than coefficients, otherwise the fit is meaningless
+        if len(design) <= design.shape[1]:
+            logger.info("Only {} growings timed: the cost will be estimated from the size of the ligands".format(
+                len(design)))
+            self.coefficients = None
+            return
+        self.coefficients, _, _, _ = np.linalg.lstsq(design, np.asarray(wall_times, dtype=float), rcond=None)
+        logger.info("Cost model fitted with {} growings: {}".format(len(design), ", ".join(
+            "{} {:.3g}".format(name, value) for name, value in zip(("intercept",) + FEATURES, self.coefficients))))
+
+    def estimate(self, features):
+        """
+        :param features: dictionary with the features of a growing.
+        :return: estimated cost (seconds if the model is fitted, arbitrary units otherwise).
+        """
+        if self.coefficients is None:
+            return float(features["ligand_atoms"] * (1 + features["rotatable_bonds"]))
+        cost = self.get_design_matrix([features[feature] for feature in FEATURES]).dot(self.coefficients)[0]
+        return max(float(cost), 1.)
+
+
+def pack_longest_first(costs, n_lanes):
+    """
+    Longest-processing-time-first scheduling: jobs are taken from the most to the least expensive and each one is
+    assigned to the lane that finishes first.
+    :param costs: list with the cost of each job.
+    :return: list of lanes (lists of job indices, in the order they run) and list with the load of each lane.
+    """
+    lanes = [[] for _ in range(n_lanes)]
+    loads = [0.] * n_lanes
+    heap = [(0., lane) for lane in range(n_lanes)]
+    for job in sorted(range(len(costs)), key=lambda job: -costs[job]):
+        load, lane = heapq.heappop(heap)
+        lanes[lane].append(job)
+        loads[lane] = load + costs[job]
+        heapq.heappush(heap, (loads[lane], lane))
+    return lanes, loads
+
+
+def get_instruction_fragments(instruction):
+    """
+    :return: fragment PDBs of an instruction of the serie file and the ID of its run root.
+    """
+    if type(instruction) == list:
+        return [task[0] for task in instruction], instruction[0][3]
+    return [instruction[0]], instruction[3]
+
+
+def schedule_instructions(instructions, complex_pdb, n_lanes, timing_files=(), ligand_chain="L"):
+    """
+    Estimate the cost of each growing of a serie file and distribute them in lanes (e.g. jobs of an allocation that
+    run at the same time) longest-first, to minimise the total wall time. Only the inputs and the timings given are
+    read, so the same arguments always give the same lanes.
+    :param instructions: instructions as returned by serie_handler.read_instructions_from_file.
+    :param timing_files: JSONL files of timed growings to fit the cost model.
+    :return: list of lanes (lists of instructions, in the order they run) and list with the estimated load of each.
+    """
+    model = CostModel.from_timings(timing_files)
+    costs = []
+    for instruction in instructions:
+        fragment_pdbs, ID = get_instruction_fragments(instruction)
+        # Successive growings cost the sum of their growings, each one with the ligand grown so far
+        costs.append(sum(model.estimate(get_features(complex_pdb, fragment_pdbs[:n + 1], ligand_chain))
+                         for n in range(len(fragment_pdbs))))
+    lanes, loads = pack_longest_first(costs, n_lanes)
+    for lane, load in enumerate(loads):
+        logger.info("Lane {}: {} growings, estimated cost {:.1f}".format(lane, len(lanes[lane]), load))
+    return [[instructions[job] for job in lane] for lane in lanes], loads
+
+
+def find_timing_files(folder="."):
+    return sorted(glob.glob(os.path.join(folder, TIMINGS_PATTERN), recursive=True))
+
+
+def get_lane_file(serie_file, lane):
+    """
+    :return: serie file with the growings of a lane, as written by main.
+    """
+    root, extension = os.path.splitext(serie_file)
+    return LANE_FILE.format(root, lane, extension)
+
+
+def parse_arguments():
+    """
+    Parse user arguments
+
+    Output: list with all the user arguments
+    """
+    parser = argparse.ArgumentParser(description="""Estimate the cost of the growings of a serie file with a model
+    fitted on the timings of previous growings, and split it longest-first in several serie files that take about the
+    same time. Run it once before launching the lanes (python -m frag_pele.main ... --lanes N --lane k), so they all
+    share the same split.""")
+    required_named = parser.add_argument_group('required named arguments')
+    required_named.add_argument("-cp", "--complex_pdb", required=True,
+                                help="Path to the PDB file which must contain a protein-ligand complex.")
+    required_named.add_argument("-sef", "--serie_file", required=True,
+                                help="Name of the tabular file which must contain the instructions of the growings.")
+    parser.add_argument("-n", "--lanes", type=int, default=2, help="Number of serie files written.")
+    parser.add_argument("-t", "--timings", default=".",
+                        help="Folder searched (recursively) for the timings of previous growings.")
+    parser.add_argument("-cc", "--c_chain", default="L", help="Chain name of the core.")
+    args = parser.parse_args()
+    return args.complex_pdb, args.serie_file, args.lanes, args.timings, args.c_chain
+
+
+def main(complex_pdb, serie_file, n_lanes, timings_folder=".", ligand_chain="L"):
+    instructions = serie_handler.read_instructions_from_file(serie_file)
+    with open(serie_file) as serie:
+        lines = [line for line in serie if len(line.split()) >= 3]
+    lanes, loads = schedule_instructions(instructions, complex_pdb, n_lanes, find_timing_files(timings_folder),
+                                         ligand_chain)
+    # Every instruction comes from one line of the serie file
+    line_of = {id(instruction): line for instruction, line in zip(instructions, lines)}
+    output_files = []
+    for lane, lane_instructions in enumerate(lanes):
+        output_file = get_lane_file(serie_file, lane)
+        with open(output_file, "w") as output:
+            output.writelines(line_of[id(instruction)] for instruction in lane_instructions)
+        output_files.append(output_file)
+        print("{}\t{} growings\testimated cost {:.1f}".format(output_file, len(lane_instructions), loads[lane]))
+    return output_files
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    complex_pdb, serie_file, n_lanes, timings_folder, ligand_chain = parse_arguments()
+    main(complex_pdb, serie_file, n_lanes, timings_folder, ligand_chain)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Stand-in for the PELE executable, to run (and benchmark) the Python side of FrAG without PELE, its license or
+Schrodinger. It reads the rendered control file and, for each trajectory, writes a report_N file and a multi-model
+trajectory_N.pdb file obtained by perturbing the coordinates of the input complex (the ligand is moved as a rigid
+body plus some noise and the rest of atoms only get a small noise).
+
+Usage (same as PELE):
+
+    fake_pele.py control_file.conf
+    mpirun -np 4 fake_pele.py control_file.conf
+
+Under MPI, rank 0 acts as the master (it only writes the log) and each rank N > 0 writes the trajectory N, as
+PELE does. In serial mode it writes one trajectory per input complex (or FAKE_PELE_TRAJECTORIES).
+
+The size and latency of the simulations are configured with environment variables:
+
+    FAKE_PELE_STEPS: number of PELE steps (overrides numberOfPeleSteps of the control file).
+    FAKE_PELE_TRAJECTORIES: number of trajectories in serial mode.
+    FAKE_PELE_ACCEPTANCE: probability of accepting a step (default 0.6).
+    FAKE_PELE_STEP_TIME: seconds that each step takes (default 0).
+    FAKE_PELE_STARTUP_TIME: seconds that the start-up takes (default 0).
+    FAKE_PELE_TRANSLATION: standard deviation of the translations of the ligand, in Angstroms (default 0.3).
+    FAKE_PELE_NOISE: standard deviation of the noise of the atoms that are not perturbed, in Angstroms (default 0.01).
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+MPI_VARIABLES = (("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"), ("PMI_RANK", "PMI_SIZE"),
+                 ("MV2_COMM_WORLD_RANK", "MV2_COMM_WORLD_SIZE"))
+METRIC_NAMES = {"bindingEnergy": "Binding Energy"}
+REPORT_SEPARATOR = "    "
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Stand-in for the PELE executable, for offline tests and benchmarks.")
+    parser.add_argument("control_file", help="PELE control file.")
+    args = parser.parse_args()
+    return args.control_file
+
+
+def get_setting(name, default, type_=float):
+    value = os.environ.get(name)
+    return default if value in (None, "") else type_(value)
+
+
+def get_mpi_rank():
+    """
+    :return: rank of the process if it runs under MPI (with more than one process), None otherwise.
+    """
+    for rank, size in MPI_VARIABLES:
+        if os.environ.get(rank) not in (None, "") and int(os.environ.get(size) or 1) > 1:
+            return int(os.environ[rank])
+    return None
+
+
+def read_control_file(control_file):
+    """
+    Read the settings that the stand-in needs from a (rendered) PELE control file.
+    :return: dictionary with the input complexes, number of steps, seed, output paths, chains to perturb, metrics and
+    log path.
+    """
+    with open(control_file) as control:
+        data = json.load(control)
+    initialization = data["Initialization"]
+    if "MultipleComplex" in initialization:
+        complexes = [complex_["files"][0]["path"] for complex_ in initialization["MultipleComplex"]]
+    else:
+        complexes = [initialization["Complex"]["files"][0]["path"]]
+    command = data["commands"][0]
+    output = command["PELE_Output"]
+    metrics = []
+    for task in command.get("PeleTasks", []):
+        for metric in task.get("metrics", []):
+            metrics.append((metric["type"], metric.get("tag", METRIC_NAMES.get(metric["type"], metric["type"]))))
+    return {"complexes": complexes,
+            "steps": int(command["PELE_Parameters"]["numberOfPeleSteps"]),
+            "seed": int(command.get("RandomGenerator", {}).get("seed", 0)),
+            "report": output["reportPath"],
+            "trajectory": output["trajectoryPath"],
+            "chains": command.get("selectionToPerturb", {}).get("chains", {}).get("names", ["L"]),
+            "metrics": metrics,
+            "log": data.get("simulationLogPath")}
+
+
+def read_complex(pdb_file):
+    """
+    :return: lines of the atoms of a PDB file and their coordinates (n_atoms x 3).
+    """
+    lines = []
+    with open(pdb_file) as pdb:
+        for line in pdb:
+            if line.startswith(("ATOM", "HETATM")):
+                lines.append(line.rstrip("\n").ljust(80))
+            elif line.startswith("ENDMDL"):
+                break
+    coords = np.array([(line[30:38], line[38:46], line[46:54]) for line in lines], dtype=float).reshape(-1, 3)
+    return lines, coords
+
+
+def format_model(lines, coords, model):
+    content = ["MODEL     {:4d}\n".format(model)]
+    for line, (x, y, z) in zip(lines, coords):
+        content.append("{}{:8.3f}{:8.3f}{:8.3f}{}\n".format(line[:30], x, y, z, line[54:].rstrip()))
+    content.append("ENDMDL\n")
+    return "".join(content)
+
+
+def random_rotation(rng, sigma_degrees=5.):
+    """
+    Small random rotation (axis-angle) matrix.
+    """
+    axis = rng.normal(size=3)
+    axis /= np.linalg.norm(axis)
+    angle = np.radians(rng.normal(scale=sigma_degrees))
+    cross = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    return np.eye(3) + np.sin(angle) * cross + (1 - np.cos(angle)) * cross.dot(cross)
+
+
+def get_metric_values(metrics, binding_energy, rng):
+    values = []
+    for metric_type, tag in metrics:
+        if metric_type == "bindingEnergy":
+            values.append(binding_energy)
+        elif metric_type == "sasa":
+            values.append(rng.uniform(0., 0.5))
+        else:
+            values.append(rng.uniform())
+    return values
+
+
+def run_trajectory(settings, trajectory_id, complex_pdb):
+    """
+    Write the report and the trajectory of a fake simulation.
+    """
+    rng = np.random.default_rng(settings["seed"] + trajectory_id)
+    steps = get_setting("FAKE_PELE_STEPS", settings["steps"], int)
+    acceptance = get_setting("FAKE_PELE_ACCEPTANCE", 0.6)
+    step_time = get_setting("FAKE_PELE_STEP_TIME", 0.)
+    translation = get_setting("FAKE_PELE_TRANSLATION", 0.3)
+    noise = get_setting("FAKE_PELE_NOISE", 0.01)
+    lines, coords = read_complex(complex_pdb)
+    perturbed = np.array([line[21:22] in settings["chains"] for line in lines], dtype=bool)
+    report_file = "{}_{}".format(settings["report"], trajectory_id)
+    trajectory_root, trajectory_ext = os.path.splitext(settings["trajectory"])
+    trajectory_file = "{}_{}{}".format(trajectory_root, trajectory_id, trajectory_ext or ".pdb")
+    for path in (report_file, trajectory_file):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = ["#Task", "Step", "numberOfAcceptedPeleSteps", "currentEnergy"] + [tag for _, tag in settings["metrics"]]
+    target_energy = rng.normal(-50., 5.)
+    binding_energy = rng.normal(-30., 3.)
+    current_energy = rng.normal(-13500., 10.)
+    accepted = 0
+    with open(report_file, "w") as report, open(trajectory_file, "w") as trajectory:
+        report.write(REPORT_SEPARATOR.join(header) + REPORT_SEPARATOR + "\n")
+        for step in range(steps + 1):
+            if step > 0:
+                if step_time:
+                    time.sleep(step_time)
+                if rng.uniform() > acceptance:
+                    continue
+                accepted += 1
+                center = coords[perturbed].mean(axis=0) if perturbed.any() else np.zeros(3)
+                coords[perturbed] = (coords[perturbed] - center).dot(random_rotation(rng).T) + center + \
+                                    rng.normal(scale=translation, size=3)
+                coords += rng.normal(scale=noise, size=coords.shape)
+                binding_energy = target_energy + (binding_energy - target_energy) * 0.9 + rng.normal(scale=1.5)
+                current_energy += rng.normal(scale=5.)
+            values = [1, step, accepted, current_energy] + get_metric_values(settings["metrics"], binding_energy, rng)
+            report.write(REPORT_SEPARATOR + REPORT_SEPARATOR.join(format_value(value) for value in values) +
+                         REPORT_SEPARATOR + "\n")
+            trajectory.write(format_model(lines, coords, accepted + 1))
+
+
+def format_value(value):
+    if isinstance(value, (int, np.integer)):
+        return str(value)
+    return "{:.4f}".format(value).rstrip("0").rstrip(".")
+
+
+def main(control_file):
+    settings = read_control_file(control_file)
+    time.sleep(get_setting("FAKE_PELE_STARTUP_TIME", 0.))
+    rank = get_mpi_rank()
+    if rank is None:
+        n_trajectories = get_setting("FAKE_PELE_TRAJECTORIES", len(settings["complexes"]), int)
+        trajectory_ids = range(1, n_trajectories + 1)
+    elif rank == 0:
+        trajectory_ids = []
+    else:
+        trajectory_ids = [rank]
+    for trajectory_id in trajectory_ids:
+        complex_pdb = settings["complexes"][(trajectory_id - 1) % len(settings["complexes"])]
+        run_trajectory(settings, trajectory_id, complex_pdb)
+    if settings["log"] and rank in (None, 0):
+        if os.path.dirname(settings["log"]) and not os.path.exists(os.path.dirname(settings["log"])):
+            os.makedirs(os.path.dirname(settings["log"]), exist_ok=True)
+        with open(settings["log"], "a") as log:
+            log.write("Fake PELE simulation of {} finished\n".format(control_file))
+
+
+if __name__ == "__main__":
+    main(parse_arguments())
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Stand-in for PlopRotTemp_S_2017/ligand_prep.py (PlopRotTemp + ffld_server), to run (and benchmark) FrAG without
+Schrodinger. It has the same command line and, for each ligand PDB, writes a valid OPLS2005 template and a rotamers
+library in the same folders. The parameters are generic (by element) and the topology is built from the CONECT records
+or, if there are not, from the interatomic distances.
+
+Usage (same as ligand_prep.py):
+
+    python fake_plop.py ligand1.pdb [ligand2.pdb ...] gridres [--out_temp folder] [--out_rot folder]
+
+    python -m frag_pele.main ... -pl Helpers/fake_plop.py -sch $(which python)
+
+FAKE_PLOP_TIME sets the seconds that each ligand takes (default 0).
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+# Local import
+frag_pele_dirname = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(frag_pele_dirname)
+from frag_pele.Growing import template_fragmenter as tf
+
+TEMPLATES_OUT = "DataLocal/Templates/OPLS2005/HeteroAtoms/templates_generated"
+ROTAMERS_OUT = "DataLocal/LigandRotamerLibs/"
+# Element: (atom type, sigma, epsilon, covalent radius, SGB radius, gamma, alpha)
+ELEMENT_PARAMETERS = {"H": ("HC", 2.5, 0.03, 0.31, 1.25, 0.0, 0.0),
+                      "C": ("CT", 3.5, 0.066, 0.76, 1.975, 0.005, -0.741),
+                      "N": ("NT", 3.3, 0.17, 0.71, 1.8, 0.018, -0.6),
+                      "O": ("OH", 3.12, 0.17, 0.66, 1.77, 0.011, -0.5),
+                      "S": ("SH", 3.6, 0.25, 1.05, 2.0, 0.005, -0.5),
+                      "P": ("P", 3.74, 0.2, 1.07, 2.15, 0.005, -0.5),
+                      "F": ("F", 2.94, 0.061, 0.57, 1.47, 0.005, -0.5),
+                      "CL": ("Cl", 3.4, 0.3, 1.02, 1.75, 0.005, -0.5),
+                      "BR": ("Br", 3.47, 0.47, 1.2, 1.85, 0.005, -0.5),
+                      "I": ("I", 3.75, 0.6, 1.39, 1.98, 0.005, -0.5)}
+BOND_TOLERANCE = 0.45
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser(description="Stand-in for PlopRotTemp, for offline tests and benchmarks.")
+    parser.add_argument("pdb", type=str, nargs="+", help="ligand files to templatize")
+    parser.add_argument("gridres", type=str, help="Degrees of rotation.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Ignored, kept for compatibility.")
+    parser.add_argument("--out_temp", type=str, default=TEMPLATES_OUT, help="Template output path")
+    parser.add_argument("--out_rot", type=str, default=ROTAMERS_OUT, help="Rotamer ouput path")
+    args = parser.parse_args()
+    return args.pdb, args.gridres, args.out_temp, args.out_rot
+
+
+def read_ligand(pdb_file, ligand_chain="L"):
+    """
+    Read the atoms of the ligand of a PDB file: the chain L if there is one, the HETATM records otherwise.
+    :return: residue name, list of (serial, PDB atom name, element), coordinates (n_atoms x 3) and CONECT bonds (as
+    pairs of serials).
+    """
+    atoms = []
+    conect = []
+    with open(pdb_file) as pdb:
+        lines = pdb.readlines()
+    records = [line for line in lines if line.startswith(("ATOM", "HETATM"))]
+    selected = [line for line in records if line[21:22] == ligand_chain] or \
+               [line for line in records if line.startswith("HETATM")] or records
+    resname = selected[0][17:20].strip()
+    selected = [line for line in selected if line[17:20].strip() == resname]
+    for line in selected:
+        name = line[12:16]
+        element = line[76:78].strip().upper() or name.strip().lstrip("0123456789")[:1].upper()
+        atoms.append((line[6:11].strip(), name, element))
+    for line in lines:
+        if line.startswith("CONECT"):
+            fields = [line[n:n + 5].strip() for n in range(6, len(line.rstrip("\n")), 5)]
+            for bonded in [field for field in fields if field]:
+                conect.append((line[6:11].strip(), bonded))
+    coords = np.array([(line[30:38], line[38:46], line[46:54]) for line in selected], dtype=float).reshape(-1, 3)
+    return resname, atoms, coords, conect
+
+
+def get_bonds(atoms, coords, conect):
+    """
+    :return: set of bonds (pairs of indices, i < j).
+    """
+    serials = {atom[0]: n for n, atom in enumerate(atoms)}
+    bonds = set()
+    for serial1, serial2 in conect:
+        if serial1 in serials and serial2 in serials and serial1 != serial2:
+            bonds.add(tuple(sorted((serials[serial1], serials[serial2]))))
+    if bonds:
+        return bonds
+    radii = np.array([ELEMENT_PARAMETERS.get(atom[2], ELEMENT_PARAMETERS["C"])[3] for atom in atoms])
+    distances = np.linalg.norm(coords[:, np.newaxis] - coords[np.newaxis], axis=-1)
+    limits = radii[:, np.newaxis] + radii[np.newaxis] + BOND_TOLERANCE
+    for i, j in zip(*np.nonzero(np.triu(distances < limits, k=1))):
+        bonds.add((int(i), int(j)))
+    return bonds
+
+
+def get_ring_bonds(n_atoms, bonds):
+    """
+    :return: set of the bonds that are in a ring (i.e. that are not bridges of the molecular graph).
+    """
+    neighbours = {n: [] for n in range(n_atoms)}
+    for i, j in bonds:
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    order = {}
+    low = {}
+    bridges = set()
+    for root in range(n_atoms):
+        if root in order:
+            continue
+        stack = [(root, None, iter(neighbours[root]))]
+        order[root] = low[root] = len(order)
+        while stack:
+            node, parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if parent is not None:
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > order[parent]:
+                        bridges.add(tuple(sorted((parent, node))))
+            elif child == parent:
+                continue
+            elif child in order:
+                low[node] = min(low[node], order[child])
+            else:
+                order[child] = low[child] = len(order)
+                stack.append((child, node, iter(neighbours[child])))
+    return set(bonds) - bridges
+
+
+def angle(a, b, c):
+    v1, v2 = a - b, c - b
+    cosine = np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+    return float(np.degrees(np.arccos(np.clip(cosine, -1., 1.))))
+
+
+def dihedral(a, b, c, d):
+    b1, b2, b3 = b - a, c - b, d - c
+    n1, n2 = np.cross(b1, b2), np.cross(b2, b3)
+    return float(np.degrees(np.arctan2(np.linalg.norm(b2) * np.dot(b1, n2), np.dot(n1, n2))))
+
+
+def build_template(resname, atoms, coords, bonds):
+    """
+    Build the OPLS2005 template of the ligand. The atoms are ordered as a breadth-first tree from the first heavy atom,
+    so each atom comes after its parent, and the Z-matrix is computed from the coordinates.
+    :return: content of the template.
+    """
+    neighbours = {n: [] for n in range(len(atoms))}
+    for i, j in sorted(bonds):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+    heavy = [n for n, atom in enumerate(atoms) if atom[2] != "H"]
+    order = []
+    parents = {}
+    for root in (heavy or [0]) + list(range(len(atoms))):
+        if root in parents:
+            continue
+        parents[root] = None
+        queue = [root]
+        while queue:
+            node = queue.pop(0)
+            order.append(node)
+            for neighbour in neighbours[node]:
+                if neighbour not in parents:
+                    parents[neighbour] = node
+                    queue.append(neighbour)
+    template_ids = {atom: n + 1 for n, atom in enumerate(order)}
+    lines = []
+    nbon = []
+    for atom in order:
+        serial, name, element = atoms[atom]
+        atom_type, sigma, epsilon, _, radius, gamma, alpha = ELEMENT_PARAMETERS.get(element, ELEMENT_PARAMETERS["C"])
+        chain = [atom]
+        while len(chain) < 4 and parents[chain[-1]] is not None:
+            chain.append(parents[chain[-1]])
+        zmatrix = [0., 0., 0.]
+        if len(chain) > 1:
+            zmatrix[0] = float(np.linalg.norm(coords[chain[0]] - coords[chain[1]]))
+        if len(chain) > 2:
+            zmatrix[1] = angle(*coords[chain[:3]])
+        if len(chain) > 3:
+            zmatrix[2] = dihedral(*coords[chain[:4]])
+        parent_id = template_ids[parents[atom]] if parents[atom] is not None else 0
+        template_atom = tf.Atom(template_ids[atom], parent_id, "M", atom_type, name.replace(" ", "_"), 0,
+                                zmatrix[0], zmatrix[1], zmatrix[2], sigma, epsilon, 0., radius / 2., radius, gamma,
+                                alpha)
+        lines.append(template_atom.write_resx())
+        nbon.append(template_atom.write_nbon())
+    bond_lines = [tf.Bond(template_ids[i], template_ids[j], 300., np.linalg.norm(coords[i] - coords[j])).write_bond()
+                  for i, j in sorted(bonds)]
+    theta_lines = []
+    phi_lines = []
+    for center in range(len(atoms)):
+        for n, a in enumerate(neighbours[center]):
+            for b in neighbours[center][n + 1:]:
+                theta_lines.append(tf.Theta(template_ids[a], template_ids[center], template_ids[b], 50.,
+                                            angle(coords[a], coords[center], coords[b])).write_theta())
+    for b, c in sorted(bonds):
+        for a in neighbours[b]:
+            for d in neighbours[c]:
+                if len({a, b, c, d}) == 4:
+                    phi_lines.append(tf.Phi(template_ids[a], template_ids[b], template_ids[c], template_ids[d], 0.,
+                                            1., 3., False).write_phi())
+    # Same header as the templates built by PlopRotTemp
+    header = tf.HEADER_OPLS2005 + "{0:>0}  {1:>6} {2:>5} {3:>5} {4:>7} {5:>7}\n".format(
+        resname.upper(), len(atoms), len(bond_lines), len(theta_lines), len(phi_lines), 0)
+    return "".join([header] + lines + ["NBON\n"] + nbon + ["BOND\n"] + bond_lines + ["THET\n"] + theta_lines +
+                   ["PHI\n"] + phi_lines + ["IPHI\n", "END"])
+
+
+def build_rotamers(resname, atoms, bonds, gridres):
+    """
+    Build the rotamers library: a FREE library of resolution gridres for each rotatable bond (non-ring bonds between
+    heavy atoms that have other heavy neighbours).
+    :return: content of the rotamers library.
+    """
+    heavy_neighbours = {n: 0 for n in range(len(atoms))}
+    for i, j in bonds:
+        if atoms[i][2] != "H" and atoms[j][2] != "H":
+            heavy_neighbours[i] += 1
+            heavy_neighbours[j] += 1
+    ring_bonds = get_ring_bonds(len(atoms), bonds)
+    lines = ["rot assign res {} &\n".format(resname.upper())]
+    for i, j in sorted(bonds):
+        if (i, j) in ring_bonds or atoms[i][2] == "H" or atoms[j][2] == "H":
+            continue
+        if heavy_neighbours[i] > 1 and heavy_neighbours[j] > 1:
+            lines.append("     sidelib FREE{} {} {} {} &\n".format(int(float(gridres)), resname.upper(),
+                                                                   atoms[i][1].replace(" ", "_"),
+                                                                   atoms[j][1].replace(" ", "_")))
+    lines.append("newgrp &\n")
+    return "".join(lines)
+
+
+def create_template(pdb, gridres, out_temp=TEMPLATES_OUT, out_rot=ROTAMERS_OUT):
+    resname, atoms, coords, conect = read_ligand(pdb)
+    bonds = get_bonds(atoms, coords, conect)
+    for folder in (out_temp, out_rot):
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+    template_file = os.path.join(out_temp, "{}z".format(resname.lower()))
+    rotamers_file = os.path.join(out_rot, "{}.rot.assign".format(resname.upper()))
+    with open(template_file, "w") as template:
+        template.write(build_template(resname, atoms, coords, bonds))
+    with open(rotamers_file, "w") as rotamers:
+        rotamers.write(build_rotamers(resname, atoms, bonds, gridres))
+    time.sleep(float(os.environ.get("FAKE_PLOP_TIME") or 0))
+    return template_file, rotamers_file
+
+
+if __name__ == '__main__':
+    pdbs, gridres, out_temp, out_rot = arg_parse()
+    for pdb in pdbs:
+        print("\n{} template and {} rotamer library has been successfully created\n".format(
+            *create_template(pdb, gridres, out_temp, out_rot)))
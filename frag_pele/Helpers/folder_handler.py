@@ -1,5 +1,8 @@
 import os
+import shutil
+import tempfile
 import logging
+from contextlib import contextmanager
 # Local import
 import frag_pele.constants as c
 
@@ -35,3 +38,81 @@ def check_and_create_pdb_clusters_folder(pdbout_folder, iteration):
         check_and_create_folder(os.path.join(pdbout_folder, "{}".format(iteration)))
     else:
         check_and_create_folder(os.path.join(pdbout_folder, "{}".format(iteration)))
+
+
+def check_and_create_run_root(workdir, run_id):
+    """
+    Create (if needed) the run-root folder of a growing inside workdir. All the intermediate files of the growing
+    (pregrow, DataLocal, control_folder, PELE results...) are stored inside it, so several growings can run at the
+    same time from the same directory tree.
+    :param workdir: folder where the run-roots are stored.
+    :param run_id: identifier of the growing.
+    :return: absolute path of the run-root.
+    """
+    run_root = os.path.abspath(os.path.join(workdir, run_id))
+    if not os.path.exists(run_root):
+        os.makedirs(run_root)
+    return run_root
+
+
+@contextmanager
+def working_directory(path):
+    """
+    Context manager to work inside a folder and go back to the previous one at the end. If path is None the
+    current working directory is kept.
+    """
+    previous_dir = os.getcwd()
+    if path:
+        os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous_dir)
+
+
+def atomic_write(path, content):
+    """
+    Write content into path through a temporary file of the same folder and an atomic rename, so concurrent readers
+    never find a half-written file.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=folder, prefix=".{}.".format(os.path.basename(path)))
+    try:
+        with os.fdopen(file_descriptor, "w") as tmp_file:
+            tmp_file.write(content)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def copy_input(path, prefix, folder=c.INPUTS_DIR):
+    """
+    Copy an input file of a growing into a folder of the current run root, so the preparation can fix it (atom and
+    ligand names) without rewriting the original, which other growings may be reading at the same time.
+    :param prefix: prefix of the name of the copy, to tell apart inputs with the same file name.
+    :return: path of the copy.
+    """
+    check_and_create_folder(folder)
+    private_path = os.path.join(folder, "{}_{}".format(prefix, os.path.basename(path)))
+    atomic_copy(path, private_path)
+    return private_path
+
+
+def atomic_copy(src, dst):
+    """
+    Copy src into dst through a temporary file of the destination folder and an atomic rename.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    folder = os.path.dirname(os.path.abspath(dst))
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=folder, prefix=".{}.".format(os.path.basename(dst)))
+    os.close(file_descriptor)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,140 @@
+"""
+Opt-in profiling of the stages of FrAG. It is configured through environment variables, so the same switch reaches
+the subprocesses (e.g. PlopRotTemp, run by Schrodinger's python):
+
+    FRAG_PROFILE: comma-separated list of stages to profile (the names of the timing spans: pregrow, templatization,
+    pele_step, clustering...), "all" for every stage or "total" for the whole growing (main()). Empty: disabled.
+    FRAG_PROFILE_MODE: "cprofile" (default) writes .prof files (pstats, readable by snakeviz, flameprof, gprof2dot...)
+    and "sample" writes .folded files (collapsed stacks of a sampling profiler, readable by flamegraph.pl, speedscope,
+    inferno...).
+    FRAG_PROFILE_DIR: folder where the profiles are written (default "profiles").
+    FRAG_PROFILE_INTERVAL: seconds between samples of the sampling profiler (default 0.005).
+
+Profilers can not be nested, so when a profiled stage runs inside another profiled stage only the outer one is
+profiled. This module only uses the standard library, so it can be imported by any interpreter.
+"""
+import os
+import re
+import sys
+import cProfile
+import threading
+from contextlib import contextmanager
+
+PROFILE_VARIABLE = "FRAG_PROFILE"
+PROFILE_MODE_VARIABLE = "FRAG_PROFILE_MODE"
+PROFILE_DIR_VARIABLE = "FRAG_PROFILE_DIR"
+PROFILE_INTERVAL_VARIABLE = "FRAG_PROFILE_INTERVAL"
+PROFILE_DIR = "profiles"
+PROFILE_MODES = ("cprofile", "sample")
+ALL_STAGES = "all"
+WHOLE_GROWING = "total"
+SAMPLING_INTERVAL = 0.005
+
+# True while a profiler is running in this process
+_profiling = False
+
+
+def configure(stages, mode=PROFILE_MODES[0], folder=PROFILE_DIR):
+    """
+    Enable the profiling of stages (list or comma-separated string) in this process and in its subprocesses.
+    """
+    if not isinstance(stages, str):
+        stages = ",".join(stages)
+    if mode not in PROFILE_MODES:
+        raise ValueError("Profile mode must be one of {}".format(", ".join(PROFILE_MODES)))
+    os.environ[PROFILE_VARIABLE] = stages
+    os.environ[PROFILE_MODE_VARIABLE] = mode
+    os.environ[PROFILE_DIR_VARIABLE] = os.path.abspath(folder)
+
+
+def is_profiled(stage):
+    stages = os.environ.get(PROFILE_VARIABLE)
+    if not stages:
+        return False
+    stages = [name.strip() for name in stages.split(",")]
+    return stage in stages or (ALL_STAGES in stages and stage != WHOLE_GROWING)
+
+
+def get_profile_path(stage, fragment_id, extension, **attributes):
+    folder = os.environ.get(PROFILE_DIR_VARIABLE) or PROFILE_DIR
+    if not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:  # Created by another process meanwhile
+            pass
+    name = "_".join([str(fragment_id), stage] + ["{}{}".format(key, attributes[key]) for key in sorted(attributes)])
+    return os.path.join(folder, "{}.{}".format(re.sub(r"[^\w.-]", "_", name), extension))
+
+
+class SamplingProfiler(object):
+    """
+    Minimal sampling profiler: a daemon thread takes the stack of the profiled thread every interval seconds and
+    counts the collapsed stacks ("module:function;module:function..." from the root), the input of the flame graph
+    tools.
+    """
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @staticmethod
+    def collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{}:{}".format(os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name))
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack = self.collapse(frame)
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def enable(self):
+        self._thread_id = threading.current_thread().ident
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample)
+        self._sampler.daemon = True
+        self._sampler.start()
+
+    def disable(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def dump_stats(self, path):
+        with open(path, "w") as folded:
+            for stack, count in sorted(self.stacks.items()):
+                folded.write("{} {}\n".format(stack, count))
+
+
+@contextmanager
+def profile(stage, fragment_id, **attributes):
+    """
+    Profile a stage if it is enabled (FRAG_PROFILE) and no other profiler is running. The profile is written to
+    FRAG_PROFILE_DIR/<fragment_id>_<stage>_<attributes>.prof (or .folded). When profiling is disabled, it only costs a
+    look-up of the environment.
+    """
+    global _profiling
+    if _profiling or not is_profiled(stage):
+        yield
+        return
+    if os.environ.get(PROFILE_MODE_VARIABLE) == "sample":
+        profiler = SamplingProfiler(float(os.environ.get(PROFILE_INTERVAL_VARIABLE) or SAMPLING_INTERVAL))
+        extension = "folded"
+    else:
+        profiler = cProfile.Profile()
+        extension = "prof"
+    _profiling = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling = False
+        profiler.dump_stats(get_profile_path(stage, fragment_id, extension, **attributes))
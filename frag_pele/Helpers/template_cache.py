@@ -0,0 +1,104 @@
+import os
+import logging
+# Local imports
+import frag_pele.constants as c
+from frag_pele.Growing.template_fragmenter import TemplateOPLS2005
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+TEMPLATES_GENERATED_PATH = os.path.join(c.TEMPLATES_PATH, "templates_generated")
+
+
+def get_template_paths(resname, templates_folder=TEMPLATES_GENERATED_PATH, rotamers_folder=c.ROTAMERS_PATH):
+    """
+    Get the paths of the template and the rotamers library that PlopRotTemp generates for a residue name.
+    :param resname: residue name of the ligand.
+    :type resname: str
+    :param templates_folder: folder where the templates are stored.
+    :type templates_folder: str
+    :param rotamers_folder: folder where the rotamers libraries are stored.
+    :type rotamers_folder: str
+    :return: path to the template and path to the rotamers library.
+    """
+    template = os.path.join(templates_folder, "{}z".format(resname.lower()))
+    rotamers = os.path.join(rotamers_folder, "{}.rot.assign".format(resname.upper()))
+    return template, rotamers
+
+
+def get_ligand_atom_names(pdb_file):
+    """
+    Read the PDB atom names of the ligand stored in a PDB file.
+    :param pdb_file: PDB file with the ligand.
+    :type pdb_file: str
+    :return: list of PDB atom names.
+    """
+    atom_names = []
+    with open(pdb_file) as pdb:
+        for line in pdb:
+            if line.startswith("HETATM") or line.startswith("ATOM"):
+                atom_names.append(line[12:16].strip())
+    return atom_names
+
+
+def is_consistent(template, pdb_file):
+    """
+    Check that a template describes the ligand of a PDB file, i.e. it has exactly the same PDB atom names.
+    :param template: OPLS2005 template.
+    :type template: TemplateOPLS2005
+    :param pdb_file: PDB file with the ligand.
+    :type pdb_file: str
+    :return: True if the template and the ligand match, False otherwise.
+    """
+    template_names = [atom.pdb_atom_name.strip("_") for atom in template.list_of_atoms.values()]
+    ligand_names = get_ligand_atom_names(pdb_file)
+    return len(template_names) == len(ligand_names) and set(template_names) == set(ligand_names)
+
+
+def reuse_template(template_path, rotamers_path, pdb_file, resname, templates_folder=TEMPLATES_GENERATED_PATH,
+                   rotamers_folder=c.ROTAMERS_PATH):
+    """
+    Reuse a template and its rotamers library already built by PlopRotTemp (i.e. the final template of a previous
+    growing) for a ligand with the same atoms and a different residue name, instead of running PlopRotTemp again.
+    :param template_path: path to the template already built.
+    :type template_path: str
+    :param rotamers_path: path to the rotamers library already built.
+    :type rotamers_path: str
+    :param pdb_file: PDB file with the ligand that needs the template.
+    :type pdb_file: str
+    :param resname: residue name of the ligand that needs the template.
+    :type resname: str
+    :param templates_folder: folder where the new template will be written.
+    :type templates_folder: str
+    :param rotamers_folder: folder where the new rotamers library will be written.
+    :type rotamers_folder: str
+    :return: True if the template has been reused, False if it has to be built again.
+    """
+    if not (os.path.exists(template_path) and os.path.exists(rotamers_path)):
+        return False
+    template = TemplateOPLS2005(template_path)
+    if not is_consistent(template, pdb_file):
+        logger.warning("Template {} does not match the ligand of {}. It will be built again.".format(template_path,
+                                                                                                     pdb_file))
+        return False
+    template_out, rotamers_out = get_template_paths(resname, templates_folder, rotamers_folder)
+    template.template_name = resname.upper()
+    template.write_template_to_file(template_new_name=template_out)
+    with open(rotamers_path) as rot_file:
+        rotamers_content = rot_file.read()
+    rotamers_content = rotamers_content.replace("rot assign res {} ".format(get_rotamers_resname(rotamers_content)),
+                                                "rot assign res {} ".format(resname.upper()), 1)
+    with open(rotamers_out, "w") as rot_file:
+        rot_file.write(rotamers_content)
+    logger.info("Template {} and rotamers library {} reused from {}.".format(template_out, rotamers_out, template_path))
+    return True
+
+
+def get_rotamers_resname(rotamers_content):
+    """
+    Get the residue name of a rotamers library.
+    :param rotamers_content: content of the rotamers library.
+    :type rotamers_content: str
+    :return: residue name.
+    """
+    return rotamers_content.split("rot assign res ", 1)[1].split()[0]
@@ -38,4 +38,32 @@ class TemplateBuilder(object):
         confile_text = confile_template.safe_substitute(self.keywords)
 
         with open(os.path.join(self.file), 'w') as outfile:
-            outfile.write(confile_text)
\ No newline at end of file
+            outfile.write(confile_text)
+
+
+# Compiled templates already read in this run, by absolute path
+_COMPILED_TEMPLATES = {}
+
+
+def load_template(file):
+    """
+    Read and compile a templatized file only once per run.
+    Following calls with the same file return the cached Template
+    (unless the file has been modified meanwhile).
+    """
+    path = os.path.abspath(file)
+    mtime = os.path.getmtime(path)
+    cached = _COMPILED_TEMPLATES.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r') as infile:
+            cached = (mtime, Template(infile.read()))
+        _COMPILED_TEMPLATES[path] = cached
+    return cached[1]
+
+
+def render_template(file, keywords):
+    """
+    Substitute the keywords of a templatized file in memory,
+    without modifying the file.
+    """
+    return load_template(file).safe_substitute(keywords)
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import logging
+import resource
+from contextlib import contextmanager
+# Local imports
+from frag_pele.Helpers import profiling
+
+# Getting the name of the module for the log system
+logger = logging.getLogger(__name__)
+
+TIMINGS_FILE = "timings_{}.jsonl"
+TIMINGS_SUMMARY = "timings_summary.tsv"
+TOTAL_STAGE = "total"
+PELE_STAGES = ("pele_step", "equilibration")
+SUMMARY_COLUMNS = ["stage", "count", "wall_s", "cpu_s", "children_cpu_s", "peak_rss_mb", "children_peak_rss_mb"]
+
+# Timer of the growing that is running, used by span() so any module can time its stages without passing it around
+_active_timer = None
+
+
+def get_resources():
+    """
+    :return: wall time, CPU time of this process, CPU time of the finished child processes (user + system), peak RSS of
+    this process and peak RSS of the largest child process (both in MB).
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KB in Linux
+    return time.time(), time.process_time(), children.ru_utime + children.ru_stime, own.ru_maxrss / 1024., \
+           children.ru_maxrss / 1024.
+
+
+class StageTimer(object):
+    """
+    Records the wall time, CPU time, CPU time of the child processes (so the CPU-hours of PELE, that runs through
+    mpirun, are counted) and peak RSS of each stage of a growing, as spans that are appended to a JSONL file.
+
+    e.g.
+
+    timer = StageTimer("aminoC1N1")
+    with timer.span("clustering", step=2):
+        clusterizer.cluster_traject(...)
+    """
+
+    def __init__(self, fragment_id, out_file=None):
+        self.fragment_id = fragment_id
+        self.out_file = os.path.abspath(out_file or TIMINGS_FILE.format(fragment_id))
+        # Features of the fragment (e.g. for the cost model), recorded with its total span
+        self.features = {}
+
+    def record(self, stage, start, end, status="ok", **attributes):
+        """
+        Append the span of a stage, measured between the resources start and end (as returned by get_resources), to
+        the JSONL file.
+        """
+        span = {"fragment": self.fragment_id, "stage": stage, "status": status, "start": start[0],
+                "wall_s": end[0] - start[0], "cpu_s": end[1] - start[1], "children_cpu_s": end[2] - start[2],
+                "peak_rss_mb": end[3], "children_peak_rss_mb": end[4]}
+        span.update(attributes)
+        if stage == TOTAL_STAGE:
+            span.update(self.features)
+        with open(self.out_file, "a") as timings:
+            timings.write(json.dumps(span) + "\n")
+        logger.debug("{} of {}: {:.2f} s".format(stage, self.fragment_id, span["wall_s"]))
+        return span
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        start = get_resources()
+        status = "ok"
+        try:
+            with profiling.profile(stage, self.fragment_id, **attributes):
+                yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.record(stage, start, get_resources(), status, **attributes)
+
+
+@contextmanager
+def fragment_timer(fragment_id, out_file=None):
+    """
+    Time the growing of a fragment: while it is open, span() records the stages in the JSONL file of the fragment. At
+    the end, a "total" span with the whole growing is recorded.
+    :return: the StageTimer of the fragment.
+    """
+    global _active_timer
+    previous = _active_timer
+    _active_timer = StageTimer(fragment_id, out_file)
+    try:
+        with _active_timer.span(TOTAL_STAGE):
+            yield _active_timer
+    finally:
+        _active_timer = previous
+
+
+@contextmanager
+def span(stage, **attributes):
+    """
+    Time a stage with the timer of the growing that is running. If there is none, nothing is recorded.
+    """
+    if _active_timer is None:
+        yield
+    else:
+        with _active_timer.span(stage, **attributes):
+            yield
+
+
+def read_spans(timing_files):
+    spans = []
+    # A fragment grown twice in the same run root appends to the same file, which must be read only once
+    for timing_file in dict.fromkeys(timing_files):
+        if not os.path.exists(timing_file):
+            continue
+        with open(timing_file) as timings:
+            spans.extend(json.loads(line) for line in timings if line.strip())
+    return spans
+
+
+def summarize(timing_files, out_file=TIMINGS_SUMMARY):
+    """
+    Summarize the spans of all the fragments of a campaign: number of spans, wall time, CPU time and CPU time of the
+    child processes of each stage, and peak RSS. The time spent out of PELE (total wall time minus the one of the PELE
+    simulations) is also logged.
+    :param timing_files: JSONL files of the fragments.
+    :param out_file: TSV file where the summary is written.
+    :return: list of rows of the summary (as dictionaries).
+    """
+    stages = {}
+    for span in read_spans(timing_files):
+        row = stages.setdefault(span["stage"], dict.fromkeys(SUMMARY_COLUMNS[1:], 0))
+        row["count"] += 1
+        for column in ("wall_s", "cpu_s", "children_cpu_s"):
+            row[column] += span[column]
+        for column in ("peak_rss_mb", "children_peak_rss_mb"):
+            row[column] = max(row[column], span[column])
+    rows = [dict(stage=stage, **values) for stage, values in sorted(stages.items(), key=lambda item:
+                                                                    -item[1]["wall_s"])]
+    lines = ["\t".join(SUMMARY_COLUMNS)]
+    for row in rows:
+        lines.append("\t".join("{:.2f}".format(row[column]) if isinstance(row[column], float) else str(row[column])
+                               for column in SUMMARY_COLUMNS))
+        logger.info("{:<25} x{:<5} wall {:>10.1f} s  cpu {:>10.1f} s  children cpu {:>12.1f} s".format(
+            row["stage"], row["count"], row["wall_s"], row["cpu_s"], row["children_cpu_s"]))
+    if TOTAL_STAGE in stages:
+        pele_wall = sum(stages[stage]["wall_s"] for stage in PELE_STAGES if stage in stages)
+        logger.info("Time out of PELE: {:.1f} s of {:.1f} s".format(stages[TOTAL_STAGE]["wall_s"] - pele_wall,
+                                                                  stages[TOTAL_STAGE]["wall_s"]))
+    with open(out_file, "w") as summary:
+        summary.write("\n".join(lines) + "\n")
+    return rows
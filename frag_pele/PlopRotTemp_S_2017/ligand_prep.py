@@ -1,5 +1,9 @@
 import os
 import sys
+import glob
+import shutil
+import tempfile
+import multiprocessing
 from schrodinger import structure as st
 import subprocess
 import argparse
@@ -7,6 +11,10 @@ import argparse
 frag_pele_dirname = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 sys.path.append(frag_pele_dirname)
 import frag_pele.PlopRotTemp_S_2017.main as plop
+from frag_pele.Helpers import profiling
+
+TEMPLATES_OUT = "DataLocal/Templates/OPLS2005/HeteroAtoms/templates_generated"
+ROTAMERS_OUT = "DataLocal/LigandRotamerLibs/"
 
 
 def convert_mae(ligands):
@@ -33,21 +41,93 @@ def convert_mae(ligands):
     return structure_mae
 
 
-def create_template(pdb, gridres):
-   mae_file = convert_mae(pdb)
-   plop.main(mae_file, out_temp="DataLocal/Templates/OPLS2005/HeteroAtoms/templates_generated", out_rot="DataLocal/LigandRotamerLibs/",
-             gridres=gridres)
-   os.remove(mae_file)
+def create_template(pdb, gridres, out_temp=TEMPLATES_OUT, out_rot=ROTAMERS_OUT):
+   # Profiled when FrAG is asked to profile the templatization (FRAG_PROFILE is inherited from FrAG)
+   with profiling.profile("templatization", "plop_{}".format(os.path.splitext(os.path.basename(pdb))[0])):
+       mae_file = convert_mae(pdb)
+       plop.main(mae_file, out_temp=out_temp, out_rot=out_rot, gridres=gridres)
+       os.remove(mae_file)
+
+
+def _create_template_isolated(args):
+    """
+       Desciption: Templatize one ligand inside its own scratch
+       folder, so intermediate files of ligands sharing a residue
+       name do not collide when several are built at once.
+       Output:
+            pdb: ligand templatized
+            error: None if everything went fine, else the error message
+    """
+    pdb, gridres, out_temp, out_rot = args
+    curr_dir = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="plop_", dir=curr_dir)
+    try:
+        os.chdir(scratch)
+        create_template(pdb, gridres, out_temp, out_rot)
+        error = None
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    finally:
+        os.chdir(curr_dir)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return pdb, error
+
+
+def collect_pdbs(inputs):
+    """
+       Desciption: Expand the inputs (PDB files or folders
+       containing them) into a sorted list of PDB files.
+    """
+    pdbs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pdbs.extend(sorted(glob.glob(os.path.join(path, "*.pdb"))))
+        else:
+            pdbs.append(path)
+    return [os.path.abspath(pdb) for pdb in pdbs]
+
+
+def create_templates(inputs, gridres, jobs=1, out_temp=TEMPLATES_OUT, out_rot=ROTAMERS_OUT):
+    """
+       Desciption: Templatize a batch of ligands in this single
+       Schrodinger interpreter (or a pool of "jobs" of them), paying
+       the start-up and module import costs only once.
+       Output:
+            failed: list of (pdb, error) of the ligands that could not be templatized
+    """
+    pdbs = collect_pdbs(inputs)
+    tasks = [(pdb, gridres, os.path.abspath(out_temp), os.path.abspath(out_rot)) for pdb in pdbs]
+    if len(tasks) == 1:
+        create_template(pdbs[0], gridres, out_temp, out_rot)
+        return []
+    if jobs > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            results = pool.map(_create_template_isolated, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_create_template_isolated(task) for task in tasks]
+    failed = [(pdb, error) for pdb, error in results if error]
+    for pdb, error in failed:
+        print("Templatization of {} failed. {}".format(pdb, error))
+    return failed
 
 
 def arg_parse():
   parser = argparse.ArgumentParser()
-  parser.add_argument("pdb", type=str, help="ligand file to templatize")
+  parser.add_argument("pdb", type=str, nargs="+", help="ligand files (or folders of ligand files) to templatize")
   parser.add_argument("gridres", type=str, help="Degrees of rotation.")
+  parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of ligands templatized in parallel.")
+  parser.add_argument("--out_temp", type=str, default=TEMPLATES_OUT, help="Template output path")
+  parser.add_argument("--out_rot", type=str, default=ROTAMERS_OUT, help="Rotamer ouput path")
   args = parser.parse_args()
-  return args.pdb, args.gridres
+  return args.pdb, args.gridres, args.jobs, args.out_temp, args.out_rot
 
 
 if __name__ == '__main__':
-    pdb, gridres = arg_parse()
-    create_template(pdb, gridres)
+    pdbs, gridres, jobs, out_temp, out_rot = arg_parse()
+    failed = create_templates(pdbs, gridres, jobs, out_temp, out_rot)
+    if failed:
+        sys.exit(1)
@@ -3,6 +3,7 @@ import __future__
 import os
 import shutil
 import re
+import tempfile
 import warnings
 from schrodinger import structure
 from frag_pele.PlopRotTemp_S_2017.template.chargeHandler import ChargeHandler
@@ -90,15 +91,12 @@ class TemplateBuilder:
       """
 
       #Create ligand params with ffld_sever from schrodinger
-      ffld_server_command = os.path.join(os.environ['SCHRODINGER'], 'utilities/ffld_server')
-      subprocess.call([ffld_server_command, "-imae", self.input_file, "-version",
-        OPLS_VERSION, "-print_parameters", "-out_file", OPLS_CONVERSION_FILE])
+      param_lines = self.run_ffld_server()
 
       #Retrieve all the useful information from that params
-      atom_names_param = self.retrieve_atom_names(OPLS_CONVERSION_FILE)
-      #shutil.copyfile(OPLS_CONVERSION_FILE, "a.txt")
-      self.search_and_replace(OPLS_CONVERSION_FILE, atom_names_param)
-      atom_types, parents, charges, sigmas, epsilons, stretchings, tors, phis, impropers = self.parse_param(OPLS_CONVERSION_FILE, atom_names_param)
+      atom_names_param = self.retrieve_atom_names(param_lines)
+      param_lines = self.search_and_replace(param_lines, atom_names_param)
+      atom_types, parents, charges, sigmas, epsilons, stretchings, tors, phis, impropers = self.parse_param(param_lines, atom_names_param)
 
 
       #Connectivity information from Mae
@@ -195,12 +193,6 @@ class TemplateBuilder:
       #Write to file
       with open(res_name, 'w') as f:
         f.write('\n'.join(file_content))
-      
-      # #Remove param.dat file
-      try:
-        os.remove(OPLS_CONVERSION_FILE)
-      except OSError:
-        print("Error, param.dat not created. Make sure $SCHRODINGER/utilities/ffld_server is up and running in your computer.")
 
       #stdout
       print("Template {} generated successfully".format(self.output_file))
@@ -208,6 +200,34 @@ class TemplateBuilder:
       return res_name, self.output_file, self.input_file, self.output_file, res_name
 
 
+    def run_ffld_server(self):
+      """
+        :Description: Run ffld_server over the input mae and
+        capture its parameters output.
+
+        The output file lives in a private temporary folder,
+        so several templates can be built at the same time
+        from the same working directory.
+
+        :Output: lines: ffld_server parameters file lines
+
+        :Author: Daniel Soler
+      """
+      ffld_server_command = os.path.join(os.environ['SCHRODINGER'], 'utilities/ffld_server')
+      tmp_dir = tempfile.mkdtemp(prefix="ffld_")
+      param_file = os.path.join(tmp_dir, OPLS_CONVERSION_FILE)
+      try:
+        subprocess.call([ffld_server_command, "-imae", self.input_file, "-version",
+          OPLS_VERSION, "-print_parameters", "-out_file", param_file])
+        with open(param_file, "r") as f:
+          lines = f.readlines()
+      except IOError:
+        raise IOError("Error, {} not created. Make sure $SCHRODINGER/utilities/ffld_server is up and running in your computer.".format(OPLS_CONVERSION_FILE))
+      finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+      return lines
+
+
     def build_triangular_matrix(self, stretchings, tors, phis, atom_names):
         """
             Build triangular interaction matrix.
@@ -518,12 +538,12 @@ class TemplateBuilder:
         return []
 
     @staticmethod  
-    def retrieve_atom_names(OPLS_CONVERSION_FILE):
+    def retrieve_atom_names(param_lines):
       """
         :Description: parse the param.data and retrieve
         the atom names of the molecule
 
-        :Input: OPLS_CONVERSION_FILE: ffldserver output file
+        :Input: param_lines: ffldserver output lines
                    cointaining the system parameters
 
         :Output: atom_names: Atom_names of the systems
@@ -531,7 +551,7 @@ class TemplateBuilder:
         :Author: Daniel Soler
       """
       atom_names = []
-      lines = preproces_file_lines(OPLS_CONVERSION_FILE)
+      lines = [re.sub(' +', ' ', line).strip('\n').strip() for line in param_lines]
       start_found_NBND = False
       for line in lines:
           if not line.startswith("----------"):
@@ -545,35 +565,25 @@ class TemplateBuilder:
                 return atom_names
 
     @staticmethod
-    def search_and_replace(file, to_search):
+    def search_and_replace(lines, to_search):
       """
         Search and replace atom_names for numbers
-      """
-      to_replace = range(1, len(to_search)+1)
-
-      with open(file, "r+") as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-          lines[i] = ' ' + line.strip('\n')
-
-
-      with open(file, "w") as f:
-        f.write('\n'.join(lines))
-      
-      with open(file, "r") as f:
-        filedata = f.read()
-     
 
-      for (item_to_search, item_to_replace) in zip(to_search, to_replace):
-          filedata = filedata.replace(' ' + item_to_search.strip('_')+' ', ' '+str(item_to_replace)+' ') #atom types are like _O1_ (strip)
-
-
-
-      f = open(file,'w')
-      f.write(filedata)
-      f.close()
-
-    def parse_param(self, param_file, atom_names):
+        All the names are replaced in a single pass
+        with one compiled regex instead of one
+        str.replace per atom over the whole text.
+      """
+      indexes = {}
+      for index, item_to_search in enumerate(to_search, 1):
+          indexes.setdefault(item_to_search.strip('_'), str(index)) #atom types are like _O1_ (strip)
+      # Longest names first so that i.e C10 is not matched as C1
+      names = sorted(indexes, key=len, reverse=True)
+      pattern = re.compile("(?<= )(" + "|".join(re.escape(name) for name in names) + ")(?= )")
+      filedata = '\n'.join(' ' + line.strip('\n') for line in lines)
+      filedata = pattern.sub(lambda match: indexes[match.group(1)], filedata)
+      return filedata.split('\n')
+
+    def parse_param(self, lines, atom_names):
       """
         :Description: Parse the OPLS conversion param file
         and get the atomtypes.
@@ -625,63 +635,61 @@ class TemplateBuilder:
       start_found_BND = False
 
 
-      with open(param_file) as f:
-        lines = f.readlines()
-        for i, line in enumerate(lines):
-          #prepared lines
-          line = re.sub(' +',' ',line)
-          line = line.strip('\n').strip()
-
-          if not end_connectivity_found:
-            if(line.startswith("BCI's")):
-              start_connectivity_found = True
-            elif(start_connectivity_found):
-              try:
-                line = line.split()
-                #parents[int(line[1])-1]-->Atom names start at 1 but list at 0
-                if(parents[int(line[1])-1]==-1):
-                    parents[int(line[1])-1] = int(line[0])-1
-                elif(parents[int(line[0])-1]==-1):
-                    parents[int(line[0])-1] = int(line[1])-1
-              except IndexError:
-                end_connectivity_found = True
-
+      for i, line in enumerate(lines):
+        #prepared lines
+        line = re.sub(' +',' ',line)
+        line = line.strip('\n').strip()
 
-          #NBND section
-          elif (line.startswith("----------") is False) and (NBND_finished is False) and (end_connectivity_found is True):
-            if(line.startswith("atom type vdw")):
-              start_found_NBND = True
-            elif(start_found_NBND):
+        if not end_connectivity_found:
+          if(line.startswith("BCI's")):
+            start_connectivity_found = True
+          elif(start_connectivity_found):
+            try:
+              line = line.split()
+              #parents[int(line[1])-1]-->Atom names start at 1 but list at 0
+              if(parents[int(line[1])-1]==-1):
+                  parents[int(line[1])-1] = int(line[0])-1
+              elif(parents[int(line[0])-1]==-1):
+                  parents[int(line[0])-1] = int(line[1])-1
+            except IndexError:
+              end_connectivity_found = True
+
+
+        #NBND section
+        elif (line.startswith("----------") is False) and (NBND_finished is False) and (end_connectivity_found is True):
+          if(line.startswith("atom type vdw")):
+            start_found_NBND = True
+          elif(start_found_NBND):
+            try:
+              line = line.split()
+              if not line[3].isdigit():
+                atom_types.append(line[3])
+              else:
+                atom_types.append(atom_names[int(line[3])-1])
+              charges.append(line[4])
+              sigmas.append(line[5])
+              epsilons.append(line[6])
+            except IndexError:
+              NBND_finished=True
+
+        elif(NBND_finished):
+          for (keyword, indexes, List) in zip(keywords, columns_to_take, lists):
+            while(line.startswith(keyword) is False):
               try:
-                line = line.split()
-                if not line[3].isdigit():
-                  atom_types.append(line[3])
-                else:
-                  atom_types.append(atom_names[int(line[3])-1])
-                charges.append(line[4])
-                sigmas.append(line[5])
-                epsilons.append(line[6])
+                line, i = move_line_forward(lines, i)
               except IndexError:
-                NBND_finished=True
-
-          elif(NBND_finished):
-            for (keyword, indexes, List) in zip(keywords, columns_to_take, lists):
-              while(line.startswith(keyword) is False):
-                try:
+                #There are no improper torsions!!
+                return atom_types, parents, charges, sigmas, epsilons, stretchings, bendings, proper_tors, improper_tors
+            line, i = move_line_forward(lines, i)
+            while(line):
+                  line = re.sub(' +',' ',line)
+                  line = line.strip('\n')
+                  line = line.split()
+                  values = [line[index] for index in indexes]
+                  values = self.amide_trans_cis_hotfix(line, values)
+                  List.append(values)
                   line, i = move_line_forward(lines, i)
-                except IndexError:
-                  #There are no improper torsions!!
-                  return atom_types, parents, charges, sigmas, epsilons, stretchings, bendings, proper_tors, improper_tors
-              line, i = move_line_forward(lines, i)
-              while(line):
-                    line = re.sub(' +',' ',line)
-                    line = line.strip('\n')
-                    line = line.split()
-                    values = [line[index] for index in indexes]
-                    values = self.amide_trans_cis_hotfix(line, values)
-                    List.append(values)
-                    line, i = move_line_forward(lines, i)
-            return atom_types, parents, charges, sigmas, epsilons, stretchings, bendings, proper_tors, improper_tors
+          return atom_types, parents, charges, sigmas, epsilons, stretchings, bendings, proper_tors, improper_tors
 
     @staticmethod
     def amide_trans_cis_hotfix(line, values):
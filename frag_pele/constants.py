@@ -78,6 +78,7 @@ NUM_CLUSTERS = 5
 
 # PRIVATE CONSTANTS (not to change)
 PRE_WORKING_DIR = "pregrow"
+INPUTS_DIR = "inputs"
 TEMPLATES_PATH = "DataLocal/Templates/OPLS2005/HeteroAtoms/"
 ROTAMERS_PATH = "DataLocal/LigandRotamerLibs/"
 PDBS_OUTPUT_FOLDER = "PDBs_growing"
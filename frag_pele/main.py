@@ -8,15 +8,17 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Adapti
 import logging
 from logging.config import fileConfig
 import shutil
+import itertools
+import math
 import subprocess
 import traceback
 # Local imports
 from frag_pele.Helpers import clusterizer, checker, folder_handler, runner, constraints, check_constants
-from frag_pele.Helpers import helpers, correct_fragment_names, center_of_mass
+from frag_pele.Helpers import helpers, correct_fragment_names, center_of_mass, template_cache, timing
+from frag_pele.Helpers import profiling, checkpoint, cost_model
 from frag_pele.Growing import template_fragmenter, simulations_linker
-from frag_pele.Growing import add_fragment_from_pdbs, bestStructs
-from frag_pele.Analysis import analyser
-from frag_pele.Banner import Detector as dt
+from frag_pele.Growing import add_fragment_from_pdbs, bestStructs, growing_schedule
+from frag_pele.Analysis import analyser, convergence, triage, score_store
 from frag_pele import serie_handler
 import frag_pele.constants as c
 
@@ -29,8 +31,17 @@ fileConfig(LogPath)
 # Getting the name of the module for the log system
 logger = logging.getLogger(__name__)
 
-# Get current path
-curr_dir = os.path.abspath(os.path.curdir)
+# Stages of the checkpoint that do not depend on the growing settings, kept after a triage
+PREPARATION_STAGES = ("pregrow", "templatization", "triage")
+# Settings of the high-throughput mode
+HT_GROWING_STEPS = 3
+HT_STEPS = 3
+HT_PELE_EQ_STEPS = 15
+HT_FOLDER = "high_throughput"
+TWO_TIER_SUMMARY = "two_tier_summary.tsv"
+# Stand-ins of PELE and PlopRotTemp (relative to the package) for offline runs
+OFFLINE_PELE = "Helpers/fake_pele.py"
+OFFLINE_PLOP = "Helpers/fake_plop.py"
 
 
 def parse_arguments():
@@ -73,8 +84,9 @@ def parse_arguments():
                         next GS. Additionally, this parameter will be the selection criteria to extract the best 
                         structure after completing the growing. By default = {}.""".format(c.SELECTION_CRITERIA))
     parser.add_argument("-rst", "--restart", action="store_true",
-                        help="If set FrAG will continue from the last GS detected. If all GS are finished it will"
-                             "restart in the equilibration phase.")
+                        help="If set FrAG will continue each growing from the first stage that is not completed (or "
+                             "whose parameters or outputs changed) in its checkpoint manifest (checkpoint_<ID>.json). "
+                             "An interrupted equilibration is continued from the last model of each trajectory.")
     parser.add_argument("-cc", "--c_chain", default="L", help="Chain name of the core. By default = 'L'")
     parser.add_argument("-fc", "--f_chain", default="L", help="Chain name of the fragment. By default = 'L'")
     parser.add_argument("-tc", "--clash_thr", default=1.7, help="Threshold distance that would to classify intramolecular"
@@ -187,7 +199,20 @@ def parse_arguments():
     parser.add_argument("-EX", "--explorative", action="store_true",
                         help="Run frag pele explorative mode: sampling simulation with high movement of the ligand.")
 
+    parser.add_argument("--two_tier", action="store_true",
+                        help="Run every individual growing of the serie file in high-throughput mode (in the folder "
+                             "{}) and then only the best ones, by their score, with the full protocol, reusing their "
+                             "templates. The ranking is written in {}. Combined with --triage, it requires --workdir."
+                             "".format(HT_FOLDER, TWO_TIER_SUMMARY))
+    parser.add_argument("--top", type=float, default=0.1,
+                        help="Number (> 1) or fraction (<= 1) of the best fragments of the high-throughput tier that "
+                             "are grown with the full protocol. By default = 0.1")
+
     parser.add_argument("--test", action="store_true", help="run test config")
+    parser.add_argument("--offline", action="store_true",
+                        help="Run with the stand-ins of PELE ({}) and PlopRotTemp ({}) instead of the real programs, "
+                             "e.g. to test FrAG without PELE, its license or Schrodinger. The paths of "
+                             "frag_pele/constants.py are not checked.".format(OFFLINE_PELE, OFFLINE_PLOP))
 
     #Output format option
     parser.add_argument("--mae", action="store_true",
@@ -196,13 +221,83 @@ def parse_arguments():
     #Others
     parser.add_argument("--rename", action="store_true",
                         help="Avoid core renaming")
+    parser.add_argument("-wd", "--workdir", default=None,
+                        help="If set, each growing is run inside its own run-root folder, named after its ID, in this "
+                             "directory. Then, several growings can run at the same time in the same directory tree.")
+    parser.add_argument("--lanes", type=int, default=1,
+                        help="Number of jobs that run the same serie file at the same time (e.g. in an allocation), "
+                             "each one with a different --lane. Each job grows the fragments of its lane serie file "
+                             "(<serie_file>_lane<k>), written before launching them by frag_pele/Helpers/cost_model.py, "
+                             "which distributes the growings longest-first with a cost model fitted on the timings of "
+                             "previous growings. It requires --workdir and can not be combined with --triage or "
+                             "--two_tier, which rank the whole serie file. By default = 1")
+    parser.add_argument("--lane", type=int, default=0,
+                        help="Lane (from 0 to --lanes - 1) run by this job.")
+    parser.add_argument("--profile", default=None,
+                        help="Comma-separated list of stages to profile (pregrow, templatization, template_fragmenter, "
+                             "pele_step, overlap_check, clustering, equilibration, best_structures, scoring, "
+                             "mae_conversion), 'all' for every stage or 'total' for the whole growing. The "
+                             "templatization is also profiled inside PlopRotTemp. Same as the environment variable "
+                             "{}.".format(profiling.PROFILE_VARIABLE))
+    parser.add_argument("--profile_mode", default=profiling.PROFILE_MODES[0], choices=profiling.PROFILE_MODES,
+                        help="'cprofile' writes .prof files (pstats) and 'sample' writes .folded files (collapsed "
+                             "stacks for flame graphs) of a sampling profiler.")
+    parser.add_argument("--profile_dir", default=profiling.PROFILE_DIR,
+                        help="Folder where the profiles of each stage and fragment are written.")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt the growing steps to the simulations: the fragment grows faster while the "
+                             "acceptance is high, the spread of the criteria low and the spawned structures do not "
+                             "overlap, and intermediate steps are added otherwise. Then, --growing_steps only sets "
+                             "the initial lambda increment.")
+    parser.add_argument("--triage", action="store_true",
+                        help="Before any PELE simulation, score the initial placement of each fragment of the serie "
+                             "file (interaction energy with the receptor) and only grow the best ones (see "
+                             "--triage_keep and --triage_max). The ranking is written in {}. Successive growings are "
+                             "not triaged.".format(triage.TRIAGE_SUMMARY))
+    parser.add_argument("--triage_keep", type=float, default=None,
+                        help="Number (> 1) or fraction (<= 1) of the best fragments kept by the triage. "
+                             "By default, all of them.")
+    parser.add_argument("--triage_max", type=float, default=None,
+                        help="Fragments with a triage energy (kcal/mol) above this value are not grown.")
+    parser.add_argument("--early_stop", action="store_true",
+                        help="Stop the sampling simulation once the score (mean of the criteria under its first "
+                             "quartile) has converged, instead of running all its steps.")
+    parser.add_argument("--conv_tol", type=float, default=convergence.TOLERANCE,
+                        help="Maximum change of the score in the last checks to consider it converged. "
+                             "By default = {}".format(convergence.TOLERANCE))
+    parser.add_argument("--conv_patience", type=int, default=convergence.PATIENCE,
+                        help="Number of consecutive checks in which the score must be stable. "
+                             "By default = {}".format(convergence.PATIENCE))
+    parser.add_argument("--conv_interval", type=int, default=convergence.POLL_INTERVAL,
+                        help="Seconds between convergence checks. By default = {}".format(convergence.POLL_INTERVAL))
 
     args = parser.parse_args()
 
+    if args.banned and args.limit is None:
+        # Without a threshold there is no way to decide which dihedrals are banned
+        parser.error("--banned requires --limit")
+    if args.two_tier and args.triage and not args.workdir:
+        # The high-throughput tier reuses the templates of the triage, which are only kept apart in run roots
+        parser.error("--two_tier with --triage requires --workdir")
+    if args.lanes > 1:
+        # Lanes run at the same time, so each growing needs its own run root
+        if not args.workdir:
+            parser.error("--lanes requires --workdir")
+        # The lanes are split before any ranking, so each lane would keep its own best fragments
+        if args.triage or args.two_tier:
+            parser.error("--lanes can not be combined with --triage or --two_tier")
+        if not 0 <= args.lane < args.lanes:
+            parser.error("--lane must be between 0 and {}".format(args.lanes - 1))
+        # The split is computed once, before any lane starts, so all of them see the same one
+        if not all(os.path.exists(cost_model.get_lane_file(args.serie_file, lane)) for lane in range(args.lanes)) or \
+                os.path.exists(cost_model.get_lane_file(args.serie_file, args.lanes)):
+            parser.error("Split {} in {} lanes first with: python -m frag_pele.Helpers.cost_model -cp {} -sef {} -n {}"
+                         "".format(args.serie_file, args.lanes, args.complex_pdb, args.serie_file, args.lanes))
+
     if args.highthroughput:
-        args.growing_steps = 3
-        args.steps = 3
-        args.pele_eq_steps = 15
+        args.growing_steps = HT_GROWING_STEPS
+        args.steps = HT_STEPS
+        args.pele_eq_steps = HT_PELE_EQ_STEPS
 
     if args.test:
         args.growing_steps = 1
@@ -210,6 +305,11 @@ def parse_arguments():
         args.pele_eq_steps = 1
         args.temp = 1000000
 
+    if args.offline:
+        args.pele_dir = os.path.join(PackagePath, OFFLINE_PELE)
+        args.plop_path = OFFLINE_PLOP
+        args.sch_python = sys.executable
+
     return args.complex_pdb, args.growing_steps, \
            args.criteria, args.plop_path, args.sch_python, args.pele_dir, args.contrl, args.license, \
            args.resfold, args.report, args.traject, args.pdbout, args.cpus, \
@@ -218,7 +318,10 @@ def parse_arguments():
            args.c_chain, args.f_chain, args.steps, args.temperature, args.seed, args.rotamers, \
            args.banned, args.limit, args.mae, args.rename, args.clash_thr, args.steering, \
            args.translation_high, args.rotation_high, args.translation_low, args.rotation_low, args.explorative, \
-           args.radius_box, args.sampling_control
+           args.radius_box, args.sampling_control, args.workdir, args.profile, args.profile_mode, args.profile_dir, \
+           args.early_stop, args.conv_tol, args.conv_patience, args.conv_interval, args.adaptive, \
+           args.triage, args.triage_keep, args.triage_max, args.two_tier, args.top, \
+           args.lanes, args.lane, args.offline
 
 
 def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criteria, plop_path, sch_python,
@@ -227,7 +330,10 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
          h_core=None, h_frag=None, c_chain="L", f_chain="L", steps=6, temperature=1000, seed=1279183, rotamers="30.0",
          banned=None, limit=None, mae=False, rename=False, threshold_clash=1.7, steering=0,
          translation_high=0.05, rotation_high=0.10, translation_low=0.02, rotation_low=0.05, explorative=False,
-         radius_box=4, sampling_control=None):
+         radius_box=4, sampling_control=None, core_template=None, early_stop=False,
+         convergence_tolerance=convergence.TOLERANCE, convergence_patience=convergence.PATIENCE,
+         convergence_interval=convergence.POLL_INTERVAL, adaptive_growing=False, triage_only=False,
+         reuse_preparation=False, template_source=None, offline=False, store=score_store.SCORE_STORE):
     """
     Description: FrAG is a Fragment-based ligand growing software which performs automatically the addition of several
     fragments to a core structure of the ligand in a protein-ligand complex.
@@ -284,7 +390,8 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
     :type nclusters: int
     :param pele_eq_steps: Number of PELE steps that we want to perform in the equilibration.
     :type pele_eq_steps: int
-    :param restart: If set FrAG will find your last iteration completed and will restart from this point.
+    :param restart: If set FrAG will restart from the first stage that is not completed in the checkpoint manifest of
+    the growing. Otherwise, the manifest is reset.
     :type restart: bool
     :param min_overlap: Minimun value of overlapping factor that will be replaced in the control file.
     :type min_overlap: float (from 0 to 1)
@@ -338,10 +445,67 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
     :type radius_box: float
     :param sampling_control: templatized control file to be used in the sampling simulation.
     :type sampling_control: str
+    :param core_template: template and rotamers library of the core ligand already built in a previous growing. If they
+    match the core they are reused instead of running PlopRotTemp again.
+    :type core_template: tuple
+    :param early_stop: If set, the sampling simulation is stopped once the score has converged.
+    :type early_stop: bool
+    :param convergence_tolerance: Maximum change of the score in the last checks to consider it converged.
+    :type convergence_tolerance: float
+    :param convergence_patience: Number of consecutive checks in which the score must be stable.
+    :type convergence_patience: int
+    :param convergence_interval: Seconds between convergence checks.
+    :type convergence_interval: int
+    :param adaptive_growing: If set, the lambda increment of each growing step is adapted to the acceptance, spread of
+    the criteria and overlapping atoms of the previous one, instead of growing linearly in iterations + 1 steps.
+    :type adaptive_growing: bool
+    :param triage_only: If set, only the preparation is done and the initial placement of the grown ligand is scored
+    by its interaction energy with the receptor, which is returned.
+    :type triage_only: bool
+    :param reuse_preparation: If set, the pre-growing, templatization and triage done before (e.g. by the triage) are
+    kept even if restart is not set.
+    :type reuse_preparation: bool
+    :param template_source: run root of a previous growing of the same fragment (e.g. its high-throughput run) whose
+    templates and rotamers libraries are reused if they match the ligands, instead of running PlopRotTemp again.
+    :type template_source: str
+    :param offline: If set, the paths of PELE and Schrodinger in constants.py are not checked (the stand-ins of PELE
+    and PlopRotTemp are used instead).
+    :type offline: bool
+    :param store: SQLite store where the score of the fragment is saved. It can be shared by several growings.
+    :type store: str
     :return:
     """
+    # Manifest of the completed stages, to restart at the first incomplete one
+    manifest = checkpoint.Checkpoint(ID)
+    if not restart:
+        manifest.reset(keep=PREPARATION_STAGES if reuse_preparation else ())
+    # The inputs are fingerprinted before they are copied and prepared: the preparation only rewrites the copies, so the
+    # outputs of a previous growing used as complex here keep the fingerprints recorded in its checkpoint
+    pregrow_params = {"complex_pdb": checkpoint.fingerprint(complex_pdb),
+                      "fragment_pdb": checkpoint.fingerprint(fragment_pdb), "core_atom": core_atom,
+                      "fragment_atom": fragment_atom, "iterations": iterations, "h_core": h_core, "h_frag": h_frag,
+                      "c_chain": c_chain, "f_chain": f_chain, "rename": rename, "threshold_clash": threshold_clash}
+    templatization_params = {"rotamers": rotamers, "core_template": core_template}
+    growing_params = {"contrl": checkpoint.fingerprint(contrl), "steps": steps, "cpus": cpus,
+                      "temperature": temperature, "seed": seed, "min_overlap": min_overlap,
+                      "max_overlap": max_overlap, "steering": steering, "translation_high": translation_high,
+                      "rotation_high": rotation_high, "translation_low": translation_low,
+                      "rotation_low": rotation_low, "radius_box": radius_box, "criteria": criteria,
+                      "distance_contact": distance_contact, "clusterThreshold": clusterThreshold, "epsilon": epsilon,
+                      "condition": condition, "metricweights": metricweights, "nclusters": nclusters,
+                      "banned": banned, "limit": limit, "adaptive_growing": adaptive_growing}
+    sampling_params = {"sampling_control": checkpoint.fingerprint(sampling_control), "explorative": explorative,
+                       "pele_eq_steps": pele_eq_steps, "early_stop": early_stop,
+                       "convergence_tolerance": convergence_tolerance, "convergence_patience": convergence_patience}
+    selection_params = {"criteria": criteria, "mae": mae}
+    all_params = [pregrow_params, templatization_params, growing_params, sampling_params, selection_params]
+    if restart and not triage_only and manifest.is_done("growing", all_params):
+        logger.info("Growing of {} already done".format(ID))
+        return manifest.get_results("growing")
+
     #Check harcoded path in constants.py
-    check_constants.check()
+    if not offline:
+        check_constants.check()
     # Time computations
     start_time = time.time()
     # Global variable to keep info
@@ -353,6 +517,9 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
     path_to_templates = "DataLocal/Templates/OPLS2005/HeteroAtoms"
     # Creation of output folder
     folder_handler.check_and_create_DataLocal()
+    # The preparation rewrites the complex and the fragment, so it works on private copies in the run root
+    complex_pdb = folder_handler.copy_input(complex_pdb, "complex")
+    fragment_pdb = folder_handler.copy_input(fragment_pdb, "fragment")
     # Creating constraints
     const = "\n".join(constraints.retrieve_constraints(complex_pdb, {}, {}, 5, 5, 10))
     # Creating symbolic links
@@ -360,28 +527,65 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
     helpers.create_symlinks(c.PATH_TO_PELE_DOCUMENTS, 'Documents')
 
     #  ---------------------------------------Pre-growing part - PREPARATION -------------------------------------------
-    fragment_names_dict, hydrogen_atoms, pdb_to_initial_template, pdb_to_final_template, pdb_initialize, \
-    core_original_atom, fragment_original_atom = add_fragment_from_pdbs.main(complex_pdb, fragment_pdb, core_atom,
-                                                                             fragment_atom, iterations, h_core=h_core,
-                                                                             h_frag=h_frag, core_chain=c_chain,
-                                                                             fragment_chain=f_chain, rename=rename,
-                                                                             threshold_clash=threshold_clash)
-
-    # Create the templates for the initial and final structures
+    if not manifest.resume("pregrow", pregrow_params):
+        with timing.span("pregrow"):
+            fragment_names_dict, hydrogen_atoms, pdb_to_initial_template, pdb_to_final_template, pdb_initialize, \
+            core_original_atom, fragment_original_atom = add_fragment_from_pdbs.main(complex_pdb, fragment_pdb,
+                                                                                     core_atom, fragment_atom,
+                                                                                     iterations, h_core=h_core,
+                                                                                     h_frag=h_frag, core_chain=c_chain,
+                                                                                     fragment_chain=f_chain,
+                                                                                     rename=rename,
+                                                                                     threshold_clash=threshold_clash)
+        pregrow_outputs = [os.path.join(c.PRE_WORKING_DIR, pdb) for pdb in (pdb_to_initial_template,
+                                                                             pdb_to_final_template, pdb_initialize)]
+        manifest.complete("pregrow", pregrow_params, outputs=pregrow_outputs,
+                          results=[fragment_names_dict, pdb_to_initial_template, pdb_to_final_template,
+                                   pdb_initialize, core_original_atom, fragment_original_atom])
+    fragment_names_dict, pdb_to_initial_template, pdb_to_final_template, pdb_initialize, core_original_atom, \
+    fragment_original_atom = manifest.get_results("pregrow")
+
     template_resnames = []
     for pdb_to_template in [pdb_to_initial_template, pdb_to_final_template]:
-        cmd = "{} {} {} {}".format(sch_python, plop_relative_path, os.path.join(curr_dir,
-                                   add_fragment_from_pdbs.c.PRE_WORKING_DIR, pdb_to_template), rotamers)
-
-        try:
-            subprocess.call(cmd.split())
-        except OSError:
-            raise OSError("Path {} not foud. Change schrodinger path under frag_pele/constants.py".format(sch_python))
         template_resname = add_fragment_from_pdbs.extract_heteroatoms_pdbs(os.path.join(add_fragment_from_pdbs.
                                                                                    c.PRE_WORKING_DIR, pdb_to_template),
                                                                                    False, c_chain, f_chain)
         template_resnames.append(template_resname)
 
+    if not manifest.resume("templatization", templatization_params):
+        # Reuse the template of the core if it was already built in a previous growing
+        pdbs_to_template = [pdb_to_initial_template, pdb_to_final_template]
+        if core_template:
+            core_resname = os.path.splitext(pdb_to_initial_template)[0]
+            if template_cache.reuse_template(core_template[0], core_template[1],
+                                             os.path.join(c.PRE_WORKING_DIR, pdb_to_initial_template), core_resname):
+                pdbs_to_template = [pdb_to_final_template]
+        # Reuse the templates built by a previous run of the same fragment
+        if template_source:
+            source_templates = os.path.join(template_source, template_cache.TEMPLATES_GENERATED_PATH)
+            source_rotamers = os.path.join(template_source, c.ROTAMERS_PATH)
+            for pdb_to_template, template_resname in zip([pdb_to_initial_template, pdb_to_final_template],
+                                                         template_resnames):
+                if pdb_to_template in pdbs_to_template and template_cache.reuse_template(
+                        *template_cache.get_template_paths(template_resname, source_templates, source_rotamers),
+                        pdb_file=os.path.join(c.PRE_WORKING_DIR, pdb_to_template), resname=template_resname):
+                    pdbs_to_template.remove(pdb_to_template)
+
+        # Create the templates for the initial and final structures in a single PlopRotTemp launch
+        pdbs_to_template = [os.path.abspath(os.path.join(add_fragment_from_pdbs.c.PRE_WORKING_DIR, pdb_to_template))
+                            for pdb_to_template in pdbs_to_template]
+        if pdbs_to_template:
+            cmd = "{} {} {} {}".format(sch_python, plop_relative_path, " ".join(pdbs_to_template), rotamers)
+            with timing.span("templatization", ligands=len(pdbs_to_template)):
+                try:
+                    subprocess.call(cmd.split())
+                except OSError:
+                    raise OSError("Path {} not foud. Change schrodinger path under frag_pele/constants.py".format(
+                        sch_python))
+        manifest.complete("templatization", templatization_params,
+                          outputs=[path for resname in template_resnames
+                                   for path in template_cache.get_template_paths(resname)])
+
     # Set box center from ligand COM
     resname_core = template_resnames[0]
     center = center_of_mass.center_of_mass(os.path.join("pregrow", "{}.pdb".format(resname_core)))
@@ -389,23 +593,34 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
     # Now, move the templates to their respective folders
     template_initial, template_final = ["{}z".format(resname.lower()) for resname in template_resnames]
 
+    # Score the initial placement of the grown ligand, before spending any PELE time
+    if triage_only:
+        if not manifest.resume("triage", pregrow_params):
+            with timing.span("triage"):
+                triage_score = triage.score_fragment(complex_pdb,
+                                                     os.path.join(c.PRE_WORKING_DIR, pdb_to_final_template),
+                                                     os.path.join(path_to_templates_generated, template_final),
+                                                     c_chain)
+            logger.info("Triage energy of {}: {:.3f} kcal/mol".format(ID, triage_score["total"]))
+            manifest.complete("triage", pregrow_params, results=triage_score)
+        return manifest.get_results("triage")
+
     # --------------------------------------------GROWING SECTION-------------------------------------------------------
     # Lists definitions
 
-    templates = ["{}_{}".format(os.path.join(path_to_templates_generated, template_final), n) for n in range(0, iterations+1)]
-
-    results = ["{}{}_{}{}".format(c.OUTPUT_FOLDER, ID, resfold, n) for n in range(0, iterations+1)]
-
-    pdbs = [pdb_initialize if n == 0 else "{}_{}".format(n, pdb_initialize) for n in range(0, iterations+1)]
+    # Lambda of each growing step, fixed or adapted to the feedback of the previous step
+    schedule = growing_schedule.GrowingSchedule(iterations, adaptive=adaptive_growing)
 
     pdb_selected_names = ["initial_0_{}.pdb".format(n) for n in range(0, cpus-1)]
 
     # Generate starting templates
-    template_fragmenter.main(template_initial_path=os.path.join(path_to_templates_generated, template_initial),
-                             template_grown_path=os.path.join(path_to_templates_generated, template_final),
-                             step=1, total_steps=iterations, hydrogen_to_replace=core_original_atom,
-                             core_atom_linker=core_atom,
-                             tmpl_out_path=os.path.join(path_to_templates_generated, "{}_0".format(template_final)))
+    with timing.span("template_fragmenter", step=0):
+        template_fragmenter.main(template_initial_path=os.path.join(path_to_templates_generated, template_initial),
+                                 template_grown_path=os.path.join(path_to_templates_generated, template_final),
+                                 step=1, total_steps=iterations, hydrogen_to_replace=core_original_atom,
+                                 core_atom_linker=core_atom,
+                                 tmpl_out_path=os.path.join(path_to_templates_generated, "{}_0".format(template_final)),
+                                 lambda_to_reduce=schedule.lambda_value)
 
     # Make a copy in the main folder of Templates in order to use it as template for the simulation
     shutil.copy(os.path.join(path_to_templates_generated, "{}_0".format(template_final)),
@@ -418,37 +633,40 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
             shutil.rmtree(subfolder)
 
     # Simulation loop - LOOP CORE
-    for i, (template, pdb_file, result) in enumerate(zip(templates, pdbs, results)):
+    for i in itertools.count():
+        template = "{}_{}".format(os.path.join(path_to_templates_generated, template_final), i)
+        result = "{}{}_{}{}".format(c.OUTPUT_FOLDER, ID, resfold, i)
 
         # Only if reset
-        if restart:
-            if os.path.exists(os.path.join(pdbout_folder, "{}".format(i))) and os.path.exists(os.path.join(pdbout_folder,
-                                                                                                    "{}".format(i),
-                                                                                                    "initial_0_0.pdb")):
-                print("STEP {} ALREADY DONE, JUMPING TO THE NEXT STEP...".format(i))
-                continue
+        if manifest.resume("growing_step_{}".format(i), growing_params):
+            print("STEP {} ALREADY DONE, JUMPING TO THE NEXT STEP...".format(i))
+            schedule.restore(manifest.get_results("growing_step_{}".format(i)))
+            if schedule.is_complete():
+                break
+            continue
         # Otherwise start from the beggining
+        # Banned dihedrals are already discarded when clustering, so all the spawned structures are valid
         pdb_input_paths = ["{}".format(os.path.join(pdbout_folder, str(i-1), pdb_file)) for pdb_file in pdb_selected_names]
-        # Banned dihedrals will be checked here
-        if banned:
-            pdbs_with_banned_dihedrals = Detector.check_folder(folder=os.path.join(pdbout_folder, str(i-1)),
-                                                               threshold=limit,
-                                                               dihedrals=banned,
-                                                               lig_chain=c_chain,
-                                                               processors=cpus)
-            pdb_input_paths = [pdb_file for pdb_file, flag in pdbs_with_banned_dihedrals.items() if flag]
-
-        # Control file modification
-        overlapping_factor = float(min_overlap) + (((float(max_overlap) - float(min_overlap))*i) / iterations)
-        overlapping_factor = "{0:.2f}".format(overlapping_factor)
 
         if i != 0:
             # Check atom overlapping
-            pdbs_with_overlapping = clusterizer.check_atom_overlapping(pdb_input_paths)
+            with timing.span("overlap_check", step=i):
+                pdbs_with_overlapping = clusterizer.check_atom_overlapping(pdb_input_paths)
             pdb_input_paths_checked = []
             for pdb in pdb_input_paths:
                 if pdb not in pdbs_with_overlapping:
                     pdb_input_paths_checked.append(pdb)
+            # Move lambda according to how relaxed the previous step was
+            acceptance, spread = None, None
+            if adaptive_growing:
+                acceptance, spread = growing_schedule.read_step_feedback(
+                    "{}{}_{}{}".format(c.OUTPUT_FOLDER, ID, resfold, i-1), report, criteria)
+            schedule.advance(acceptance, spread, float(len(pdbs_with_overlapping)) / len(pdb_input_paths))
+
+        # Control file modification
+        overlapping_factor = "{0:.2f}".format(schedule.get_overlapping_factor(min_overlap, max_overlap))
+
+        if i != 0:
             simulation_file = simulations_linker.control_file_modifier(contrl, pdb=pdb_input_paths_checked, step=i,
                                                                        license=license,
                                                                        overlap=overlapping_factor, results_path=result,
@@ -478,18 +696,22 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
 
         logger.info(c.LINES_MESSAGE)
         if i != 0:
-            template_fragmenter.main(template_initial_path=os.path.join(path_to_templates_generated, template_initial),
-                                     template_grown_path=os.path.join(path_to_templates_generated, template_final),
-                                     step=i+1, total_steps=iterations, hydrogen_to_replace=core_original_atom,
-                                     core_atom_linker=core_atom,
-                                     tmpl_out_path=os.path.join(path_to_templates, template_final))
+            with timing.span("template_fragmenter", step=i):
+                template_fragmenter.main(template_initial_path=os.path.join(path_to_templates_generated,
+                                                                            template_initial),
+                                         template_grown_path=os.path.join(path_to_templates_generated, template_final),
+                                         step=i+1, total_steps=iterations, hydrogen_to_replace=core_original_atom,
+                                         core_atom_linker=core_atom,
+                                         tmpl_out_path=os.path.join(path_to_templates, template_final),
+                                         lambda_to_reduce=schedule.lambda_value)
 
         # Make a copy of the template file in growing_templates folder
         shutil.copy(os.path.join(path_to_templates, template_final), template)
 
         # Creating results folder
         folder_handler.check_and_create_results_folder(result)
-        simulations_linker.simulation_runner(pele_dir, simulation_file, cpus)
+        with timing.span("pele_step", step=i):
+            simulations_linker.simulation_runner(pele_dir, simulation_file, cpus)
         logger.info(c.LINES_MESSAGE)
         logger.info(c.FINISH_SIM_MESSAGE.format(result))
         # Before selecting a step from a trajectory we will save the input PDB file in a folder
@@ -499,117 +721,285 @@ def main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criter
         # Transform column name of the criteria to column number
         result_abs = os.path.abspath(result)
         logger.info("Looking structures to cluster in '{}'".format(result_abs))
-        column_number = clusterizer.get_column_num(result_abs, criteria, report)
-        # Selection of the trajectory used as new input
-        clusterizer.cluster_traject(str(template_resnames[1]), cpus-1, column_number, distance_contact,
+        with timing.span("clustering", step=i):
+            column_number = clusterizer.get_column_num(result_abs, criteria, report)
+            # Selection of the trajectory used as new input
+            clusterizer.cluster_traject(str(template_resnames[1]), cpus-1, column_number, distance_contact,
                                         clusterThreshold, "{}*".format(os.path.join(result_abs, traject)),
                                         os.path.join(pdbout_folder, str(i)), os.path.join(result_abs),
-                                        epsilon, report, condition, metricweights, nclusters)
+                                        epsilon, report, condition, metricweights, nclusters, banned=banned,
+                                        limit=limit, lig_chain=c_chain, processors=cpus)
+        manifest.complete("growing_step_{}".format(i), growing_params,
+                          outputs=glob.glob(os.path.join(pdbout_folder, str(i), "initial_*.pdb")),
+                          results=schedule.get_state())
+        if schedule.is_complete():
+            break
+    last_step = i
     # ----------------------------------------------------EQUILIBRATION-------------------------------------------------
     # Set input PDBs
-    pdb_inputs = ["{}".format(os.path.join(pdbout_folder, str(iterations), pdb_file)) for pdb_file in pdb_selected_names]
-    if banned:
-        pdbs_with_banned_dihedrals = Detector.check_folder(folder=os.path.join(pdbout_folder, str(iterations)),
-                                                           threshold=limit,
-                                                           dihedrals=banned,
-                                                           lig_chain=c_chain,
-                                                           processors=cpus)
-        pdb_inputs = [pdb_file for pdb_file, flag in pdbs_with_banned_dihedrals.items() if flag]
-    if not os.path.exists("sampling_result_{}".format(ID)):  # Create the folder if it does not exist
-        os.mkdir("sampling_result_{}".format(ID))
+    pdb_inputs = ["{}".format(os.path.join(pdbout_folder, str(last_step), pdb_file)) for pdb_file in pdb_selected_names]
+    sampling_folder = "sampling_result_{}".format(ID)
+    if not os.path.exists(sampling_folder):  # Create the folder if it does not exist
+        os.mkdir(sampling_folder)
     # Modify the control file to increase the steps TO THE SAMPLING SIMULATION
+    sampling_template = contrl
+    sampling_settings = dict(step=last_step, license=license, overlap=max_overlap, chain=c_chain, constraints=const,
+                             center=center, temperature=temperature, seed=seed, steering=steering,
+                             translation_high=translation_high, translation_low=translation_low,
+                             rotation_high=rotation_high, rotation_low=rotation_low, radius=radius_box)
     if sampling_control:
-        simulation_file = simulations_linker.control_file_modifier(sampling_control, pdb=pdb_inputs, step=iterations,
-                                                                   license=license, overlap=max_overlap,
-                                                                   results_path="sampling_result_{}".format(ID),
-                                                                   steps=pele_eq_steps, chain=c_chain,
-                                                                   constraints=const, center=center,
-                                                                   temperature=temperature, seed=seed, steering=steering,
-                                                                   translation_high=translation_high,
-                                                                   translation_low=translation_low,
-                                                                   rotation_high=rotation_high, rotation_low=rotation_low,
-                                                                   radius=radius_box)
-    elif explorative and not sampling_control:
-        simulation_file = simulations_linker.control_file_modifier(contrl, pdb=pdb_inputs, license=license, step=iterations,
-                                                                   overlap=max_overlap,
-                                                                   results_path="sampling_result_{}".format(ID),
-                                                                   steps=pele_eq_steps,
-                                                                   chain=c_chain, constraints=const, center=center,
-                                                                   temperature=temperature, seed=seed,
-                                                                   steering=2,
-                                                                   translation_high=0.5,
-                                                                   translation_low=0.3,
-                                                                   rotation_high=0.4,
-                                                                   rotation_low=0.15,
-                                                                   radius=25)
-    else:
-        simulation_file = simulations_linker.control_file_modifier(contrl, pdb=pdb_inputs, step=iterations,
-                                                                   license=license, overlap=max_overlap,
-                                                                   results_path="sampling_result_{}".format(ID),
-                                                                   steps=pele_eq_steps, chain=c_chain,
-                                                                   constraints=const, center=center,
-                                                                   temperature=temperature, seed=seed, steering=steering,
-                                                                   translation_high=translation_high,
-                                                                   translation_low=translation_low,
-                                                                   rotation_high=rotation_high, rotation_low=rotation_low,
-                                                                   radius=radius_box)
+        sampling_template = sampling_control
+    elif explorative:
+        sampling_settings.update(steering=2, translation_high=0.5, translation_low=0.3, rotation_high=0.4,
+                                 rotation_low=0.15, radius=25)
+    simulation_file = simulations_linker.control_file_modifier(sampling_template, pdb=pdb_inputs,
+                                                               results_path=sampling_folder, steps=pele_eq_steps,
+                                                               **sampling_settings)
 
     # EQUILIBRATION SIMULATION
-    if not (restart and os.path.exists("selected_result_{}".format(ID))):
+    report_prefix, traject_prefix = "{}_".format(report), "{}_".format(traject)
+    if not manifest.resume("equilibration", sampling_params):
         shutil.copy(os.path.join(path_to_templates_generated, template_final), path_to_templates)
-        logger.info(".....STARTING EQUILIBRATION.....")
-        simulations_linker.simulation_runner(pele_dir, simulation_file, cpus)
-    equilibration_path = os.path.join(os.path.abspath(os.path.curdir), "sampling_result_{}".format(ID))
+        # An interrupted equilibration is continued from the last model of each trajectory, once the rows and models
+        # being written when it was interrupted are dropped
+        completed = {}
+        if restart:
+            convergence.trim_outputs(sampling_folder, report_prefix, traject_prefix)
+            completed = checkpoint.get_completed_steps(sampling_folder, report_prefix)
+        if completed and sorted(completed) == list(range(1, len(pdb_inputs) + 1)) and \
+                min(step for step, accepted in completed.values()) > 0:
+            remaining_steps = pele_eq_steps - min(step for step, accepted in completed.values())
+            if remaining_steps > 0:
+                logger.info(".....CONTINUING EQUILIBRATION ({} STEPS LEFT).....".format(remaining_steps))
+                continuation_folder = os.path.join(sampling_folder, "continuation")
+                last_models = checkpoint.extract_last_models(sampling_folder, sorted(completed),
+                                                             os.path.join(pdbout_folder, "equilibration_restart"),
+                                                             traject_prefix)
+                continuation_file = simulations_linker.control_file_modifier(sampling_template, pdb=last_models,
+                                                                             results_path=continuation_folder,
+                                                                             steps=remaining_steps,
+                                                                             **sampling_settings)
+                folder_handler.check_and_create_folder(continuation_folder)
+                watcher = convergence.ScoreConvergence([sampling_folder, continuation_folder], report_prefix,
+                                                       criteria, tolerance=convergence_tolerance,
+                                                       patience=convergence_patience) if early_stop else None
+                with timing.span("equilibration", continuation=True):
+                    stopped = simulations_linker.simulation_runner(pele_dir, continuation_file, cpus, watcher=watcher,
+                                                                   poll_interval=convergence_interval)
+                if stopped:
+                    convergence.trim_outputs(continuation_folder, report_prefix, traject_prefix)
+                checkpoint.merge_continuation(sampling_folder, continuation_folder, completed, pele_eq_steps,
+                                              report_prefix, traject_prefix)
+        else:
+            logger.info(".....STARTING EQUILIBRATION.....")
+            watcher = convergence.ScoreConvergence(sampling_folder, report_prefix, criteria,
+                                                   tolerance=convergence_tolerance,
+                                                   patience=convergence_patience) if early_stop else None
+            with timing.span("equilibration"):
+                stopped = simulations_linker.simulation_runner(pele_dir, simulation_file, cpus, watcher=watcher,
+                                                               poll_interval=convergence_interval)
+            if stopped:
+                # Leave the outputs as if the simulation had finished at the last complete step
+                convergence.trim_outputs(sampling_folder, report_prefix, traject_prefix)
+        manifest.complete("equilibration", sampling_params,
+                          outputs=glob.glob(os.path.join(sampling_folder, "{}*".format(report_prefix))))
+    equilibration_path = os.path.join(os.path.abspath(os.path.curdir), sampling_folder)
     # SELECTION OF BEST STRUCTURES
     selected_results_path = "selected_result_{}".format(ID)
     if not os.path.exists(selected_results_path):  # Create the folder if it does not exist
         os.mkdir(selected_results_path)
-    best_structure_file, all_output_files = bestStructs.main(criteria, selected_results_path, path=equilibration_path,
-                                                             n_structs=50)
+    best_structure_path = os.path.join(c.PRE_WORKING_DIR, selected_results_path + ".pdb")
+    if not manifest.resume("best_structures", selection_params):
+        with timing.span("best_structures"):
+            best_structure_file, all_output_files = bestStructs.main(criteria, selected_results_path,
+                                                                     path=equilibration_path, n_structs=50)
 
-    shutil.copy(os.path.join(selected_results_path, best_structure_file), os.path.join(c.PRE_WORKING_DIR,
-                                                                                       selected_results_path + ".pdb"))
+            folder_handler.atomic_copy(os.path.join(selected_results_path, best_structure_file), best_structure_path)
+        manifest.complete("best_structures", selection_params, outputs=[best_structure_path],
+                          results=[best_structure_file, all_output_files])
+    best_structure_file, all_output_files = manifest.get_results("best_structures")
     # COMPUTE AND SAVE THE SCORE
-    analyser.analyse_at_epoch(report_prefix=report, path_to_equilibration=equilibration_path,
-                              column=criteria, quantile_value=0.25)
+    if not manifest.resume("scoring", selection_params):
+        with timing.span("scoring"):
+            score = analyser.analyse_at_epoch(report_prefix=report, path_to_equilibration=equilibration_path,
+                                              column=criteria, quantile_value=0.25, store=store)
+        manifest.complete("scoring", selection_params, results=score)
 
     
     #MOVE FROM PDB TO MAE
-    if mae:
+    if mae and not manifest.resume("mae_conversion", selection_params):
         if sch_python.endswith("python"):
             schrodinger_path = os.path.dirname(os.path.dirname(sch_python))
         elif sch_python.endswith("run"):
             schrodinger_path = os.path.dirname(sch_python)
         python_file = os.path.join(os.path.dirname(FilePath), "Analysis/output_files.py")
-        for outputfile in all_output_files:
-            filename = os.path.join(selected_results_path, outputfile)
-            command = "{} {} {} --schr {} {}".format(sch_python, python_file, filename, schrodinger_path, "--remove") 
-            subprocess.call(command.split())
+        # All the structures of the fragment are converted by the same interpreter
+        filenames = [os.path.join(selected_results_path, outputfile) for outputfile in all_output_files]
+        command = [sch_python, python_file] + filenames + ["--schr", schrodinger_path, "--remove"]
+        with timing.span("mae_conversion", structures=len(filenames)):
+            subprocess.call(command)
+        manifest.complete("mae_conversion", selection_params)
 
     # COMPUTE TIME
     end_time = time.time()
     total_time = (end_time - start_time) / 60
     logging.info("Growing of {} in {} min".format(fragment_pdb, total_time))
+    manifest.complete("growing", all_params, outputs=[best_structure_path], results=fragment_names_dict)
 
     return fragment_names_dict
 
 
+def read_individual_instruction(instruction):
+    """
+    :return: fragment PDB, core atom, fragment atom, ID, core hydrogen and fragment hydrogen (None if not set) of an
+    individual growing of the serie file.
+    """
+    fragment_pdb, core_atom, fragment_atom, ID = instruction[0], instruction[1], instruction[2], instruction[3]
+    atoms_if_bond = serie_handler.extract_hydrogens_from_instructions([fragment_pdb, core_atom, fragment_atom])
+    try:
+        ID = ID.split("/")[-1]
+    except Exception:
+        traceback.print_exc()
+
+    if atoms_if_bond:
+        core_atom = atoms_if_bond[0]
+        h_core = atoms_if_bond[1]
+        fragment_atom = atoms_if_bond[2]
+        h_frag = atoms_if_bond[3]
+    else:
+        h_core = None
+        h_frag = None
+    return fragment_pdb, core_atom, fragment_atom, ID, h_core, h_frag
+
+
+def select_top_fragments(scores, top, out_file=TWO_TIER_SUMMARY):
+    """
+    Rank the fragments by their score (lowest first) and select the best ones.
+    :param scores: dictionary with the fragment ID as key and its score as value. Fragments without a finite score
+    (e.g. their simulation failed) are ranked last and never selected.
+    :param top: number (> 1) or fraction (<= 1) of the fragments selected.
+    :param out_file: TSV file where the ranking is written.
+    :return: set of the IDs of the fragments selected.
+    """
+    scored = [fragment for fragment in scores if scores[fragment] is not None and math.isfinite(scores[fragment])]
+    ranking = sorted(scored, key=lambda fragment: scores[fragment])
+    n_top = min(int(top) if top > 1 else int(math.ceil(top * len(scores))), len(ranking))
+    ranking += sorted(fragment for fragment in scores if fragment not in scored)
+    lines = ["\t".join(["rank", "fragment", "score", "selected"])]
+    for rank, fragment in enumerate(ranking, 1):
+        score = math.nan if scores[fragment] is None else scores[fragment]
+        lines.append("\t".join([str(rank), fragment, "{:.3f}".format(score), str(rank <= n_top)]))
+    with open(out_file, "w") as summary:
+        summary.write("\n".join(lines) + "\n")
+    logger.info("{} of {} fragments selected for the full protocol. Ranking written in {}".format(
+        n_top, len(ranking), out_file))
+    return set(ranking[:n_top])
+
+
 if __name__ == '__main__':
     complex_pdb, iterations, criteria, plop_path, sch_python, pele_dir, \
     contrl, license, resfold, report, traject, pdbout, cpus, distcont, threshold, epsilon, condition, metricweights, \
     nclusters, pele_eq_steps, restart, min_overlap, max_overlap, serie_file, \
     c_chain, f_chain, steps, temperature, seed, rotamers, banned, limit, mae, \
     rename, threshold_clash, steering, translation_high, rotation_high, \
-    translation_low, rotation_low, explorative, radius_box, sampling_control = parse_arguments()
+    translation_low, rotation_low, explorative, radius_box, sampling_control, workdir, profile, profile_mode, \
+    profile_dir, early_stop, conv_tol, conv_patience, conv_interval, adaptive, triage_fragments, triage_keep, \
+    triage_max, two_tier, top, lanes, lane, offline = parse_arguments()
+    if profile:
+        # Set through the environment, so it also reaches PlopRotTemp
+        profiling.configure(profile, profile_mode, profile_dir)
+    if lanes > 1:
+        # Run only the share of this job, most expensive growings first
+        serie_file = cost_model.get_lane_file(serie_file, lane)
     list_of_instructions = serie_handler.read_instructions_from_file(serie_file)
+    if workdir or two_tier:
+        # Inputs must be reachable from the run-root of each growing
+        complex_pdb, contrl = os.path.abspath(complex_pdb), os.path.abspath(contrl)
+        if sampling_control:
+            sampling_control = os.path.abspath(sampling_control)
+    original_complex_pdb = complex_pdb
+    # All the growings save their scores in the same store, out of their run roots
+    store = os.path.abspath(os.path.join(workdir or ".", score_store.SCORE_STORE))
     print("READING INSTRUCTIONS... You will perform the growing of {} fragments. GOOD LUCK and ENJOY the trip :)".format(len(list_of_instructions)))
     dict_traceback = correct_fragment_names.main(complex_pdb)
+    timing_files = []
+    kept_fragments = None
+    if triage_fragments:
+        # Score the initial placement of all the fragments before growing any of them
+        triage_scores = {}
+        for instruction in list_of_instructions:
+            if type(instruction) == list:
+                continue
+            fragment_pdb, core_atom, fragment_atom, ID, h_core, h_frag = read_individual_instruction(instruction)
+            run_root = None
+            if workdir:
+                run_root = folder_handler.check_and_create_run_root(workdir, ID)
+                fragment_pdb = os.path.abspath(fragment_pdb)
+            try:
+                with folder_handler.working_directory(run_root), timing.fragment_timer(ID) as timer:
+                    timing_files.append(timer.out_file)
+                    triage_scores[ID] = main(original_complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations,
+                                             criteria, plop_path, sch_python, pele_dir, contrl, license, resfold,
+                                             report, traject, pdbout, cpus, distcont, threshold, epsilon, condition,
+                                             metricweights, nclusters, pele_eq_steps, restart, min_overlap,
+                                             max_overlap, ID, h_core, h_frag, c_chain, f_chain, steps, temperature,
+                                             seed, rotamers, banned, limit, mae, rename, threshold_clash, steering,
+                                             translation_high, rotation_high, translation_low, rotation_low,
+                                             explorative, radius_box, sampling_control, triage_only=True,
+                                             offline=offline)
+            except Exception:
+                # Fragments that can not be scored are grown anyway
+                triage_scores[ID] = None
+                traceback.print_exc()
+        kept_fragments = triage.rank_fragments(triage_scores, triage_keep, triage_max)
+    top_fragments = None
+    ht_roots = {}
+    if two_tier:
+        # High-throughput tier: grow all the fragments with few steps to find the best ones
+        ht_scores = {}
+        # Their scores are kept apart from the ones of the full growings
+        ht_store = os.path.abspath(os.path.join(workdir or ".", HT_FOLDER, score_store.SCORE_STORE))
+        for instruction in list_of_instructions:
+            if type(instruction) == list:
+                continue
+            fragment_pdb, core_atom, fragment_atom, ID, h_core, h_frag = read_individual_instruction(instruction)
+            if kept_fragments is not None and ID not in kept_fragments:
+                continue
+            fragment_pdb = os.path.abspath(fragment_pdb)
+            ht_roots[ID] = folder_handler.check_and_create_run_root(os.path.join(workdir or ".", HT_FOLDER), ID)
+            # Templates built by the triage are reused
+            triage_root = None
+            if triage_fragments:
+                triage_root = folder_handler.check_and_create_run_root(workdir, ID)
+            try:
+                print("PERFORMING HIGH-THROUGHPUT GROWING...")
+                with folder_handler.working_directory(ht_roots[ID]), timing.fragment_timer(ID) as timer:
+                    timing_files.append(timer.out_file)
+                    main(original_complex_pdb, fragment_pdb, core_atom, fragment_atom, HT_GROWING_STEPS, criteria,
+                         plop_path, sch_python, pele_dir, contrl, license, resfold, report, traject, pdbout, cpus,
+                         distcont, threshold, epsilon, condition, metricweights, nclusters, HT_PELE_EQ_STEPS, restart,
+                         min_overlap, max_overlap, ID, h_core, h_frag, c_chain, f_chain, HT_STEPS, temperature, seed,
+                         rotamers, banned, limit, mae, rename, threshold_clash, steering, translation_high,
+                         rotation_high, translation_low, rotation_low, explorative, radius_box, sampling_control,
+                         None, early_stop, conv_tol, conv_patience, conv_interval, adaptive,
+                         template_source=triage_root, offline=offline, store=ht_store)
+                    ht_scores[ID] = checkpoint.Checkpoint(ID).get_results("scoring")
+            except Exception:
+                traceback.print_exc()
+        if os.path.exists(ht_store):
+            score_store.ScoreStore(ht_store).export_tsv(score_store.get_summary_file(ht_store))
+        top_fragments = select_top_fragments(ht_scores, top)
     for instruction in list_of_instructions:
         # We will iterate trough all individual instructions of file.
         # SUCCESSIVE GROWING
         if type(instruction) == list:  #  If in the individual instruction we have more than one command means successive growing.
             growing_counter = len(instruction)  #  Doing so we will determinate how many successive growings the user wants to do.
             atomname_mappig = []
+            core_template = None
+            complex_pdb = original_complex_pdb
+            run_root = None
+            if workdir:
+                run_root = folder_handler.check_and_create_run_root(workdir, instruction[0][3].split("/")[-1])
             for i in range(int(growing_counter)):
                 core_from_previous_fragment = instruction[i][-1]
                 fragment_pdb, core_atom, fragment_atom = instruction[i][0], instruction[i][1], instruction[i][2]
@@ -633,7 +1023,7 @@ if __name__ == '__main__':
                 if i == 0:  # In the first iteration we will use the complex_pdb as input.
                     ID = instruction[i][3]
                 else:  # If is not the first we will use as input the output of the previous iteration
-                    complex_pdb = "pregrow/selected_result_{}.pdb".format(ID)
+                    complex_pdb = os.path.join(run_root or "", c.PRE_WORKING_DIR, "selected_result_{}.pdb".format(ID))
                     dict_traceback = correct_fragment_names.main(complex_pdb)
                     ID_completed = []
                     for id in instruction[0:i+1]:
@@ -647,43 +1037,61 @@ if __name__ == '__main__':
                     serie_handler.check_instructions(instruction[i], complex_pdb, c_chain, f_chain)
                     print("PERFORMING SUCCESSIVE GROWING...")
                     print("HYDROGEN ATOMS IN INSTRUCTIONS:  {}    {}".format(h_core, h_frag))
-                    atomname_map = main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criteria, plop_path,
-                         sch_python,pele_dir, contrl, license, resfold, report, traject, pdbout, cpus, distcont,
-                         threshold, epsilon, condition, metricweights, nclusters, pele_eq_steps, restart, min_overlap,
-                         max_overlap, ID, h_core, h_frag, c_chain, f_chain, steps, temperature, seed, rotamers, banned,
-                         limit, mae, rename, threshold_clash, steering, translation_high, rotation_high,
-                         translation_low, rotation_low, explorative, radius_box, sampling_control)
+                    if run_root:
+                        complex_pdb, fragment_pdb = os.path.abspath(complex_pdb), os.path.abspath(fragment_pdb)
+                    grown_fragments = [os.path.abspath(task[0]) for task in instruction[:i + 1]]
+                    with folder_handler.working_directory(run_root), timing.fragment_timer(ID) as timer:
+                        timing_files.append(timer.out_file)
+                        atomname_map = main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criteria,
+                             plop_path, sch_python,pele_dir, contrl, license, resfold, report, traject, pdbout, cpus,
+                             distcont, threshold, epsilon, condition, metricweights, nclusters, pele_eq_steps, restart,
+                             min_overlap, max_overlap, ID, h_core, h_frag, c_chain, f_chain, steps, temperature, seed,
+                             rotamers, banned, limit, mae, rename, threshold_clash, steering, translation_high,
+                             rotation_high, translation_low, rotation_low, explorative, radius_box, sampling_control,
+                             core_template, early_stop, conv_tol, conv_patience, conv_interval, adaptive,
+                             offline=offline, store=store)
+                        # Same features as the cost model computes before the growing: from the original inputs
+                        timer.features.update(cost_model.get_features(original_complex_pdb, grown_fragments, c_chain))
                     atomname_mappig.append(atomname_map)
+                    # The grown ligand will be the core of the next growing, so its template can be reused
+                    core_template = template_cache.get_template_paths(add_fragment_from_pdbs.GROWN_RESNAME)
 
                 except Exception:
+                    core_template = None
                     traceback.print_exc()
         # INDIVIDUAL GROWING
         else:
             # Initialize the growing for each line in the file
-            fragment_pdb, core_atom, fragment_atom, ID = instruction[0], instruction[1], instruction[2], instruction[3]
-            atoms_if_bond = serie_handler.extract_hydrogens_from_instructions([fragment_pdb, core_atom, fragment_atom])
-            try:
-                ID = ID.split("/")[-1]
-            except Exception:
-                traceback.print_exc()
-
-            if atoms_if_bond:
-                core_atom = atoms_if_bond[0]
-                h_core = atoms_if_bond[1]
-                fragment_atom = atoms_if_bond[2]
-                h_frag = atoms_if_bond[3]
-            else:
-                h_core = None
-                h_frag = None
+            fragment_pdb, core_atom, fragment_atom, ID, h_core, h_frag = read_individual_instruction(instruction)
+            if kept_fragments is not None and ID not in kept_fragments:
+                print("SKIPPING {}: DISCARDED BY THE TRIAGE".format(ID))
+                continue
+            if top_fragments is not None and ID not in top_fragments:
+                print("SKIPPING {}: NOT AMONG THE BEST OF THE HIGH-THROUGHPUT TIER".format(ID))
+                continue
+            run_root = None
+            if workdir:
+                run_root = folder_handler.check_and_create_run_root(workdir, ID)
+                fragment_pdb = os.path.abspath(fragment_pdb)
             try:
                 print("PERFORMING INDIVIDUAL GROWING...")
                 print("HYDROGEN ATOMS IN INSTRUCTIONS:  {}    {}".format(h_core, h_frag))
-                main(complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criteria, plop_path, sch_python,
-                     pele_dir, contrl, license, resfold, report, traject, pdbout, cpus, distcont, threshold, epsilon,
-                     condition, metricweights, nclusters, pele_eq_steps, restart, min_overlap, max_overlap, ID, h_core,
-                     h_frag, c_chain, f_chain, steps, temperature, seed, rotamers, banned, limit, mae, rename,
-                     threshold_clash, steering, translation_high, rotation_high,
-                     translation_low, rotation_low, explorative, radius_box, sampling_control)
+                with folder_handler.working_directory(run_root), timing.fragment_timer(ID) as timer:
+                    timing_files.append(timer.out_file)
+                    main(original_complex_pdb, fragment_pdb, core_atom, fragment_atom, iterations, criteria, plop_path,
+                         sch_python, pele_dir, contrl, license, resfold, report, traject, pdbout, cpus, distcont,
+                         threshold, epsilon, condition, metricweights, nclusters, pele_eq_steps, restart, min_overlap,
+                         max_overlap, ID, h_core, h_frag, c_chain, f_chain, steps, temperature, seed, rotamers, banned,
+                         limit, mae, rename, threshold_clash, steering, translation_high, rotation_high,
+                         translation_low, rotation_low, explorative, radius_box, sampling_control, None, early_stop,
+                         conv_tol, conv_patience, conv_interval, adaptive,
+                         reuse_preparation=triage_fragments, template_source=ht_roots.get(ID), offline=offline,
+                         store=store)
+                    timer.features.update(cost_model.get_features(original_complex_pdb, fragment_pdb, c_chain))
             except Exception:
                 traceback.print_exc()
-
+    # The TSV summary is exported once, when all the growings have saved their scores
+    if os.path.exists(store):
+        score_store.ScoreStore(store).export_tsv(score_store.get_summary_file(store))
+    # Where the time of the whole campaign went
+    timing.summarize(timing_files)
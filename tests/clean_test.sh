@@ -1,3 +1,3 @@
 #!/bin/bash
-rm -r growing_results/ sampling_result_* Data* Documents selected_result_* output.log simulation_score_summary.tsv control_folder/ PDBs_growing_* pregrow/ __pycache__/
+rm -r growing_results/ sampling_result_* Data* Documents selected_result_* output.log simulation_score_summary.tsv simulation_score_summary.db control_folder/ PDBs_growing_* pregrow/ __pycache__/ checkpoint_*.json inputs/ offline_runs/
 
@@ -1,6 +1,9 @@
 import pytest
 import subprocess
 import os
+import glob
+import json
+import numpy as np
 
 
 def test_double():
@@ -46,10 +49,523 @@ def test_chainame():
 def test_temperature():
     subprocess.call("bash test_temperature.sh".split())
 
-    with open("control_template.conf", "r") as f:
+    with open("control_folder/1_control_template.conf", "r") as f:
         for line in f.readlines():
             if "temperature" in line:
                 if "100000" in line:
                     assert True
                 else:
                     assert False
+
+def test_offline():
+    subprocess.call("bash test_offline.sh".split())
+    assert glob.glob("selected_result_aminoC1N1/epochsampling_result_aminoC1N1_trajectory_1.*.pdb")
+    with open("checkpoint_aminoC1N1.json") as manifest:
+        assert "growing" in json.load(manifest)["stages"]
+
+def test_offline_workdir():
+    subprocess.call("bash test_offline_workdir.sh".split())
+    run_root = "offline_runs/aminoC1N1"
+    assert glob.glob(os.path.join(run_root, "selected_result_aminoC1N1/epochsampling_result_aminoC1N1_trajectory_1.*.pdb"))
+    assert os.path.exists(os.path.join(run_root, "inputs/complex_1w7h_preparation_structure_2w.pdb"))
+    # The scores of all the run roots are saved in one store, at the top of the workdir
+    assert os.path.exists("offline_runs/simulation_score_summary.tsv")
+    assert not os.path.exists(os.path.join(run_root, "simulation_score_summary.db"))
+
+def test_offline_restart():
+    subprocess.call("bash test_offline_restart.sh".split())
+    # Every step is accepted, so the continued equilibration has steps 0-4 and models 1-5
+    with open("sampling_result_aminoC1N1/report_1") as report:
+        steps = [int(line.split()[1]) for line in report.readlines()[1:]]
+    with open("sampling_result_aminoC1N1/trajectory_1.pdb") as trajectory:
+        models = [int(line.split()[1]) for line in trajectory if line.startswith("MODEL")]
+    assert steps == [0, 1, 2, 3, 4]
+    assert models == [1, 2, 3, 4, 5]
+    assert not os.path.exists("sampling_result_aminoC1N1/continuation")
+
+def write_report(path, rows, header=("#Task", "Step", "numberOfAcceptedPeleSteps", "currentEnergy", "Binding Energy")):
+    separator = "    "
+    with open(path, "w") as report:
+        report.write(separator.join(header) + separator + "\n")
+        for row in rows:
+            report.write(separator + separator.join(str(value) for value in row) + separator + "\n")
+
+def test_streaming_score(tmp_path):
+    from frag_pele.Analysis import analyser
+    rng = np.random.default_rng(0)
+    for trajectory, n_rows in enumerate((250, 1, 777), 1):
+        # Rounded values, so there are ties around the quantile
+        energies = np.round(rng.normal(-40., 5., n_rows), 1)
+        write_report(str(tmp_path / "report_{}".format(trajectory)),
+                     [(1, step, step, -13500., energy) for step, energy in enumerate(energies)])
+    reports = sorted(glob.glob(str(tmp_path / "report_*")))
+    dataframe = analyser.pele_report2pandas(str(tmp_path / "report_"), export=False)
+    for quantile_value in (0.1, 0.25, 0.5):
+        # Small chunks, so the selection buffer is trimmed many times
+        score, sterr = analyser.compute_streaming_score(reports, "Binding Energy", quantile_value, chunk_size=37)
+        assert np.isclose(score, analyser.compute_mean_quantile(dataframe, "Binding Energy", quantile_value))
+        assert np.isclose(sterr, analyser.compute_sterr(dataframe, "Binding Energy", quantile_value))
+    score, sterr = analyser.compute_streaming_score(reports, "Binding Energy", 0.25, steps=100, chunk_size=37)
+    subset = analyser.select_subset_by_steps(dataframe, 100)
+    assert np.isclose(score, analyser.compute_mean_quantile(subset, "Binding Energy", 0.25))
+
+def test_checkpoint_resume(tmp_path):
+    from frag_pele.Helpers import checkpoint
+    manifest_path = str(tmp_path / "checkpoint_test.json")
+    output = tmp_path / "pregrow.pdb"
+    output.write_text("ATOM\n")
+    manifest = checkpoint.Checkpoint("test", manifest_path)
+    for stage in ("pregrow", "templatization", "growing_step_0"):
+        assert not manifest.resume(stage, {"steps": 1})
+        manifest.complete(stage, {"steps": 1}, outputs=[str(output)] if stage == "pregrow" else [], results=stage)
+    # Completed stages are skipped
+    manifest = checkpoint.Checkpoint("test", manifest_path)
+    assert manifest.resume("pregrow", {"steps": 1})
+    assert manifest.get_results("pregrow") == "pregrow"
+    # A stage with different parameters is run again, and so are all the stages after it
+    assert not manifest.resume("templatization", {"steps": 2})
+    assert not manifest.resume("growing_step_0", {"steps": 1})
+    assert set(checkpoint.Checkpoint("test", manifest_path).stages) == {"pregrow"}
+    # Changed outputs invalidate their stage
+    output.write_text("ATOM\nATOM\n")
+    assert not checkpoint.Checkpoint("test", manifest_path).resume("pregrow", {"steps": 1})
+
+def test_merge_continuation(tmp_path):
+    from frag_pele.Helpers import checkpoint
+    def write_trajectory(path, models):
+        with open(path, "w") as trajectory:
+            for model in models:
+                trajectory.write("MODEL     {:4d}\nATOM      1  C1  LIG L   1       0.000   0.000   0.000\nENDMDL\n"
+                                 "".format(model))
+    folder, continuation = tmp_path / "sampling", tmp_path / "sampling" / "continuation"
+    continuation.mkdir(parents=True)
+    # Interrupted after 3 steps (2 accepted), continued for the 3 remaining ones
+    write_report(str(folder / "report_1"), [(1, 0, 0, -1, -1), (1, 1, 1, -1, -2), (1, 3, 2, -1, -3)])
+    write_trajectory(str(folder / "trajectory_1.pdb"), [1, 2, 3])
+    write_report(str(continuation / "report_1"), [(1, 0, 0, -1, -3), (1, 1, 1, -1, -4), (1, 2, 1, -1, -5),
+                                                  (1, 4, 2, -1, -6)])
+    write_trajectory(str(continuation / "trajectory_1.pdb"), [1, 2, 3])
+    completed = checkpoint.get_completed_steps(str(folder))
+    assert completed == {1: (3, 2)}
+    checkpoint.merge_continuation(str(folder), str(continuation), completed, 6)
+    with open(str(folder / "report_1")) as report:
+        rows = [line.split()[1:3] for line in report.readlines()[1:]]
+    with open(str(folder / "trajectory_1.pdb")) as trajectory:
+        models = [int(line.split()[1]) for line in trajectory if line.startswith("MODEL")]
+    # The initial structure of the continuation and the steps beyond the total are dropped
+    assert rows == [["0", "0"], ["1", "1"], ["3", "2"], ["4", "3"], ["5", "3"]]
+    assert models == [1, 2, 3, 4]
+    assert not continuation.exists()
+
+def test_fixed_growing_schedule():
+    from frag_pele.Growing import growing_schedule
+    min_overlap, max_overlap = 0.5, 0.65
+    for iterations in (1, 3, 10):
+        schedule = growing_schedule.GrowingSchedule(iterations)
+        lambdas, overlaps = [], []
+        for i in range(100):
+            if i != 0:
+                # The feedback is ignored by the fixed schedule
+                schedule.advance(acceptance=0.01, spread=100., overlapping=1.)
+            lambdas.append(schedule.lambda_value)
+            overlaps.append(schedule.get_overlapping_factor(min_overlap, max_overlap))
+            if schedule.is_complete():
+                break
+        # Same lambda (template_fragmenter) and overlapping factor as the original growing loop
+        assert len(lambdas) == iterations + 1
+        assert np.allclose(lambdas, [float(i + 1) / (iterations + 1) for i in range(iterations + 1)])
+        assert ["{0:.2f}".format(overlap) for overlap in overlaps] == \
+               ["{0:.2f}".format(min_overlap + (max_overlap - min_overlap) * i / iterations)
+                for i in range(iterations + 1)]
+
+def test_triage_pairs():
+    from frag_pele.Analysis import triage
+    rng = np.random.default_rng(0)
+    receptor = rng.uniform(-30., 30., (5000, 3))
+    for ligand in (rng.normal(0., 3., (40, 3)), rng.normal(25., 3., (10, 3)), np.zeros((1, 3))):
+        ligand_index, receptor_index, distances = triage.get_pairs(ligand, receptor, cutoff=8.)
+        # Brute force: all the pairs of the distance matrix under the cutoff
+        matrix = np.linalg.norm(ligand[:, np.newaxis] - receptor[np.newaxis], axis=-1)
+        expected = set(zip(*np.nonzero(matrix < 8.)))
+        assert set(zip(ligand_index, receptor_index)) == expected
+        assert len(ligand_index) == len(expected)
+        assert np.allclose(distances, matrix[ligand_index, receptor_index])
+    ligand_index, receptor_index, distances = triage.get_pairs(np.zeros((0, 3)), receptor)
+    assert len(ligand_index) == len(receptor_index) == len(distances) == 0
+
+def write_pdb(path, atoms):
+    """
+    :param atoms: list of (chain, resname, atom name, element, x, y, z).
+    """
+    with open(path, "w") as pdb:
+        for n, (chain, resname, name, element, x, y, z) in enumerate(atoms, 1):
+            pdb.write("HETATM{:5d} {:<4s} {:3s} {:1s}{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00          {:>2s}\n"
+                      "".format(n, name, resname, chain, 1, x, y, z, element))
+        pdb.write("END\n")
+
+def test_pack_longest_first():
+    from frag_pele.Helpers import cost_model
+    lanes, loads = cost_model.pack_longest_first([1, 7, 3, 5, 2, 4], 2)
+    assert lanes == [[1, 2, 0], [3, 5, 4]]
+    assert loads == [11, 11]
+    lanes, loads = cost_model.pack_longest_first([3, 3], 4)
+    assert sorted(job for lane in lanes for job in lane) == [0, 1]
+    assert sorted(loads) == [0, 0, 3, 3]
+
+def test_schedule_instructions(tmp_path):
+    from frag_pele.Helpers import cost_model, timing
+    complex_pdb = str(tmp_path / "complex.pdb")
+    write_pdb(complex_pdb, [("A", "ALA", "CA", "C", 10. + 3.8 * n, 0., 0.) for n in range(20)] +
+              [("L", "LIG", "C{}".format(n + 1), "C", 1.5 * n, 0., 0.) for n in range(3)])
+    fragments = {}
+    for name, size in (("small", 2), ("medium", 5), ("big", 9)):
+        fragments[name] = str(tmp_path / "{}.pdb".format(name))
+        # Zig-zag chain of carbons: every inner bond is rotatable
+        write_pdb(fragments[name], [("L", "FRG", "C{}".format(n + 1), "C", 1.5 * n, 0.8 * (n % 2), 5.)
+                                    for n in range(size)])
+    instructions = [(fragments[name], "C1", "C1", name) for name in ("small", "medium", "big")]
+    instructions.append([(fragments["small"], "C1", "C1", "small", None), (fragments["medium"], "C1", "C1", "medium", 1)])
+    assert cost_model.get_features(complex_pdb, fragments["big"]) == \
+           {"ligand_atoms": 12, "rotatable_bonds": 0 + 6 + 1, "receptor_atoms": 20}
+    lanes, loads = cost_model.schedule_instructions(instructions, complex_pdb, 2)
+    # Every growing runs once, the most expensive ones first, and the split does not change between calls
+    assert sorted(map(str, [instruction for lane in lanes for instruction in lane])) == sorted(map(str, instructions))
+    assert [lane[0] for lane in lanes] == [instructions[2], instructions[3]]
+    assert cost_model.schedule_instructions(instructions, complex_pdb, 2) == (lanes, loads)
+    # With enough timed growings, the cost is the fitted one (here, proportional to the ligand atoms)
+    timings = str(tmp_path / timing.TIMINGS_FILE.format("campaign"))
+    with open(timings, "w") as timings_file:
+        for ligand_atoms, rotatable_bonds in ((4, 1), (6, 3), (8, 2), (10, 7), (12, 5), (14, 9)):
+            timings_file.write(json.dumps({"stage": timing.TOTAL_STAGE, "status": "ok", "wall_s": 60. * ligand_atoms,
+                                           "ligand_atoms": ligand_atoms, "rotatable_bonds": rotatable_bonds,
+                                           "receptor_atoms": 20}) + "\n")
+    _, loads = cost_model.schedule_instructions(instructions, complex_pdb, 1, cost_model.find_timing_files(str(tmp_path)))
+    assert np.isclose(loads[0], 60. * (5 + 8 + 12 + (5 + 10)))
+
+def test_report_tailer(tmp_path):
+    from frag_pele.Analysis import convergence
+    report = tmp_path / "report_1"
+    # A multi-byte character before the rows, so byte and character offsets differ
+    write_report(str(report), [(1, 0, 0, -1, -10, 0.1), (1, 1, 1, -1, -11, 0.2)],
+                 header=("#Task", "Step", "numberOfAcceptedPeleSteps", "currentEnergy", "Binding Energy", "RMSD (Å)"))
+    with open(str(report), "ab") as report_file:
+        report_file.write(b"    1    2    2    -1    -1")
+    (tmp_path / "report_2").write_text("#Task    Step    numberOfAcceptedPeleSteps    currentEnergy    Binding Energy")
+    tailer = convergence.ReportTailer(str(tmp_path))
+    # The initial structure and the half-written row are not read
+    assert tailer.read_new_values() == [-11.]
+    with open(str(report), "ab") as report_file:
+        report_file.write(b"2    0.3    \n    1    3    3    -1    -13    0.4    \n")
+    assert tailer.read_new_values() == [-12., -13.]
+    assert tailer.read_new_values() == []
+    write_report(str(tmp_path / "report_2"), [(1, 0, 0, -1, -20), (1, 1, 1, -1, -21)])
+    assert tailer.read_new_values() == [-21.]
+
+def test_score_convergence(tmp_path):
+    from frag_pele.Analysis import convergence
+    rng = np.random.default_rng(0)
+    energies = list(np.round(rng.normal(-40., 2., 251), 1))
+    write_report(str(tmp_path / "report_1"), [(1, step, step, -1, energy) for step, energy in
+                                              enumerate(energies[:151])])
+    watcher = convergence.ScoreConvergence(str(tmp_path), tolerance=1., sem_tolerance=1., patience=2, min_values=100)
+    converged = []
+    for new_rows in ((), (), (), energies[151:201], energies[201:]):
+        with open(str(tmp_path / "report_1"), "a") as report:
+            report.write("".join("    1    0    0    -1    {}    \n".format(energy) for energy in new_rows))
+        watcher.update()
+        converged.append(watcher.converged())
+    # Not before patience + 1 checks, and never while no new values are read
+    assert converged == [False, False, False, False, True]
+    values = np.array(energies[1:])
+    subset = values[values < np.quantile(values, 0.25)]
+    assert np.isclose(watcher.history[-1][1], subset.mean())
+    assert np.isclose(watcher.history[-1][2], subset.std(ddof=1) / np.sqrt(len(subset)))
+    watcher.min_values = 1000
+    assert not watcher.converged()
+
+def test_trim_outputs(tmp_path):
+    from frag_pele.Analysis import convergence
+    def write_trajectory(path, models, last_closed=True):
+        with open(path, "w") as trajectory:
+            for model in models:
+                trajectory.write("MODEL     {:4d}\nATOM      1  C1  LIG L   1       0.000   0.000   0.000\n"
+                                 "".format(model))
+                if model != models[-1] or last_closed:
+                    trajectory.write("ENDMDL\n")
+    # Stopped while writing the model 4 and the row of step 5
+    write_report(str(tmp_path / "report_1"), [(1, 0, 0, -1, -1), (1, 1, 1, -1, -2), (1, 2, 1, -1, -3),
+                                              (1, 3, 2, -1, -4), (1, 4, 3, -1, -5)])
+    with open(str(tmp_path / "report_1"), "a") as report:
+        report.write("    1    5    4")
+    write_trajectory(str(tmp_path / "trajectory_1.pdb"), [1, 2, 3, 4], last_closed=False)
+    # Models written after the last row of the report
+    write_report(str(tmp_path / "report_2"), [(1, 0, 0, -1, -1), (1, 1, 1, -1, -2)])
+    write_trajectory(str(tmp_path / "trajectory_2.pdb"), [1, 2, 3, 4])
+    convergence.trim_outputs(str(tmp_path))
+    for number, steps, models in ((1, [0, 1, 2, 3], [1, 2, 3]), (2, [0, 1], [1, 2])):
+        with open(str(tmp_path / "report_{}".format(number))) as report:
+            assert [int(line.split()[1]) for line in report.readlines()[1:]] == steps
+        with open(str(tmp_path / "trajectory_{}.pdb".format(number))) as trajectory:
+            content = trajectory.read()
+        assert [int(line.split()[1]) for line in content.splitlines() if line.startswith("MODEL")] == models
+        assert content.endswith("ENDMDL\n")
+
+def test_run_watched():
+    import sys
+    import time
+    from frag_pele.Growing import simulations_linker
+    class Watcher(object):
+        def __init__(self, polls):
+            self.polls = polls
+            self.updates = 0
+        def update(self):
+            self.updates += 1
+        def converged(self):
+            return self.updates >= self.polls
+    # Stopped once converged, long before its end
+    watcher = Watcher(2)
+    start = time.time()
+    assert simulations_linker.run_watched([sys.executable, "-c", "import time; time.sleep(60)"], watcher,
+                                          poll_interval=0.1, stop_timeout=5)
+    assert time.time() - start < 30
+    assert watcher.updates == 2
+    # Finished by itself: the last rows are still read
+    watcher = Watcher(100)
+    assert not simulations_linker.run_watched([sys.executable, "-c", "pass"], watcher, poll_interval=30)
+    assert watcher.updates == 1
+
+def test_bootstrap_score(tmp_path):
+    from frag_pele.Analysis import bootstrap_score
+    rng = np.random.default_rng(0)
+    for trajectory in range(1, 5):
+        # Strongly correlated consecutive steps, as in a PELE trajectory
+        energies = [-40.]
+        for step in range(400):
+            energies.append(-40. + 0.95 * (energies[-1] + 40.) + rng.normal(0., 1.))
+        write_report(str(tmp_path / "report_{}".format(trajectory)),
+                     [(1, step, step, -1, energy) for step, energy in enumerate(energies)])
+    score, ci_low, ci_high = bootstrap_score.compute_confidence_interval(str(tmp_path), resamples=500, seed=7)
+    values = np.concatenate(bootstrap_score.read_trajectory_values(str(tmp_path)))
+    assert np.isclose(score, values[values < np.quantile(values, 0.25)].mean())
+    assert ci_low <= score <= ci_high
+    assert bootstrap_score.compute_confidence_interval(str(tmp_path), resamples=500, seed=7) == (score, ci_low, ci_high)
+    assert bootstrap_score.compute_confidence_interval(str(tmp_path), resamples=500, seed=8) != (score, ci_low, ci_high)
+    # Resampling the steps one by one ignores their correlation and gives a narrower interval
+    _, iid_low, iid_high = bootstrap_score.compute_confidence_interval(str(tmp_path), resamples=500, seed=7,
+                                                                       block_size=1)
+    assert iid_high - iid_low < ci_high - ci_low
+
+def write_models(path, models, header=""):
+    """
+    :param models: list of models, each one a list of (record, chain, resname, resnum, atom name, element, x, y, z).
+    """
+    with open(path, "w") as pdb:
+        pdb.write(header)
+        for number, atoms in enumerate(models, 1):
+            pdb.write("MODEL     {:4d}\n".format(number))
+            for n, (record, chain, resname, resnum, name, element, x, y, z) in enumerate(atoms, 1):
+                pdb.write("{:<6s}{:5d} {:<4s} {:3s} {:1s}{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00          {:>2s}\n"
+                          "".format(record, n, name, resname, chain, resnum, x, y, z, element))
+            pdb.write("ENDMDL\n")
+        pdb.write("END\n")
+
+def superimpose(mobile, fixed):
+    """
+    Brute force, one frame at a time: optimal rotation (without reflections) and translation of mobile onto fixed.
+    :return: function that applies the transformation to any coordinates of the frame.
+    """
+    mobile_center, fixed_center = mobile.mean(axis=0), fixed.mean(axis=0)
+    u, _, vt = np.linalg.svd(np.dot((mobile - mobile_center).T, fixed - fixed_center))
+    rotation = np.dot(np.dot(u, np.diag([1., 1., np.sign(np.linalg.det(np.dot(u, vt)))])), vt)
+    return lambda coordinates: np.dot(coordinates - mobile_center, rotation) + fixed_center
+
+def random_frames(rng, reference, n_frames, noise=0.3):
+    """
+    Randomly rotated, translated and perturbed copies of the reference.
+    """
+    frames = []
+    for _ in range(n_frames):
+        rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        frames.append(np.dot(reference, rotation) + rng.normal(0., 5., 3) + rng.normal(0., noise, reference.shape))
+    return np.array(frames)
+
+def test_rmsd_computer(tmp_path):
+    import pandas as pd
+    from frag_pele.Analysis import rmsd_computer
+    rng = np.random.default_rng(0)
+    reference = rng.normal(0., 3., (12, 3))
+    # The last frame is the mirror image of the reference, which can not be superimposed by a rotation
+    frames = np.concatenate([random_frames(rng, reference, 5), [reference * [-1., 1., 1.]]])
+    expected = [np.sqrt(np.mean(np.sum((superimpose(frame, reference)(frame) - reference) ** 2, axis=1)))
+                for frame in frames]
+    assert np.allclose(rmsd_computer.compute_rmsd(frames, reference), expected)
+    # Backbone stored in a different order in the reference
+    backbone, reference_backbone = np.arange(0, 12, 2), np.arange(0, 12, 2)[::-1]
+    superimposed = rmsd_computer.superimpose_backbones(frames, reference[::-1], backbone, reference_backbone)
+    for frame, result in zip(frames, superimposed):
+        assert np.allclose(result, superimpose(frame[backbone], reference[::-1][reference_backbone])(frame))
+    # Trajectories with a receptor atom before the ligand, and the summary rows (in any order) of their reports
+    def atoms(coordinates):
+        return [("ATOM", "A", "ALA", 1, "CA", "C", 9., 9., 9.)] + \
+               [("HETATM", "L", "GRW", 900, "C{}".format(n + 1), "C", x, y, z) for n, (x, y, z) in
+                enumerate(coordinates)]
+    write_models(str(tmp_path / "reference.pdb"), [atoms(reference)])
+    # A different noise in each frame, so a frame merged with the wrong row is noticed
+    trajectories = {1: np.concatenate([random_frames(rng, reference, 1, noise) for noise in (0.1, 0.4, 0.7)]),
+                    2: np.concatenate([random_frames(rng, reference, 1, noise) for noise in (1., 1.3)])}
+    for processor, trajectory in trajectories.items():
+        write_models(str(tmp_path / "trajectory_{}.pdb".format(processor)), [atoms(frame) for frame in trajectory])
+    (tmp_path / "summary").mkdir()
+    rows = [(2, 1), (1, 0), (1, 2), (2, 0), (1, 1), (2, 5)]
+    summary = pd.DataFrame({"Processor": [processor for processor, _ in rows], "Binding Energy": -1.,
+                            "rmsd": 99.}, index=[model for _, model in rows])
+    summary.to_csv(str(tmp_path / "summary" / "summary_report_1.csv"))
+    rmsd_computer.compute_rmsd_in_serie(str(tmp_path / "reference.pdb"), str(tmp_path))
+    result = pd.read_csv(str(tmp_path / "summary" / "summary_report_1.csv"))
+    assert len(result) == len(rows)
+    for (processor, model), rmsd in zip(rows, result["rmsd"]):
+        if model >= len(trajectories[processor]):
+            assert np.isnan(rmsd)
+            continue
+        # As written in the PDB files
+        frame, fixed = np.round(trajectories[processor][model], 3), np.round(reference, 3)
+        # In nm, as mdtraj
+        expected = np.sqrt(np.mean(np.sum((superimpose(frame, fixed)(frame) - fixed) ** 2, axis=1))) / 10.
+        assert np.isclose(rmsd, expected)
+
+def test_interaction_fingerprints(tmp_path):
+    from frag_pele.Analysis import interaction_fingerprints
+    rng = np.random.default_rng(0)
+    # Two residues, a water and an ion (not counted), and a ligand with a hydrogen
+    topology = [("ATOM", "A", "ALA", 1, "N", "N"), ("ATOM", "A", "ALA", 1, "CA", "C"), ("ATOM", "A", "GLY", 2, "CA", "C"),
+                ("HETATM", "W", "HOH", 3, "O", "O"), ("HETATM", "A", "MG", 4, "MG", "MG"),
+                ("HETATM", "L", "GRW", 900, "C1", "C"), ("HETATM", "L", "GRW", 900, "C2", "C"),
+                ("HETATM", "L", "GRW", 900, "H1", "H")]
+    frames = rng.uniform(0., 7., (2, len(topology), 3))
+    write_models(str(tmp_path / "trajectory_1.pdb"), [[atom + tuple(coordinates) for atom, coordinates in
+                                                       zip(topology, frame)] for frame in frames])
+    residues = [[0, 1], [2], [3]]
+    for addh, ligand in ((False, [5, 6]), (True, [5, 6, 7])):
+        matrix, ligand_names, residue_labels = interaction_fingerprints.compute_fingerprints(
+            str(tmp_path / "trajectory_1.pdb"), distance=4., addh=addh)
+        assert ligand_names == [topology[n][4] for n in ligand]
+        assert residue_labels == ["1ALA", "2GLY", "3HOH"]
+        # Brute force: all the distances between each ligand atom and the atoms of each residue
+        frames_written = np.round(frames, 3)
+        expected = np.array([[np.any(np.linalg.norm(frame[residue] - frame[atom], axis=1) <= 4.)
+                              for atom in ligand for residue in residues] for frame in frames_written])
+        assert expected.any() and not expected.all()
+        assert matrix.shape == expected.shape
+        assert np.array_equal(matrix.toarray(), expected)
+        _, summary = interaction_fingerprints.compute_contact_frequencies(str(tmp_path), addh=addh)
+        frequencies = {(row.ligand_atom, row.residue): row.frequency for row in summary.itertuples()}
+        assert frequencies == {(ligand_names[n // 3], residue_labels[n % 3]): frequency
+                               for n, frequency in enumerate(expected.mean(axis=0)) if frequency}
+
+def test_sidechains_analyser(tmp_path):
+    from frag_pele.Analysis import sidecahins_analyser
+    rng = np.random.default_rng(0)
+    residues = [(1, "ALA", ("N", "CA", "C", "O", "CB")), (2, "SER", ("N", "CA", "C", "O", "CB", "OG", "HG")),
+                (3, "GLY", ("N", "CA", "C", "O"))]
+    topology = [("ATOM", "A", resname, resnum, name, name[0]) for resnum, resname, names in residues for name in names]
+    topology += [("HETATM", "L", "GRW", 900, name, "C") for name in ("C1", "C2")]
+    reference = rng.uniform(0., 10., (len(topology), 3))
+    # The target has its atoms in another order, and three models
+    order = rng.permutation(len(topology))
+    frames = random_frames(rng, reference, 3, noise=0.5)[:, order]
+    write_models(str(tmp_path / "reference.pdb"), [[atom + tuple(xyz) for atom, xyz in zip(topology, reference)]])
+    write_models(str(tmp_path / "target.pdb"), [[topology[n] + tuple(xyz) for n, xyz in zip(order, frame)]
+                                                for frame in frames])
+    reference, frames = np.round(reference, 3), np.round(frames, 3)
+    (tmp_path / "residues.txt").write_text("1\n2\n")
+    results = sidecahins_analyser.sidechains_rmsd_calculator(str(tmp_path / "target.pdb"), str(tmp_path / "reference.pdb"),
+                                                              str(tmp_path / "residues.txt"),
+                                                              write2report=str(tmp_path / "report_rmsd.txt"))
+    # Brute force: superimpose the backbones of each model and loop over the heavy atoms of each residue
+    position = {(topology[n][3], topology[n][4]): k for k, n in enumerate(order)}
+    backbone = [n for n, atom in enumerate(topology) if atom[0] == "ATOM" and atom[4] in ("N", "CA", "C", "O")]
+    expected = []
+    for frame_number, frame in enumerate(frames):
+        transform = superimpose(frame[[position[topology[n][3:5]] for n in backbone]], reference[backbone])
+        superimposed = transform(frame)
+        for resnum, resname, names in residues[:2]:
+            squared = []
+            for name in names:
+                if name.startswith("H"):
+                    continue
+                n = topology.index(("ATOM", "A", resname, resnum, name, name[0]))
+                squared.append(np.sum((superimposed[position[(resnum, name)]] - reference[n]) ** 2))
+                if name == "CA":
+                    ca_shift = np.sqrt(squared[-1])
+            expected.append((frame_number, resnum, resname, np.sqrt(np.mean(squared)), ca_shift))
+    assert [result[:3] for result in results] == [result[:3] for result in expected]
+    assert np.allclose([result[3:] for result in results], [result[3:] for result in expected])
+    assert len((tmp_path / "report_rmsd.txt").read_text().splitlines()) == len(expected)
+    # Per-residue reduction of contiguous residues, against an explicit loop
+    coordinates, fixed = rng.normal(size=(4, 9, 3)), rng.normal(size=(9, 3))
+    offsets, ca_positions = np.array([0, 2, 7]), np.array([1, 3, 8])
+    rmsds, ca_shifts = sidecahins_analyser.compute_residue_rmsds(coordinates, fixed, offsets, ca_positions)
+    bounds = list(offsets) + [9]
+    for frame in range(4):
+        for residue in range(3):
+            atoms = range(bounds[residue], bounds[residue + 1])
+            assert np.isclose(rmsds[frame, residue], np.sqrt(np.mean([np.sum((coordinates[frame, n] - fixed[n]) ** 2)
+                                                                      for n in atoms])))
+            assert np.isclose(ca_shifts[frame, residue],
+                              np.linalg.norm(coordinates[frame, ca_positions[residue]] - fixed[ca_positions[residue]]))
+    # Distances between ligand and residue atoms (or their centers) in each model
+    (tmp_path / "distances.txt").write_text("1 C1 CB\n2 [C1,C2] [OG,CB]\n")
+    report = sidecahins_analyser.compute_atom_distances(str(tmp_path / "target.pdb"), str(tmp_path / "distances.txt"),
+                                                        str(tmp_path / "report_distances.txt"))
+    distances = [float(line.split()[-1]) for line in report.splitlines()]
+    expected = []
+    for frame in frames:
+        expected.append(np.linalg.norm(frame[position[(900, "C1")]] - frame[position[(1, "CB")]]))
+        expected.append(np.linalg.norm(frame[[position[(900, "C1")], position[(900, "C2")]]].mean(axis=0) -
+                                       frame[[position[(2, "OG")], position[(2, "CB")]]].mean(axis=0)))
+    assert np.allclose(distances, expected, atol=1e-3)
+
+def test_backtrack_pathway(tmp_path, monkeypatch):
+    from ast import literal_eval
+    from frag_pele.Analysis import backtrackFragTrajectory
+    monkeypatch.chdir(tmp_path)
+    trajectories = []
+    def write_trajectory(path, n_models):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        trajectories.append(path)
+        # Each model is identified by the coordinates of its atom: trajectory and model
+        write_models(path, [[("HETATM", "L", "GRW", 900, "C1", "C", len(trajectories), model, 0.)]
+                            for model in range(n_models)], header="REMARK header before the first model\n")
+    for n in range(2):
+        for trajectory in (1, 2):
+            write_trajectory("growing_results/ID_growing_output{}/trajectory_{}.pdb".format(n, trajectory), 4 + n)
+    # The second trajectory spawned from a snapshot beyond the end of its origin
+    with open("growing_results/ID_growing_output0/processorMapping.txt", "w") as mapping:
+        mapping.write("(0, 1, 0):(0, 1, 0)")
+    with open("growing_results/ID_growing_output1/processorMapping.txt", "w") as mapping:
+        mapping.write("(0, 2, 1):(0, 1, 9)")
+    for trajectory in (1, 2):
+        write_trajectory("sampling_result_ID/trajectory_{}.pdb".format(trajectory), 5)
+    for trajectory, snapshot in ((1, 3), (2, 4)):
+        selected = "selected_result_ID/epochsampling_result_ID_trajectory_{}.{}_BindingEnergy-40.pdb".format(
+            trajectory, snapshot)
+        out_file = backtrackFragTrajectory.main(selected, "growing_results", "out", "pathway.pdb")
+        # Baseline: the models are the pieces between ENDMDL (AdaptivePELE getSnapshots), sliced for each step
+        def get_snapshots(path):
+            with open(path) as trajectory_file:
+                return trajectory_file.read().split("ENDMDL")[:-1]
+        expected = get_snapshots("sampling_result_ID/trajectory_{}.pdb".format(trajectory))[1:snapshot + 1]
+        for n in (1, 0):
+            with open("growing_results/ID_growing_output{}/processorMapping.txt".format(n)) as mapping:
+                _, trajectory, snapshot = literal_eval(mapping.read().split(":")[trajectory - 1])
+            expected = get_snapshots("growing_results/ID_growing_output{}/trajectory_{}.pdb".format(n, trajectory))[
+                       (0 if n == 0 else 1):snapshot + 1] + expected
+        written = get_snapshots(out_file)
+        assert [model.strip() for model in written] == [model.strip() for model in expected]
+        assert written[0].startswith("REMARK header")
+    # Offsets of the models, the header being part of the first one
+    with open("sampling_result_ID/trajectory_1.pdb", "rb") as trajectory_file:
+        content = trajectory_file.read()
+    offsets = backtrackFragTrajectory.index_models("sampling_result_ID/trajectory_1.pdb")
+    assert offsets[0] == 0 and len(offsets) == 6
+    assert all(content[:offset].endswith(b"ENDMDL\n") for offset in offsets[1:])
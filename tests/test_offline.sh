@@ -0,0 +1,4 @@
+#!/bin/bash
+# Stand-ins of PELE and PlopRotTemp: no PELE, license or Schrodinger needed
+export FAKE_PELE_ACCEPTANCE=1
+python -m frag_pele.main -cp 1w7h_preparation_structure_2w.pdb -sef serie_file.conf -x 1 --steps 1 -es 2 --cpus 2 --offline